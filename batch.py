@@ -0,0 +1,213 @@
+# Batch balance runner for the 2D Cave Shooter
+# Plays many headless, seeded games with simple bots, one game per
+# job on a pool of worker processes (one per core by default), and
+# prints a table of how each parameter set did.
+#
+#   python batch.py                                  every policy, 20 seeds
+#   python batch.py --gun Shotgun --clip 6,8,10      try three clip sizes
+#   python batch.py --enemy-speed 80,100 --enemy-health 5,8 --seeds 50
+#   python batch.py --swarm --minutes 5 --csv results.csv
+#
+# Comma-separated values are crossed with each other, so
+# "--clip 6,8 --cooldown 600,800" runs 4 parameter sets.
+
+import argparse
+import csv
+import itertools
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import main as game
+
+GUNS = {cls.name: cls for cls in (game.Handgun, game.AssaultRifle, game.Shotgun)}
+KITE_RANGE = 350  # Kiting bot backs off from enemies closer than this
+EDGE_MARGIN = 150  # ...and steers back toward the middle this close to a wall
+
+# --- Bot policies ---
+def nearest_enemy(pos):
+    """
+    Center of the enemy nearest to pos, or None if there are none.
+    """
+    if game.swarm is not None:
+        n = len(game.swarm)
+        if n == 0:
+            return None
+        centers = game.swarm.pos[:n] + (game.swarm.width / 2, game.swarm.height / 2)
+        dist = ((centers - (pos.x, pos.y)) ** 2).sum(axis=1)
+        return game.vector(*centers[dist.argmin()])
+    best = min(game.enemies, default=None,
+               key=lambda e: pos.distance_squared_to(e.rect.center))
+    return game.vector(best.rect.center) if best else None
+
+def aim_and_fire(controls, player, target):
+    """
+    Points the cursor at target and fires, reloading on empty.
+    """
+    gun = player.gun
+    if gun.ammo == 0:
+        controls.reload = True
+    if target is not None:
+        controls.cursor = game.SCREEN_CENTER + (target - player.pos)
+        controls.fire = True
+
+def stand_and_shoot(tick):
+    """
+    Never moves: turns to the nearest enemy and holds the trigger.
+    """
+    controls = game.Controls()
+    aim_and_fire(controls, game.player, nearest_enemy(game.player.pos))
+    return controls
+
+def kite(tick):
+    """
+    Shoots the nearest enemy while backing away from it when it
+    gets within KITE_RANGE, circling otherwise, and turning back
+    toward the middle of the map near a wall.
+    """
+    player = game.player
+    target = nearest_enemy(player.pos)
+    controls = game.Controls()
+    aim_and_fire(controls, player, target)
+    if target is None:
+        return controls
+    away = player.pos - target
+    if away.length_squared() == 0:
+        away = game.vector(1, 0)
+    move = away if away.length() < KITE_RANGE else away.rotate(90)
+    if player.pos.x < EDGE_MARGIN or player.pos.x > game.MAP_WIDTH - EDGE_MARGIN:
+        move.x = game.MAP_WIDTH / 2 - player.pos.x
+    if player.pos.y < EDGE_MARGIN or player.pos.y > game.MAP_HEIGHT - EDGE_MARGIN:
+        move.y = game.MAP_HEIGHT / 2 - player.pos.y
+    move.scale_to_length(1)
+    controls.left, controls.right = move.x < -0.38, move.x > 0.38
+    controls.up, controls.down = move.y < -0.38, move.y > 0.38
+    return controls
+
+POLICIES = {"kite": kite, "stand": stand_and_shoot}
+
+# --- Jobs ---
+def play(job):
+    """
+    Plays one game for a job dict and returns its results.
+    Runs inside a worker process.
+    """
+    rules = dict(game.WAVE_RULES, enemy_speed=job["enemy_speed"],
+                 enemy_health=job["enemy_health"])
+    game.new_game(job["seed"], rules, swarm_mode=job["swarm"])
+    player = game.player
+    player.equip(next(slot for slot, gun in player.inventory.items()
+                      if gun.name == job["gun"]))
+    gun = player.gun
+    if job["clip"] is not None:
+        gun.clip_size = gun.ammo = job["clip"]
+    if job["cooldown"] is not None:
+        gun.cooldown = job["cooldown"]
+    start = time.perf_counter()
+    ticks = game.run_headless(job["ticks"], script=POLICIES[job["policy"]])
+    elapsed = time.perf_counter() - start
+    spawner = game.spawner
+    cleared = spawner.queued == 0 and game.enemy_count() == 0
+    return dict(job,
+                waves=spawner.wave if cleared else spawner.wave - 1,
+                score=game.score,
+                damage=player.max_health - max(player.health, 0),
+                died=not game.game_running,
+                ticks_run=ticks,
+                ticks_per_sec=ticks / elapsed)
+
+def make_jobs(args):
+    """
+    One job per parameter set per seed, crossing every list given.
+    """
+    def values(text, kind=int):
+        return [None] if text is None else [kind(v) for v in text.split(",")]
+    ticks = int(args.minutes * 60 * game.SIM_HZ)
+    grid = itertools.product(
+        args.policy.split(","), args.gun.split(","), values(args.clip),
+        values(args.cooldown), values(args.enemy_speed, float),
+        values(args.enemy_health), range(args.seed, args.seed + args.seeds))
+    return [dict(policy=policy, gun=gun, clip=clip, cooldown=cooldown,
+                 enemy_speed=speed if speed is not None else game.WAVE_RULES["enemy_speed"],
+                 enemy_health=health if health is not None else game.WAVE_RULES["enemy_health"],
+                 seed=seed, ticks=ticks, swarm=args.swarm)
+            for policy, gun, clip, cooldown, speed, health, seed in grid]
+
+PARAMS = ("policy", "gun", "clip", "cooldown", "enemy_speed", "enemy_health")
+
+def summarize(results):
+    """
+    Averages the results of every seed of each parameter set.
+    """
+    groups = {}
+    for r in results:
+        groups.setdefault(tuple(r[p] for p in PARAMS), []).append(r)
+    rows = []
+    for key, runs in groups.items():
+        n = len(runs)
+        rows.append(dict(zip(PARAMS, key), games=n,
+                         waves=sum(r["waves"] for r in runs) / n,
+                         score=sum(r["score"] for r in runs) / n,
+                         damage=sum(r["damage"] for r in runs) / n,
+                         deaths=100 * sum(r["died"] for r in runs) / n,
+                         ticks_per_sec=sum(r["ticks_run"] for r in runs) /
+                                       sum(r["ticks_run"] / r["ticks_per_sec"] for r in runs)))
+    return rows
+
+def print_table(rows):
+    print(f"{'policy':<7} {'gun':<8} {'clip':>5} {'cd ms':>6} {'speed':>6} {'hp':>4} "
+          f"{'games':>6} {'waves':>6} {'score':>7} {'damage':>7} {'died %':>7} {'ticks/s':>8}")
+    for r in rows:
+        clip = "-" if r["clip"] is None else r["clip"]
+        cooldown = "-" if r["cooldown"] is None else r["cooldown"]
+        print(f"{r['policy']:<7} {r['gun']:<8} {clip:>5} {cooldown:>6} "
+              f"{r['enemy_speed']:>6.0f} {r['enemy_health']:>4} {r['games']:>6} "
+              f"{r['waves']:>6.2f} {r['score']:>7.1f} {r['damage']:>7.1f} "
+              f"{r['deaths']:>7.1f} {r['ticks_per_sec']:>8.0f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless balance runs on every core")
+    parser.add_argument("--policy", default="kite,stand", help="bots: " + ",".join(POLICIES))
+    parser.add_argument("--gun", default="Rifle", help="guns: " + ",".join(GUNS))
+    parser.add_argument("--clip", help="clip sizes (default: the gun's own)")
+    parser.add_argument("--cooldown", help="shot cooldowns in ms (default: the gun's own)")
+    parser.add_argument("--enemy-speed", help="enemy speeds in pixels/s")
+    parser.add_argument("--enemy-health", help="enemy health values")
+    parser.add_argument("--seeds", type=int, default=20, help="games per parameter set")
+    parser.add_argument("--seed", type=int, default=0, help="first seed")
+    parser.add_argument("--minutes", type=float, default=2, help="game time limit per game")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument("--csv", help="also write every game's results to this file")
+    parser.add_argument("--swarm", action="store_true", help="use the NumPy swarm engine")
+    args = parser.parse_args()
+    for name in args.policy.split(","):
+        if name not in POLICIES:
+            sys.exit(f"unknown policy {name!r}, pick from {', '.join(POLICIES)}")
+    for name in args.gun.split(","):
+        if name not in GUNS:
+            sys.exit(f"unknown gun {name!r}, pick from {', '.join(GUNS)}")
+
+    jobs = make_jobs(args)
+    print(f"{len(jobs)} games on {args.workers} workers, "
+          f"up to {args.minutes:g} min of game time each")
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        chunk = max(1, math.ceil(len(jobs) / (args.workers * 4)))
+        results = list(pool.map(play, jobs, chunksize=chunk))
+    elapsed = time.perf_counter() - start
+    print_table(summarize(results))
+    total = sum(r["ticks_run"] for r in results)
+    print(f"{total} ticks in {elapsed:.1f} s ({total / elapsed:.0f} ticks/s across all workers)")
+    if args.csv:
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(results[0]))
+            writer.writeheader()
+            writer.writerows(results)
+
+if __name__ == "__main__":
+    main()
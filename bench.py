@@ -0,0 +1,378 @@
+# Benchmarks for the 2D Cave Shooter
+# Runs the game headless (SDL dummy driver, no window or GPU needed)
+# from a fixed input script and a seeded random, so numbers from
+# different machines/commits are comparable.
+#
+#   python bench.py                  waves 1-20 on the sprite engine
+#   python bench.py --swarm          same on the NumPy swarm engine
+#   python bench.py --render         include drawing each tick
+#   python bench.py --waves 5-10 --ticks 500
+#   python bench.py --engines        sprite vs swarm ms/frame by enemy count
+#   python bench.py --flow           flow field rebuild time by map size
+#   python bench.py --startup        launch to first frame, cold vs warm asset cache
+#   python bench.py --effects        effect drawing cost by simultaneous enemy deaths
+#   python bench.py --saves          check saving runs doesn't worsen frame times
+#   python bench.py --scaling        swarm ticks/s by worker processes, 10k-100k enemies
+
+import argparse
+import math
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import main as game
+
+def wave_size(wave):
+    """
+    Number of enemies the game spawns for a given wave.
+    """
+    return game.WaveSpawner().wave_size(wave)
+
+def percentile(sorted_values, pct):
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * pct / 100))
+    return sorted_values[index]
+
+def start_wave(wave, seed, swarm):
+    """
+    Resets the game and jumps straight to the given wave with an
+    unkillable player, so every wave runs for the full tick count.
+    The whole wave is spawned up front, ignoring the spawn budget
+    and alive cap, so each row measures that many enemies.
+    swarm: run it on the NumPy swarm engine
+    """
+    game.new_game(seed, swarm_mode=swarm)
+    game.clear_enemies()
+    spawner = game.spawner
+    spawner.queued = 0
+    spawner.start_wave(wave)
+    spawner.spawn(spawner.queued, game.player.pos)
+    game.player.max_health = game.player.health = 10 ** 9
+
+def bench_wave(wave, ticks, seed, render, alloc_ticks, swarm):
+    """
+    Times every tick of one wave. Returns a dict with ticks/sec,
+    p50/p99 frame time (ms) and transient KiB allocated per tick.
+    """
+    start_wave(wave, seed, swarm)
+    stamps = [time.perf_counter()]
+    game.run_headless(ticks, seed, render=render,
+                      on_tick=lambda tick: stamps.append(time.perf_counter()))
+    frames = sorted(b - a for a, b in zip(stamps, stamps[1:]))
+
+    # Allocations are measured in a second, shorter pass because
+    # tracemalloc slows everything down
+    start_wave(wave, seed, swarm)
+    allocated = []
+    def measure(tick):
+        current, peak = tracemalloc.get_traced_memory()
+        allocated.append(peak - measure.base)
+        tracemalloc.reset_peak()
+        measure.base = tracemalloc.get_traced_memory()[0]
+    tracemalloc.start()
+    measure.base = tracemalloc.get_traced_memory()[0]
+    game.run_headless(alloc_ticks, seed, render=render, on_tick=measure)
+    tracemalloc.stop()
+
+    return {
+        "enemies": wave_size(wave),
+        "ticks_per_sec": len(frames) / sum(frames),
+        "p50": percentile(frames, 50) * 1000,
+        "p99": percentile(frames, 99) * 1000,
+        "alloc_kib": sum(allocated) / len(allocated) / 1024,
+    }
+
+def run_suite(first, last, ticks, seed, render, alloc_ticks, swarm):
+    engine = "swarm" if swarm else "sprites"
+    print(f"engine={engine} render={render} ticks/wave={ticks} seed={seed}")
+    print(f"{'wave':>4} {'enemies':>8} {'ticks/s':>9} {'p50 ms':>8} "
+          f"{'p99 ms':>8} {'alloc KiB/tick':>15}")
+    for wave in range(first, last + 1):
+        r = bench_wave(wave, ticks, seed, render, alloc_ticks, swarm)
+        print(f"{wave:>4} {r['enemies']:>8} {r['ticks_per_sec']:>9.0f} "
+              f"{r['p50']:>8.2f} {r['p99']:>8.2f} {r['alloc_kib']:>15.1f}")
+
+def bench_engines(counts=(100, 500, 1000, 2000, 5000, 10000), frames=60):
+    """
+    Compares the sprite and swarm engines on enemy movement +
+    bullet hits alone, printing average ms per frame.
+    """
+    if game.np is None:
+        sys.exit("--engines needs NumPy (pip install numpy)")
+    game.new_game(0)
+    rng = random.Random(1010)
+    print(f"{'enemies':>8} {'sprites ms':>11} {'swarm ms':>9}")
+    for count in counts:
+        timings = []
+        for engine in ("sprites", "swarm"):
+            game.clear_enemies()
+            random.seed(count)
+            game.swarm = game.EnemySwarm() if engine == "swarm" else None
+            spawner = game.WaveSpawner()
+            spawner.start_wave(1)
+            spawner.queued = count
+            spawner.spawn(count, game.player.pos)
+            start = time.perf_counter()
+            for _ in range(frames):
+                # A handful of bullets scattered over the map each frame
+                for _ in range(20):
+                    pos = (rng.randint(0, game.MAP_WIDTH), rng.randint(0, game.MAP_HEIGHT))
+                    game.bullet_group.fire(pos, (1, 0))
+                if game.swarm is not None:
+                    game.swarm.update(game.SIM_DT, game.player.pos)
+                else:
+                    game.enemies.update(game.SIM_DT, None)
+                game.bullet_group.hit_enemies()
+                game.bullet_group.clear()
+            timings.append((time.perf_counter() - start) * 1000 / frames)
+        game.clear_enemies()
+        print(f"{count:>8} {timings[0]:>11.2f} {timings[1]:>9.2f}")
+
+def bench_flow(sizes=(1000, 2000, 5000, 10000, 20000), obstacles=0.1, repeats=3):
+    """
+    Times a full flow field rebuild for square maps of each size,
+    on open ground and with a share of the cells walled off.
+    "searched" is how many cells the search around the player
+    reached on open ground (the rest of the map is never visited).
+    """
+    rng = random.Random(1010)
+    print(f"{'map':>12} {'cells':>8} {'searched':>9} {'open ms':>8} {'walls ms':>9} {'ticks':>6}")
+    for size in sizes:
+        timings = []
+        for share in (0, obstacles):
+            field = game.FlowField(size, size)
+            cell = field.cell_size
+            for _ in range(int(field.cells * share)):
+                x, y = rng.randrange(size), rng.randrange(size)
+                field.block(game.pygame.Rect(x, y, cell, cell))
+            best = math.inf
+            for _ in range(repeats):
+                start = time.perf_counter()
+                field.reset((size / 2, size / 2))
+                best = min(best, time.perf_counter() - start)
+            timings.append(best * 1000)
+            if not share:
+                searched = field.searched
+        # Sim ticks an incremental rebuild is spread over
+        ticks = math.ceil(searched / game.FLOW_BUDGET)
+        print(f"{size:>5}x{size:<6} {field.cells:>8} {searched:>9} {timings[0]:>8.2f} "
+              f"{timings[1]:>9.2f} {ticks:>6}")
+
+def bench_startup(runs=5):
+    """
+    Launches the game in a fresh process until its main menu is
+    up, first with an empty asset cache and then with the cache
+    it just filled. Prints the game's own launch-to-first-frame
+    time and the wall time of the whole process.
+    """
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+    print(f"{'run':>4} {'cache':>6} {'first frame ms':>15} {'process ms':>11}")
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for run in range(runs + 1):
+            start = time.perf_counter()
+            out = subprocess.run(
+                [sys.executable, script, "--startup", f"--asset-cache={cache_dir}"],
+                capture_output=True, text=True, env=os.environ, check=True).stdout
+            wall = (time.perf_counter() - start) * 1000
+            first_frame = float(re.search(r"Startup: (\d+) ms", out).group(1))
+            print(f"{run:>4} {'cold' if run == 0 else 'warm':>6} {first_frame:>15.0f} {wall:>11.0f}")
+
+def bench_effects(counts=(10, 50, 100, 250, 500, 1000, 5000), frames=60):
+    """
+    Kills count enemies at once around the player and times drawing
+    their death effects, mid-animation, averaged over frames. The
+    pool's fixed slots and draw budget cap the cost however many
+    deaths there are.
+    """
+    game.new_game(0)
+    game.camera.move_bg()
+    view = game.camera.view
+    rng = random.Random(1010)
+    print(f"{'deaths':>7} {'effects':>8} {'drawn':>6} {'draw ms':>8}")
+    for count in counts:
+        game.effects.clear()
+        for _ in range(count):
+            game.enemy_death_effect(rng.uniform(view.left, view.right),
+                                    rng.uniform(view.top, view.bottom),
+                                    rng.randrange(game.ENEMY_ROTATION_BUCKETS))
+        now = game.sim_clock.now() + game.DEATH_FRAME_MS * 2
+        live = min(count * (1 + game.SPARKS_PER_DEATH), game.EFFECT_CAPACITY)
+        drawn = game.effects.draw(game.display, view, now)  # Warms the rotation frames
+        start = time.perf_counter()
+        for _ in range(frames):
+            game.effects.draw(game.display, view, now)
+        ms = (time.perf_counter() - start) * 1000 / frames
+        print(f"{count:>7} {live:>8} {drawn:>6} {ms:>8.2f}")
+
+SAVE_LAG_MS = 20   # Extra time each --saves write takes, standing in for a slow disk
+SAVE_SLACK_MS = 3  # How much worse than no saves the IO thread's save frames may be
+
+class SlowStore(game.ScoreStore):
+    """
+    ScoreStore whose writes take SAVE_LAG_MS longer, like a slow or
+    busy disk, so a save that holds up the game loop can't hide.
+    """
+    def write(self, run):
+        time.sleep(SAVE_LAG_MS / 1000)
+        super().write(run)
+
+def time_saves(mode, store, ticks, every):
+    """
+    Plays a rendered headless game that saves a run every `every`
+    ticks in the given mode. Returns (sorted frame times, worst
+    frame a save was made on).
+    """
+    on_save = []  # Index of each frame a save was made on
+    def on_tick(tick):
+        if tick % every == 0:
+            if mode == "worker":
+                store.save(game.run_stats())
+            elif mode == "inline":
+                store.write(game.run_stats())
+            on_save.append(len(stamps) - 1)
+        stamps.append(time.perf_counter())
+    game.new_game(0)
+    stamps = [time.perf_counter()]
+    game.run_headless(ticks, render=True, on_tick=on_tick)
+    game.io_worker.flush()
+    frames = [b - a for a, b in zip(stamps, stamps[1:])]
+    return sorted(frames), max(frames[i] for i in on_save)
+
+def bench_saves(ticks=1500, every=25, rounds=3):
+    """
+    Checks that saving runs on the IO worker doesn't make the game
+    loop's frames worse. Each round plays the same game with no
+    saves, with the saves queued on the IO worker like the game
+    does, and with the same saves written inline on the loop, all
+    through SlowStore. "save ms" is the worst of the frames a save
+    was made on (the same frames when there are no saves). Taking
+    each mode's best round filters out one-off stalls from the OS.
+    Returns False (a regression) if the IO worker's save frames are
+    more than SAVE_SLACK_MS worse than with no saves, or if inline
+    saves aren't, since then the check couldn't see one. The
+    database goes next to this file rather than in /tmp, which is
+    often in memory.
+    """
+    game.new_game(0)
+    game.run_headless(ticks // 2, render=True)  # Warm up caches so the first mode isn't penalised
+    print(f"{'round':>5} {'saves':>7} {'count':>6} {'p50 ms':>7} {'p99 ms':>7} "
+          f"{'worst ms':>9} {'save ms':>8}")
+    best = {}
+    here = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory(dir=here) as tmp:
+        for round_number in range(1, rounds + 1):
+            for mode in ("none", "worker", "inline"):
+                store = SlowStore(os.path.join(tmp, mode + ".sqlite3"))
+                frames, save_worst = time_saves(mode, store, ticks, every)
+                best[mode] = min(best.get(mode, save_worst), save_worst)
+                saves = 0 if mode == "none" else ticks // every
+                print(f"{round_number:>5} {mode:>7} {saves:>6} "
+                      f"{percentile(frames, 50) * 1000:>7.2f} "
+                      f"{percentile(frames, 99) * 1000:>7.2f} {frames[-1] * 1000:>9.2f} "
+                      f"{save_worst * 1000:>8.2f}")
+    limit = best["none"] * 1000 + SAVE_SLACK_MS
+    worker, inline = best["worker"] * 1000, best["inline"] * 1000
+    if inline <= limit:
+        print(f"FAIL: inline saves ({inline:.2f} ms) stayed under {limit:.2f} ms, "
+              f"so this check can't catch a save that blocks the loop")
+        return False
+    if worker > limit:
+        print(f"FAIL: frames saving on the IO worker took {worker:.2f} ms, "
+              f"over the {limit:.2f} ms limit ({SAVE_SLACK_MS} ms above no saves)")
+        return False
+    print(f"OK: frames saving on the IO worker took {worker:.2f} ms "
+          f"(limit {limit:.2f} ms, inline {inline:.2f} ms)")
+    return True
+
+def bench_scaling(counts=(10000, 25000, 50000, 100000), ticks=30):
+    """
+    Swarm ticks per second (movement + 20 bullets a tick) for each
+    enemy count, on the plain swarm (0 workers) and sharded over
+    1, 2, 4 and one worker per core.
+    """
+    if game.np is None:
+        sys.exit("--scaling needs NumPy (pip install numpy)")
+    game.new_game(0)
+    worker_counts = sorted({0, 1, 2, 4, os.cpu_count()})
+    rng = random.Random(1010)
+    rates = {}
+    for workers in worker_counts:
+        swarm = game.ShardedSwarm(workers) if workers else game.EnemySwarm()
+        for count in counts:
+            swarm.clear()
+            swarm.spawn([(rng.uniform(0, game.MAP_WIDTH), rng.uniform(0, game.MAP_HEIGHT))
+                         for _ in range(count)], health=10 ** 6)
+            start = None
+            for tick in range(ticks + 3):
+                if tick == 3:  # The first ticks rebalance and copy the flow field
+                    start = time.perf_counter()
+                boxes = [(rng.randint(0, game.MAP_WIDTH), rng.randint(0, game.MAP_HEIGHT), 6, 6)
+                         for _ in range(20)]
+                swarm.update(game.SIM_DT, game.player.pos)
+                swarm.apply_hits(boxes)
+            rates[count, workers] = ticks / (time.perf_counter() - start)
+        swarm.close()
+    print(f"{os.cpu_count()} cores; 0 workers = plain swarm in this process")
+    print(f"{'enemies':>8} " + " ".join(f"{f'{w} workers':>10}" for w in worker_counts)
+          + f" {'speedup':>8}")
+    for count in counts:
+        row = [rates[count, w] for w in worker_counts]
+        print(f"{count:>8} " + " ".join(f"{rate:>10.1f}" for rate in row)
+              + f" {max(row) / row[0]:>8.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless game benchmarks")
+    parser.add_argument("--waves", default="1-20", help="wave range, e.g. 1-20")
+    parser.add_argument("--ticks", type=int, default=300, help="sim ticks per wave")
+    parser.add_argument("--alloc-ticks", type=int, default=30,
+                        help="ticks per wave measured with tracemalloc")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--render", action="store_true", help="draw every tick too")
+    parser.add_argument("--swarm", action="store_true", help="run the waves on the NumPy swarm engine")
+    parser.add_argument("--engines", action="store_true",
+                        help="compare the sprite and swarm engines by enemy count")
+    parser.add_argument("--flow", action="store_true",
+                        help="time flow field rebuilds by map size")
+    parser.add_argument("--startup", action="store_true",
+                        help="time launches with a cold and a warm asset cache")
+    parser.add_argument("--effects", action="store_true",
+                        help="time effect drawing by simultaneous enemy deaths")
+    parser.add_argument("--saves", action="store_true",
+                        help="check run saves on the IO thread don't worsen the worst frame")
+    parser.add_argument("--scaling", action="store_true",
+                        help="swarm ticks/s by worker processes for 10k-100k enemies")
+    args = parser.parse_args()
+
+    if args.engines:
+        bench_engines()
+        return
+    if args.flow:
+        bench_flow()
+        return
+    if args.startup:
+        bench_startup()
+        return
+    if args.effects:
+        bench_effects()
+        return
+    if args.saves:
+        sys.exit(0 if bench_saves() else 1)
+    if args.scaling:
+        bench_scaling()
+        return
+    first, _, last = args.waves.partition("-")
+    run_suite(int(first), int(last or first), args.ticks, args.seed,
+              args.render, args.alloc_ticks, args.swarm)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,765 @@
+# Local co-op for the 2D Cave Shooter
+# One process runs the game as the authoritative server; every
+# player runs a client that sends its input and draws the snapshots
+# the server sends back, all over UDP (localhost by default).
+#
+#   python coop.py --server                      host a game (add --swarm for big waves)
+#   python coop.py --join                        join it in a window, once per player
+#   python coop.py --load-test                   server tick cost by players and enemies
+#   python coop.py --load-test --swarm --enemies 1000,5000,20000
+#
+# Each snapshot is made for one client: only what is inside that
+# player's view (plus a margin), positions quantized to whole pixels
+# and facing to a byte. Enemies are sent as changes against the last
+# snapshot the client acknowledged: new ones and long moves in full,
+# short moves as one packed byte, and unchanged ones not at all.
+
+import argparse
+import os
+import random
+import socket
+import struct
+import sys
+import time
+
+import main as game
+
+pygame = game.pygame
+np = game.np
+
+PORT = 47470
+SNAPSHOT_EVERY = 5     # Sim ticks between two snapshots to one client (20 a second)
+HISTORY = 32           # Snapshots kept per client to build deltas on
+VIEW_MARGIN = 150      # World pixels sent beyond the edges of a client's view
+MAX_VIEW_BULLETS = 4000  # Most bullets in one snapshot (the nearest), 16 KB of it
+FULL_ENEMY_BYTES = 9     # Most one enemy can take in a full snapshot: id gap, x, y, look
+JOIN_TIMEOUT = 5       # Seconds a client waits for the server to answer
+CLIENT_TIMEOUT = 10    # Seconds of silence before the server drops a client
+MAX_PACKET = 65507     # Largest UDP payload
+GUNS = ("Handgun", "Rifle", "Shotgun")  # Gun byte -> gun name
+
+# Packets, told apart by their first byte
+JOIN = struct.Struct("<cB")             # b"J", skin wanted (255 = next free)
+WELCOME = struct.Struct("<cBII")        # b"W", player index, map width, map height
+INPUT = struct.Struct("<cIIBhhB")       # b"I", seq, newest snapshot decoded, buttons,
+                                        #   cursor x, y, weapon slot (0 = none)
+LEAVE = b"L"
+# b"S", tick, base tick (0 = full), your index, game over, wave, score,
+# then your health, max health, gun, ammo, clip size, reloading, player count
+SNAPSHOT = struct.Struct("<cIIBBHIhhBHHBB")
+PLAYER = struct.Struct("<BHHBBBh")      # index, center x, y, facing, skin, gun, health
+IDS = struct.Struct("<HIB")             # id count, first id, bytes per gap
+
+# Controls bits in INPUT's buttons byte
+BUTTONS = ("up", "left", "down", "right", "fire", "reload")
+
+# --- Snapshot encoding ---
+class EnemyTable:
+    """
+    Enemies as one snapshot showed them: network ids, quantized
+    center x and y, and look (atlas facing bucket, +128 while hit
+    flashing) as arrays sorted by id. The server keeps the tables
+    it sent and the client the ones it decoded, so both sides can
+    apply the same delta to the same base.
+    """
+    def __init__(self, uid=None, x=None, y=None, look=None):
+        self.uid = np.zeros(0, np.uint32) if uid is None else uid
+        self.x = np.zeros(0, np.int32) if x is None else x
+        self.y = np.zeros(0, np.int32) if y is None else y
+        self.look = np.zeros(0, np.uint8) if look is None else look
+
+    def __len__(self):
+        return len(self.uid)
+
+    def sorted(self):
+        """
+        The same table ordered by id.
+        """
+        order = np.argsort(self.uid, kind="stable")
+        return EnemyTable(self.uid[order], self.x[order], self.y[order], self.look[order])
+
+def nearest(x, y, center, limit):
+    """
+    Indices of the (at most) limit points nearest to center, in no
+    particular order.
+    """
+    if len(x) <= limit:
+        return np.arange(len(x))
+    dist = (x.astype(np.int64) - center[0]) ** 2 + (y.astype(np.int64) - center[1]) ** 2
+    return np.argpartition(dist, limit)[:limit]
+
+def visible_enemies(view, center, limit):
+    """
+    EnemyTable of the enemies whose center is inside the world-space
+    view rect, from whichever engine is running. Keeps only the
+    limit nearest to center if there are more.
+    """
+    if game.swarm is not None:
+        swarm, n = game.swarm, len(game.swarm)
+        centers = swarm.pos[:n] + (swarm.width / 2, swarm.height / 2)
+        inside = ((centers[:, 0] >= view.left) & (centers[:, 0] < view.right) &
+                  (centers[:, 1] >= view.top) & (centers[:, 1] < view.bottom))
+        flashing = game.sim_clock.now() - swarm.hit_time[:n][inside] < \
+            game.enemy_hit_animation.duration
+        table = EnemyTable(swarm.uid[:n][inside], centers[inside, 0].astype(np.int32),
+                           centers[inside, 1].astype(np.int32),
+                           (swarm.buckets(swarm.direction[:n][inside]) |
+                            flashing * 128).astype(np.uint8))
+    else:
+        sprites = game.enemy_grid.collide(view)
+        count = len(sprites)
+        table = EnemyTable(np.fromiter((e.uid for e in sprites), np.uint32, count),
+                           np.fromiter((e.rect.centerx for e in sprites), np.int32, count),
+                           np.fromiter((e.rect.centery for e in sprites), np.int32, count),
+                           np.fromiter((e.rotation_bucket | e.flashing * 128 for e in sprites),
+                                       np.uint8, count))
+    if len(table) > limit:
+        near = nearest(table.x, table.y, center, limit)
+        table = EnemyTable(table.uid[near], table.x[near], table.y[near], table.look[near])
+    return table.sorted()
+
+def pack_ids(out, ids):
+    """
+    Appends sorted ids as the first one and the gaps after it,
+    every gap in as few bytes (1, 2 or 4) as the largest one needs.
+    """
+    gaps = np.diff(ids.astype(np.int64))
+    top = int(gaps.max()) if len(gaps) else 0
+    width = 1 if top < 0x100 else 2 if top < 0x10000 else 4
+    out += IDS.pack(len(ids), int(ids[0]) if len(ids) else 0, width)
+    out += gaps.astype(f"<u{width}").tobytes()
+
+def unpack_ids(data, offset):
+    """
+    Reads ids written by pack_ids(). Returns (ids, new offset).
+    """
+    count, first, width = IDS.unpack_from(data, offset)
+    offset += IDS.size
+    ids = np.full(count, first, dtype=np.uint32)
+    if count > 1:
+        ids[1:] += np.cumsum(np.frombuffer(data, f"<u{width}", count - 1, offset),
+                             dtype=np.uint32)
+        offset += width * (count - 1)
+    return ids, offset
+
+def column(data, offset, dtype, count):
+    """
+    Reads one array of count values. Returns (array, new offset).
+    """
+    array = np.frombuffer(data, dtype, count, offset)
+    return array, offset + array.nbytes
+
+def encode_enemies(out, table, base):
+    """
+    Appends table as changes from base (an EnemyTable the client
+    has, or None for a full list), in four sections:
+    removed ids; short moves (dx, dy within 7 px, packed in one
+    byte); look changes; and new enemies or long moves in full.
+    """
+    base = base or EnemyTable()
+    common, mine, theirs = np.intersect1d(table.uid, base.uid, assume_unique=True,
+                                          return_indices=True)
+    gone = np.ones(len(base), dtype=bool)
+    gone[theirs] = False
+    dx = table.x[mine] - base.x[theirs]
+    dy = table.y[mine] - base.y[theirs]
+    short = (np.abs(dx) <= 7) & (np.abs(dy) <= 7)
+    moved = short & ((dx != 0) | (dy != 0))
+    looks = short & (table.look[mine] != base.look[theirs])
+    full = np.ones(len(table), dtype=bool)
+    full[mine[short]] = False
+    pack_ids(out, base.uid[gone])
+    pack_ids(out, common[moved])
+    out += ((dx[moved] + 8) << 4 | (dy[moved] + 8)).astype(np.uint8).tobytes()
+    pack_ids(out, common[looks])
+    out += table.look[mine[looks]].tobytes()
+    pack_ids(out, table.uid[full])
+    for values in (table.x[full].astype("<u2"), table.y[full].astype("<u2"), table.look[full]):
+        out += values.tobytes()
+
+def decode_enemies(data, offset, base):
+    """
+    Rebuilds the table encode_enemies() was given from the same
+    base. Returns (EnemyTable, new offset).
+    """
+    base = base or EnemyTable()
+    gone, offset = unpack_ids(data, offset)
+    keep = ~np.isin(base.uid, gone, assume_unique=True)
+    uid, x, y, look = base.uid[keep], base.x[keep], base.y[keep], base.look[keep]
+    moved, offset = unpack_ids(data, offset)
+    packed, offset = column(data, offset, np.uint8, len(moved))
+    rows = np.searchsorted(uid, moved)
+    x[rows] += (packed >> 4).astype(np.int32) - 8
+    y[rows] += (packed & 15).astype(np.int32) - 8
+    looked, offset = unpack_ids(data, offset)
+    values, offset = column(data, offset, np.uint8, len(looked))
+    look[np.searchsorted(uid, looked)] = values
+    full, offset = unpack_ids(data, offset)
+    fx, offset = column(data, offset, "<u2", len(full))
+    fy, offset = column(data, offset, "<u2", len(full))
+    flook, offset = column(data, offset, np.uint8, len(full))
+    keep = ~np.isin(uid, full, assume_unique=True)  # Long moves replace their old row
+    table = EnemyTable(np.concatenate((uid[keep], full)),
+                       np.concatenate((x[keep], fx.astype(np.int32))),
+                       np.concatenate((y[keep], fy.astype(np.int32))),
+                       np.concatenate((look[keep], flook)))
+    return table.sorted(), offset
+
+def facing_byte(angle):
+    return round(angle % 360 * 256 / 360) % 256
+
+def health_short(health):
+    return max(-0x8000, min(health, 0x7FFF))
+
+# --- Server ---
+class Seat:
+    """
+    A connected client, as the server sees it: the player it
+    drives, the newest input it sent and the snapshots it was sent.
+    """
+    def __init__(self, address, index):
+        self.address = address
+        self.index = index               # Its player in game.players
+        self.controls = game.Controls()  # Held keys and cursor, one-shots until used
+        self.seq = 0                     # Newest INPUT seq applied
+        self.acked = 0                   # Newest snapshot tick it decoded
+        self.sent = {}                   # tick -> EnemyTable sent, oldest first
+        self.heard = time.monotonic()
+        self.snapshots = 0
+        self.bytes = 0
+        self.full_bytes = 0              # Same snapshots without deltas (load test)
+
+class CoopServer:
+    """
+    Runs the game for every client. Each tick it reads the waiting
+    packets, steps the simulation with one Controls per player and
+    sends the clients whose turn it is a snapshot. Clients take
+    turns (by player index), so at most a fifth of them are encoded
+    in any one tick.
+    """
+    def __init__(self, host="127.0.0.1", port=PORT, seed=None, rules=None, quiet=False,
+                 swarm_mode=False, swarm_workers=0):
+        if max(game.MAP_WIDTH, game.MAP_HEIGHT) > 0xFFFF:
+            sys.exit("Co-op snapshots need a map of at most 65535x65535")
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((host, port))
+        self.sock.setblocking(False)
+        self.address = self.sock.getsockname()
+        self.seats = {}        # Client address -> Seat
+        self.tick = 0          # Snapshot tick, 0 means "no base"
+        self.sim_ms = []       # Per tick: simulate_tick()
+        self.net_ms = []       # Per tick: reading input, encoding and sending
+        self.measure_full = False  # Also size every snapshot as a full one
+        self.quiet = quiet         # No joined/left messages (load test)
+        game.new_game(seed, rules, swarm_mode, swarm_workers)
+
+    def poll(self):
+        """
+        Handles every packet waiting on the socket.
+        """
+        while True:
+            try:
+                data, address = self.sock.recvfrom(MAX_PACKET)
+            except (BlockingIOError, ConnectionResetError):
+                return
+            kind = data[:1]
+            if kind == b"J" and len(data) == JOIN.size:
+                self.join(address, JOIN.unpack(data)[1])
+            elif kind == b"I" and len(data) == INPUT.size and address in self.seats:
+                self.read_input(self.seats[address], data)
+            elif kind == LEAVE and address in self.seats:
+                self.say(f"Player {self.seats.pop(address).index + 1} left")
+
+    def join(self, address, skin):
+        """
+        Seats a new client on the first player nobody drives (adding
+        a player if there is none) and welcomes it. A repeated JOIN
+        just gets the welcome again.
+        """
+        seat = self.seats.get(address)
+        if seat is None:
+            taken = {s.index for s in self.seats.values()}
+            free = [i for i in range(len(game.players)) if i not in taken]
+            if free:
+                index = free[0]
+            elif len(game.players) < 255:
+                game.add_player()
+                index = len(game.players) - 1
+            else:
+                return
+            if skin != 255:
+                p = game.players[index]
+                p.change_look(skin % game.player_looks.skins, p.gun)
+            seat = self.seats[address] = Seat(address, index)
+            self.say(f"Player {index + 1} joined from {address[0]}:{address[1]}")
+        self.send(WELCOME.pack(b"W", seat.index, game.MAP_WIDTH, game.MAP_HEIGHT), address)
+
+    def send(self, packet, address):
+        """
+        Sends one packet. Returns False if the OS wouldn't take it
+        (buffer full, network down); UDP may lose it anyway, so the
+        client just keeps its older base until the next one.
+        """
+        try:
+            self.sock.sendto(packet, address)
+        except OSError:
+            return False
+        return True
+
+    def read_input(self, seat, data):
+        """
+        Applies an INPUT packet: held keys and the cursor replace the
+        old ones, fire/reload/weapon wait for the next tick to use them.
+        Late (reordered) packets are dropped.
+        """
+        _, seq, ack, buttons, cx, cy, weapon = INPUT.unpack(data)
+        if seq <= seat.seq:
+            return
+        seat.seq = seq
+        seat.acked = max(seat.acked, ack)
+        seat.heard = time.monotonic()
+        controls = seat.controls
+        for bit, name in enumerate(BUTTONS[:4]):
+            setattr(controls, name, bool(buttons >> bit & 1))
+        controls.fire |= bool(buttons >> 4 & 1)
+        controls.reload |= bool(buttons >> 5 & 1)
+        if weapon:
+            controls.weapon = weapon
+        controls.cursor = (cx, cy)
+
+    def step(self):
+        """
+        One server tick: input, simulation, snapshots.
+        """
+        start = time.perf_counter()
+        self.poll()
+        driven = {seat.index: seat.controls for seat in self.seats.values()}
+        controls = [driven.get(i) or game.Controls() for i in range(len(game.players))]
+        sim_start = time.perf_counter()
+        game.simulate_tick(controls)
+        sim_end = time.perf_counter()
+        self.tick += 1
+        due = [seat for seat in self.seats.values()
+               if (self.tick + seat.index) % SNAPSHOT_EVERY == 0 or not game.game_running]
+        for seat in due:
+            packet = self.snapshot(seat, seat.sent.get(seat.acked))
+            if not self.send(packet, seat.address):
+                continue
+            seat.snapshots += 1
+            seat.bytes += len(packet)
+        now = time.monotonic()
+        for address, seat in list(self.seats.items()):
+            if now - seat.heard > CLIENT_TIMEOUT:
+                self.say(f"Player {seat.index + 1} timed out")
+                del self.seats[address]
+        end = time.perf_counter()
+        self.sim_ms.append((sim_end - sim_start) * 1000)
+        self.net_ms.append((sim_start - start + end - sim_end) * 1000)
+        if self.measure_full:
+            for seat in due:
+                seat.full_bytes += len(self.snapshot(seat, None))
+
+    def snapshot(self, seat, base):
+        """
+        Encodes what seat's player can see, as changes from base
+        (an EnemyTable the client acknowledged) or in full if None.
+        Always fits one datagram: only the nearest MAX_VIEW_BULLETS
+        bullets go in, then as many of the nearest enemies as would
+        fit sent in full, and a delta that comes out bigger than
+        that (a lot of enemies left the view) is sent in full instead.
+        """
+        me = game.players[seat.index]
+        view = pygame.Rect(0, 0, game.SCREEN_WIDTH + VIEW_MARGIN * 2,
+                           game.SCREEN_HEIGHT + VIEW_MARGIN * 2)
+        view.center = me.rect.center
+        body = bytearray()
+        for i, p in enumerate(game.players):
+            body += PLAYER.pack(i, *p.rect.center, facing_byte(p.angle), p.skin,
+                                GUNS.index(p.gun.name), health_short(p.health))
+        bullets = [s.rect.center for s in game.bullet_group.visible(view)]
+        points = np.array(bullets, dtype=np.int64).reshape(-1, 2)
+        points = points[nearest(points[:, 0], points[:, 1], me.rect.center, MAX_VIEW_BULLETS)]
+        body += struct.pack("<H", len(points))
+        body += np.clip(points, 0, 0xFFFF).astype("<u2").T.tobytes()
+        room = MAX_PACKET - SNAPSHOT.size - len(body) - 4 * IDS.size
+        table = visible_enemies(view, me.rect.center, room // FULL_ENEMY_BYTES)
+        enemies = bytearray()
+        encode_enemies(enemies, table, base)
+        if base is not None and len(enemies) > room + 4 * IDS.size:
+            base, enemies = None, bytearray()
+            encode_enemies(enemies, table, None)
+        seat.sent[self.tick] = table
+        if len(seat.sent) > HISTORY:
+            del seat.sent[next(iter(seat.sent))]
+        gun = me.gun
+        header = SNAPSHOT.pack(
+            b"S", self.tick, seat.acked if base is not None else 0, seat.index,
+            not game.game_running, game.spawner.wave, game.score,
+            health_short(me.health), health_short(me.max_health), GUNS.index(gun.name),
+            gun.ammo, gun.clip_size, gun.is_reloading, len(game.players))
+        return header + body + enemies
+
+    def say(self, message):
+        if not self.quiet:
+            print(message)
+
+    def close(self):
+        self.sock.close()
+
+    def report(self):
+        lines = []
+        for seat in sorted(self.seats.values(), key=lambda s: s.index):
+            average = seat.bytes / max(seat.snapshots, 1)
+            lines.append(f"Player {seat.index + 1}: {seat.snapshots} snapshots, "
+                         f"{average:.0f} bytes each")
+        return "\n".join(lines)
+
+def run_server(host, port, swarm_mode=False, swarm_workers=0):
+    """
+    Hosts a game in real time until every player is down (or has
+    left). The clock only starts once the first player has joined.
+    """
+    server = CoopServer(host, port, swarm_mode=swarm_mode, swarm_workers=swarm_workers)
+    print(f"Co-op server on {server.address[0]}:{server.address[1]}, waiting for players")
+    while not server.seats:
+        server.poll()
+        time.sleep(0.05)
+    next_tick = time.perf_counter()
+    while game.game_running and server.seats:
+        now = time.perf_counter()
+        if now < next_tick:
+            time.sleep(next_tick - now)
+            continue
+        server.step()
+        next_tick += game.SIM_DT
+        if now - next_tick > game.MAX_SIM_STEPS * game.SIM_DT:
+            next_tick = now  # Too far behind: drop the backlog
+    if not game.game_running:
+        for seat in server.seats.values():  # Once more, in case the last one was lost
+            server.send(server.snapshot(seat, None), seat.address)
+    print(f"Game over: wave {game.spawner.wave}, score {game.score}")
+    print(server.report())
+    sim, net = sorted(server.sim_ms), sorted(server.net_ms)
+    print(f"Server tick: sim {percentile(sim, 50):.2f} ms, net {percentile(net, 50):.2f} ms "
+          f"(p50) of {1000 / game.SIM_HZ:.0f} ms")
+    server.close()
+
+# --- Client ---
+class Snapshot:
+    """
+    One decoded snapshot: HUD values, every player, the bullets and
+    enemies in view, and when it arrived.
+    """
+    def __init__(self, tick, you, over, score, hud, players, bullets, enemies, received):
+        self.tick = tick
+        self.you = you            # Index of this client's player
+        self.over = over          # True once every player is down
+        self.score = score
+        self.hud = hud            # Tuple for Hud.draw_state()
+        self.players = players    # index -> (x, y, facing degrees, skin, gun name, health)
+        self.bullets = bullets    # (n, 2) int array of centers
+        self.enemies = enemies    # EnemyTable
+        self.received = received  # time.perf_counter() on arrival
+
+class CoopClient:
+    """
+    One player's end of a co-op game: sends input, decodes the
+    snapshots and keeps the last two of them to draw in between.
+    """
+    def __init__(self, host="127.0.0.1", port=PORT):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        self.sock.connect((host, port))
+        self.sock.setblocking(False)
+        self.index = None     # Our player, from WELCOME
+        self.seq = 0
+        self.tables = {}      # tick -> EnemyTable decoded, bases for the next deltas
+        self.state = None     # Newest Snapshot
+        self.previous = None  # The one before it
+        self.bytes = 0
+
+    def join(self, skin=255, timeout=JOIN_TIMEOUT):
+        """
+        Asks for a seat until the server answers or timeout runs out.
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            self.sock.send(JOIN.pack(b"J", skin))
+            wait_until = time.monotonic() + 0.25
+            while time.monotonic() < wait_until:
+                try:
+                    data = self.sock.recv(MAX_PACKET)
+                except BlockingIOError:
+                    time.sleep(0.01)
+                    continue
+                except ConnectionRefusedError:
+                    break
+                if data[:1] == b"W" and len(data) == WELCOME.size:
+                    _, self.index, width, height = WELCOME.unpack(data)
+                    if (width, height) != (game.MAP_WIDTH, game.MAP_HEIGHT):
+                        sys.exit(f"The server plays on a {width}x{height} map, "
+                                 f"join with --map={width}x{height}")
+                    return
+        sys.exit(f"No co-op server answered at {self.sock.getpeername()}")
+
+    def send(self, controls):
+        """
+        Sends this frame's controls, with the newest snapshot we can
+        build deltas on.
+        """
+        buttons = sum(bool(getattr(controls, name)) << bit for bit, name in enumerate(BUTTONS))
+        cx, cy = controls.cursor
+        self.seq += 1
+        acked = self.state.tick if self.state is not None else 0
+        try:
+            self.sock.send(INPUT.pack(b"I", self.seq, acked, buttons, int(cx), int(cy),
+                                      controls.weapon or 0))
+        except ConnectionRefusedError:
+            pass  # Server gone; the game over snapshot (or its absence) tells the rest
+
+    def leave(self):
+        try:
+            self.sock.send(LEAVE)
+        except ConnectionRefusedError:
+            pass
+        self.sock.close()
+
+    def receive(self):
+        """
+        Decodes every snapshot waiting on the socket.
+        """
+        while True:
+            try:
+                data = self.sock.recv(MAX_PACKET)
+            except BlockingIOError:
+                return
+            except ConnectionRefusedError:
+                continue  # The server left; what it sent before is still queued
+            if data[:1] == b"S":
+                self.bytes += len(data)
+                self.read_snapshot(data)
+
+    def read_snapshot(self, data):
+        """
+        Decodes one snapshot. Ones older than what we have, or built
+        on a base we no longer keep, are skipped.
+        """
+        (_, tick, base_tick, you, over, wave, score, health, max_health, gun, ammo, clip,
+         reloading, player_count) = SNAPSHOT.unpack_from(data)
+        if self.state is not None and tick <= self.state.tick:
+            return
+        base = self.tables.get(base_tick)
+        if base_tick and base is None:
+            return
+        offset = SNAPSHOT.size
+        players = {}
+        for _ in range(player_count):
+            i, x, y, facing, skin, gun_id, player_health = PLAYER.unpack_from(data, offset)
+            players[i] = (x, y, facing * 360 / 256, skin, GUNS[gun_id], player_health)
+            offset += PLAYER.size
+        (count,) = struct.unpack_from("<H", data, offset)
+        points, offset = column(data, offset + 2, "<u2", count * 2)
+        bullets = points.reshape(2, count).T.astype(np.int32)
+        enemies, offset = decode_enemies(data, offset, base)
+        self.tables[tick] = enemies
+        if len(self.tables) > HISTORY:
+            del self.tables[next(iter(self.tables))]
+        hud = (health, max_health, wave, GUNS[gun], ammo, clip, bool(reloading))
+        self.previous, self.state = self.state, Snapshot(
+            tick, you, bool(over), score, hud, players, bullets, enemies, time.perf_counter())
+
+def draw_snapshot(client, cursor, hud):
+    """
+    Draws the client's view, moving everything between the last
+    two snapshots by how long ago the newest one arrived.
+    """
+    state, previous = client.state, client.previous or client.state
+    blend = min((time.perf_counter() - state.received) / (SNAPSHOT_EVERY * game.SIM_DT), 1.0)
+    def between(old, new):
+        return old + (new - old) * blend
+    x, y = state.players[state.you][:2]
+    old = previous.players.get(state.you, state.players[state.you])
+    ox = round(between(old[0], x) - game.SCREEN_WIDTH / 2)
+    oy = round(between(old[1], y) - game.SCREEN_HEIGHT / 2)
+    view = pygame.Rect(ox, oy, game.SCREEN_WIDTH, game.SCREEN_HEIGHT)
+    display = game.display
+    if not game.world_rect.contains(view):
+        display.fill((0, 0, 0))
+    game.tile_map.draw(display, view)
+    # Enemies: slide the ones the last snapshot had too
+    enemies, before = state.enemies, previous.enemies
+    ex, ey = enemies.x.astype(float), enemies.y.astype(float)
+    if len(before):
+        rows = np.minimum(np.searchsorted(before.uid, enemies.uid), len(before) - 1)
+        seen = before.uid[rows] == enemies.uid
+        ex[seen] = between(before.x[rows[seen]], ex[seen])
+        ey[seen] = between(before.y[rows[seen]], ey[seen])
+    blits = []
+    for cx, cy, look in zip((ex - ox).tolist(), (ey - oy).tolist(), enemies.look.tolist()):
+        if look & 128:
+            frame = game.enemy_hit_animation.frame(0, look & 127)
+        else:
+            frame = game.enemy_atlas.frame(look)
+        blits.append((frame, (cx - frame.get_width() // 2, cy - frame.get_height() // 2)))
+    display.blits(blits, doreturn=False)
+    for i, (px, py, facing, skin, gun, health) in state.players.items():
+        old = previous.players.get(i, state.players[i])
+        atlas = game.player_looks.atlas(skin, gun)
+        frame = atlas.frame(atlas.bucket(facing))
+        if health <= 0:
+            frame = game.faded(frame, 90, 1.0)
+        display.blit(frame, (between(old[0], px) - ox - frame.get_width() // 2,
+                             between(old[1], py) - oy - frame.get_height() // 2))
+    bullet = game.assets.circle((255, 0, 0), 3)
+    display.blits([(bullet, (bx - ox - 3, by - oy - 3)) for bx, by in state.bullets.tolist()],
+                  doreturn=False)
+    crosshair = game.crosshair
+    display.blit(crosshair, (cursor[0] - crosshair.get_width() // 2,
+                             cursor[1] - crosshair.get_height() // 2))
+    hud.draw_state(display, state.hud)
+    if state.over or state.hud[0] <= 0:
+        text = f"GAME OVER - score {state.score}" if state.over else "You're down"
+        image = game.text_cache.render(game.wave_font, text, (255, 255, 255))
+        display.blit(image, image.get_rect(center=(game.SCREEN_WIDTH // 2, 120)))
+
+def run_client(host, port, skin):
+    """
+    Joins a co-op server and plays in the window until the game
+    ends or the window is closed.
+    """
+    game.init()
+    client = CoopClient(host, port)
+    client.join(skin)
+    print(f"Joined as player {client.index + 1}")
+    hud = game.Hud()
+    dispatcher = game.input_dispatcher
+    dispatcher.reset()
+    pygame.mouse.set_visible(False)
+    over_at = None
+    while True:
+        game.clock.tick(game.FPS)
+        controls = dispatcher.poll()
+        if controls.quit:
+            break
+        client.send(controls)
+        controls.consume()
+        client.receive()
+        if client.state is None:
+            continue
+        if time.perf_counter() - client.state.received > CLIENT_TIMEOUT:
+            print("Lost the server")
+            break
+        draw_snapshot(client, controls.cursor, hud)
+        pygame.display.update()
+        if client.state.over:
+            over_at = over_at or time.monotonic()
+            if time.monotonic() - over_at > 3:
+                break
+    client.leave()
+    if client.state is not None:
+        print(f"Wave {client.state.hud[2]}, score {client.state.score}, "
+              f"{client.bytes / 1024:.0f} KiB of snapshots received")
+    pygame.quit()
+
+# --- Load test ---
+def percentile(sorted_values, pct):
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * pct / 100))]
+
+def load_test(player_counts, enemy_counts, ticks, swarm_mode=False):
+    """
+    Runs a server in this process with bot clients on real sockets
+    and prints its tick cost for every mix of player and enemy
+    counts. Enemies are scattered over the whole map with too much
+    health to die, so the counts hold; bots play the headless input
+    script (each a little out of step) and can't be hurt. Only the
+    server's own work is timed. "full" is what the same snapshots
+    would weigh without deltas.
+    """
+    print(f"{'players':>7} {'enemies':>8} {'sim ms':>7} {'net ms':>7} {'p99 ms':>7} "
+          f"{'budget %':>9} {'bytes':>7} {'full':>7} {'KiB/s':>7}")
+    budget = 1000 / game.SIM_HZ
+    for enemies in enemy_counts:
+        for count in player_counts:
+            server = CoopServer(port=0, seed=0, quiet=True, swarm_mode=swarm_mode)
+            game.spawner.queued = 0  # No waves, just these enemies
+            rng = random.Random(1010)
+            w, h = game.enemy_image.get_size()
+            game.spawn_enemies([(rng.uniform(0, game.MAP_WIDTH - w),
+                                 rng.uniform(0, game.MAP_HEIGHT - h))
+                                for _ in range(enemies)], 80, 10 ** 6)
+            bots = []
+            for _ in range(count):
+                bot = CoopClient(*server.address)
+                bot.sock.send(JOIN.pack(b"J", 255))
+                server.poll()
+                bot.join()
+                bots.append(bot)
+            for p in game.players:
+                p.invincible, p.invincibility_duration = True, float("inf")
+            for tick in range(50 + ticks):
+                if tick == 50:  # Everyone's in and has a base to delta on
+                    server.sim_ms, server.net_ms = [], []
+                    server.measure_full = True
+                    for seat in server.seats.values():
+                        seat.snapshots = seat.bytes = seat.full_bytes = 0
+                for bot in bots:
+                    bot.receive()
+                    bot.send(game.scripted_controls(tick + 40 * bot.index))
+                server.step()
+            totals = sorted(s + n for s, n in zip(server.sim_ms, server.net_ms))
+            seats = list(server.seats.values())
+            snapshots = sum(seat.snapshots for seat in seats)
+            sent = sum(seat.bytes for seat in seats) / snapshots
+            full = sum(seat.full_bytes for seat in seats) / snapshots
+            rate = sent * game.SIM_HZ / SNAPSHOT_EVERY / 1024
+            sim, net = percentile(sorted(server.sim_ms), 50), percentile(sorted(server.net_ms), 50)
+            print(f"{count:>7} {game.enemy_count():>8} {sim:>7.2f} {net:>7.2f} "
+                  f"{percentile(totals, 99):>7.2f} {(sim + net) / budget * 100:>9.0f} "
+                  f"{sent:>7.0f} {full:>7.0f} {rate:>7.1f}")
+            for bot in bots:
+                bot.leave()
+            server.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Local networked co-op")
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument("--server", action="store_true", help="host a game")
+    mode.add_argument("--join", action="store_true", help="join a game in a window")
+    mode.add_argument("--load-test", action="store_true",
+                      help="time the server with bot clients")
+    parser.add_argument("--host", default="127.0.0.1", help="address to host on or join")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--skin", type=int, default=255, help="skin to ask for (0-31)")
+    parser.add_argument("--map", help="map size as WxH (server and clients must match)")
+    parser.add_argument("--swarm", action="store_true", help="use the NumPy swarm engine")
+    parser.add_argument("--swarm-workers", type=int, default=0,
+                        help="server: run the swarm on this many worker processes")
+    parser.add_argument("--players", default="1,2,4,8", help="load test player counts")
+    parser.add_argument("--enemies", help="load test enemy counts "
+                        "(default 100,250,500, or 1000,5000,20000 with --swarm)")
+    parser.add_argument("--ticks", type=int, default=300, help="load test ticks per mix")
+    args = parser.parse_args()
+    if np is None:
+        sys.exit("Co-op needs NumPy (pip install numpy)")
+    if args.map:
+        game.set_map(*(int(v) for v in args.map.split("x")))
+    if args.join:
+        run_client(args.host, args.port, args.skin)
+        return
+    # The server only simulates; it never opens a window
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+    if args.server:
+        run_server(args.host, args.port, args.swarm, args.swarm_workers)
+        return
+    enemies = args.enemies or ("1000,5000,20000" if args.swarm else "100,250,500")
+    load_test([int(v) for v in args.players.split(",")],
+              [int(v) for v in enemies.split(",")], args.ticks, args.swarm)
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,12 @@
 
 # This module runs our top-down wave-based shooter. It defines all
 # the core classes and helper functions, and handles the game loop.
+# Run it with "python main.py". Importing it (e.g. from bench.py)
+# only defines things: pygame, the window and the assets start up
+# in init(), which new_game() calls the first time it runs.
 
+import time
+LAUNCH_TIME = time.perf_counter()  # Before the other imports, so startup timing covers them
 
 import pygame
 import sys
@@ -11,65 +16,1536 @@ import os
 import math
 import warnings
 import random
+import json
+import hashlib
+import io
+import csv
+import struct
+import sqlite3
+import atexit
+import multiprocessing
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import shared_memory
+from itertools import islice
 
-# Starts up pygame
-pygame.init()
-warnings.filterwarnings("ignore", category=UserWarning, module="PIL.PngImagePlugin")
+try:
+    import numpy as np
+except ImportError:  # NumPy is only needed for the swarm engine
+    np = None
 
-# font for wave counter
-wave_font = pygame.font.Font(None, 36)
+# Headless runs (and fast replays) draw to SDL's dummy driver instead of a real window
+HEADLESS = False  # Set by main() for --headless and --replay=
 
-FPS = 100  # Caps the frames per second
+FPS = 100  # Caps the rendered frames per second
+SIM_HZ = 100  # Fixed simulation ticks per second
+SIM_DT = 1 / SIM_HZ  # Seconds of game time per simulation tick
+MAX_SIM_STEPS = 25  # Most sim ticks run per rendered frame before dropping time
 SCREEN_WIDTH = 1000  # Width of the game window
 SCREEN_HEIGHT = 1000  # Height of the game window
-MAP_WIDTH = 2000  # Width of the entire map background
-MAP_HEIGHT = 2000  # Height of the entire map background
+MAP_WIDTH = 2000  # Width of the entire map in world pixels
+MAP_HEIGHT = 2000  # Height of the entire map in world pixels
+# Bigger maps, e.g. --map=20000x20000 (the ground is tiled, so this is cheap); see set_map()
 screen_size = (SCREEN_WIDTH, SCREEN_HEIGHT)  # Tuple for screen dimensions
+SCREEN_CENTER = (SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2)  # Where the player is drawn
 background_pos = (0, 0)  # Top-left origin for background blitting
 player_start_pos = (600, 600)  # Starting position of the player
 player_size = .15  # Scaling factor for player sprite
 player_speed = 300  # Movement speed of the player
 vector = pygame.math.Vector2  # For vector operations throughout the code
+BULLET_RANGE = 1200  # Pixels a bullet flies before it fizzles out
+# Enemy engine, chosen by new_game() (main() takes it from --swarm
+# and --swarm-workers=N)
+SWARM_MODE = False  # Run enemies on the NumPy swarm engine
+SWARM_WORKERS = 0   # Processes the swarm's movement and bullet tests run on (0 = in this one)
 
-# Wave variables to manage wave progression
-wave_number = 1  # Current wave index
-current_wave_count = 5  # Number of enemies in the current wave
-wave_clear_time = None  # Time when a wave was cleared
+# Wave rules, read by WaveSpawner. Override any of them with
+# --wave-rules=file.json (a JSON object with the same keys, read by main()).
+WAVE_RULES = {
+    "first_wave": 5,         # Enemies in wave 1
+    "growth": 1.5,           # Each wave is this many times the last (rounded up)
+    "sizes": [],             # Exact sizes for the first waves, before growth takes over
+    "break_ms": 5000,        # Pause after a wave is cleared
+    "spawn_per_tick": 10,    # Most enemies spawned in one sim tick
+    "max_alive": 300,        # Most enemies alive at once (sprite engine)
+    "max_alive_swarm": 5000,  # Same for the NumPy swarm engine
+    "spawn_margin": 150,     # How far outside the view enemies appear
+    "enemy_speed": 80,       # Wave 1 enemy speed (pixels per second)
+    "speed_per_wave": 0,     # Added to enemy speed every wave
+    "enemy_health": 5,       # Wave 1 enemy health
+    "health_per_wave": 0,    # Added to enemy health every wave
+}
 
 # Sprite groups for organization
 enemies = pygame.sprite.Group()     # All enemy sprites
-bullet_group = pygame.sprite.Group()  # All bullet sprites
-game_sprites = pygame.sprite.Group()  # All active game sprites (including player)
-
-# Screen setup and window caption
-display = pygame.display.set_mode(screen_size)
-pygame.display.set_caption("2D shooter")
-clock = pygame.time.Clock()  # Clock object to track time and FPS
-
-# Load and scale the main game background
-background = pygame.transform.scale(
-    pygame.image.load("Lords Of Pain/environment/ground.png.png").convert(),
-    (MAP_WIDTH, MAP_HEIGHT)
-)
-# Load and scale the menu background
-menu_background = pygame.transform.scale(
-    pygame.image.load("Premium top-down shooter asset pack/yo gurt.jpg"),
-    screen_size
-)
 
-# Load UI button images and scale them
-play_button_img = pygame.transform.scale(
-    pygame.image.load("Premium top-down shooter asset pack/Play Rect.png"),
-    (400, 125)
-)
-quit_button_img = pygame.transform.scale(
-    pygame.image.load("Premium top-down shooter asset pack/Quit Rect.png"),
-    (400, 125)
-)
-# Crosshair sprite for aiming
-crosshair = pygame.image.load(
-    "Premium top-down shooter asset pack/crosshair.png"
-)
+# Window, clock and HUD font, created by init()
+display = None
+clock = None      # Clock object to track time and FPS
+wave_font = None  # Font for the wave counter
+
+# --- Simulation Clock ---
+class SimClock:
+    """
+    Game-time clock that only moves when the simulation ticks.
+    Guns, invincibility and the wave timer read this instead of
+    pygame.time.get_ticks(), so the same inputs always give the
+    same game no matter how fast frames are drawn.
+    """
+    def __init__(self, hz=SIM_HZ):
+        self.hz = hz
+        self.ticks = 0  # Simulation ticks run so far
+
+    def now(self):
+        """
+        Milliseconds of game time elapsed.
+        """
+        return self.ticks * 1000 // self.hz
+
+    def advance(self):
+        self.ticks += 1
+
+    def reset(self):
+        self.ticks = 0
+
+sim_clock = SimClock()  # Default clock shared by guns and game logic
+
+# Speeds the simulation up relative to real time, e.g. --speed=4
+SIM_SPEED = 1.0
+
+# --- Background IO ---
+# High scores and run stats are saved to this SQLite file;
+# --stats=FILE moves it, --no-stats turns saving off.
+STATS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pest_stats.sqlite3")
+
+class IOWorker:
+    """
+    One background thread for the disk work the game loop would
+    otherwise wait on: saving runs, writing baked assets and
+    recordings, and reading the next screen's font file. Jobs run
+    one at a time in the order they were submitted, so two writes
+    never overlap; the loop only ever submits them.
+    """
+    def __init__(self):
+        self.pool = None    # ThreadPoolExecutor, started by the first job
+        self.jobs = 0
+        self.failed = 0
+        self.busy = 0.0     # Seconds spent running jobs
+        self.slowest = 0.0  # Longest single job, in seconds
+
+    def submit(self, job, *args):
+        """
+        Queues job(*args) on the worker thread and returns its Future.
+        """
+        if self.pool is None:
+            self.pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pest-io")
+        self.jobs += 1
+        return self.pool.submit(self._run, job, args)
+
+    def _run(self, job, args):
+        start = time.perf_counter()
+        try:
+            return job(*args)
+        except Exception as e:  # Nobody waits on most jobs, so say what went wrong
+            self.failed += 1
+            print(f"Background IO failed: {e}")
+            return None
+        finally:
+            elapsed = time.perf_counter() - start
+            self.busy += elapsed
+            self.slowest = max(self.slowest, elapsed)
+
+    def flush(self):
+        """
+        Waits for every job queued so far.
+        """
+        if self.pool is not None:
+            self.pool.submit(int).result()
+
+    def report(self):
+        return (f"Background IO: {self.jobs} jobs, {self.failed} failed, "
+                f"{self.busy * 1000:.1f} ms busy, slowest {self.slowest * 1000:.1f} ms")
+
+io_worker = IOWorker()  # Shared by everything that writes files during play
+
+def write_file(path, data):
+    """
+    Writes data to path through a temporary file, so a crash
+    mid-write never leaves half a file behind.
+    """
+    with open(path + ".tmp", "wb") as f:
+        f.write(data)
+    os.replace(path + ".tmp", path)
+
+def read_file(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+class ScoreStore:
+    """
+    High scores and per-run stats in a small SQLite database, one
+    row per game. save() and best() run on io_worker and return
+    Futures, so the game never waits on the disk; write() and
+    top() do the same work on the calling thread. The connection
+    belongs to the first thread that uses it.
+    """
+    def __init__(self, path=STATS_PATH):
+        self.path = path
+        self.db = None
+
+    def _connect(self):
+        if self.db is None:
+            self.db = sqlite3.connect(self.path)
+            self.db.execute("CREATE TABLE IF NOT EXISTS runs (ended REAL, score INTEGER, "
+                            "wave INTEGER, seconds REAL, engine TEXT, map TEXT)")
+        return self.db
+
+    def write(self, run):
+        """
+        Adds one run (a dict from run_stats()).
+        """
+        db = self._connect()
+        with db:
+            db.execute("INSERT INTO runs VALUES (:ended, :score, :wave, :seconds, :engine, :map)",
+                       run)
+
+    def top(self, limit=5):
+        """
+        The best (score, wave) pairs so far, best first.
+        """
+        return self._connect().execute(
+            "SELECT score, wave FROM runs ORDER BY score DESC, wave DESC LIMIT ?",
+            (limit,)).fetchall()
+
+    def save(self, run):
+        return io_worker.submit(self.write, run)
+
+    def best(self, limit=5):
+        return io_worker.submit(self.top, limit)
+
+scores = ScoreStore()  # main() moves it for --stats=FILE and makes it None with --no-stats
+
+# --- Asset Cache ---
+# Paths to every image/font the game uses
+ASSET_DIR = "Premium top-down shooter asset pack"
+GROUND_TILE = "Lords of Pain/environment/ground_stone1.png"
+GROUND_OVERLAYS = [
+    "Lords of Pain/environment/ground_variation1.png",
+    "Lords of Pain/environment/ground_variation2.png",
+]
+TILESET_IMAGE = ASSET_DIR + "/Premium Content/Tileset with cell size 256x256.png"
+MENU_BACKGROUND_IMAGE = ASSET_DIR + "/yo gurt.jpg"
+PLAY_BUTTON_IMAGE = ASSET_DIR + "/Play Rect.png"
+QUIT_BUTTON_IMAGE = ASSET_DIR + "/Quit Rect.png"
+CROSSHAIR_IMAGE = ASSET_DIR + "/crosshair.png"
+PLAYER_IMAGE = ASSET_DIR + "/Player with AK.png"
+ENEMY_IMAGE = ASSET_DIR + "/Bug_enemy.png"
+MENU_FONT = ASSET_DIR + "/font.ttf"
+
+# Scaled, converted images are saved here as raw pixels so later
+# launches skip decoding and scaling. --asset-cache=DIR moves it,
+# --no-asset-cache turns it off.
+ASSET_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".asset_cache")
+BAKED_VERSION = 1  # Bump to throw away every cached file
+BAKED_HEADER = struct.Struct("<4sHH")  # Magic, width, height; BGRA pixels follow
+
+class AssetCache:
+    """
+    Loads every image from disk once and keeps each scaled
+    variant, so all sprites and menus share the same Surfaces
+    instead of decoding the file again on every spawn.
+    Each variant is also baked to cache_dir as raw BGRA pixels
+    (the display's own layout), which the next launch loads
+    with image.frombuffer instead of decoding and scaling.
+    """
+    def __init__(self, cache_dir=ASSET_CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.sources = {}    # path -> decoded (unscaled) Surface
+        self.surfaces = {}   # (path, size, scale, alpha) -> ready Surface
+        self.fonts = {}      # (path, size) -> Font
+        self.font_files = {} # .ttf path -> Future of its bytes, read on io_worker
+        self.parts = {}      # sheet path -> bounding rects of its shapes
+        self.decodes = {}    # path -> number of times read from disk
+        self.hits = 0
+        self.misses = 0
+        self.baked_loads = 0  # Variants read back from cache_dir
+
+    def _baked_path(self, key, path):
+        """
+        File in cache_dir for one variant. The name hashes the key
+        with the size and modified time of each source file (path is
+        one path or a tuple of them), so editing an image makes a new
+        entry instead of loading a stale one.
+        """
+        stamps = ()
+        for source in path if isinstance(path, tuple) else (path,):
+            stat = os.stat(source)
+            stamps += (stat.st_size, stat.st_mtime_ns)
+        name = repr((BAKED_VERSION, key) + stamps)
+        return os.path.join(self.cache_dir, hashlib.sha1(name.encode()).hexdigest() + ".raw")
+
+    def _load_baked(self, key, path, alpha):
+        """
+        Returns the variant from cache_dir, or None if it isn't there.
+        """
+        if self.cache_dir is None:
+            return None
+        try:
+            with open(self._baked_path(key, path), "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        if len(data) < BAKED_HEADER.size:  # Cut short mid-write; rebuild it
+            return None
+        magic, width, height = BAKED_HEADER.unpack_from(data)
+        if magic != b"BAKE" or len(data) != BAKED_HEADER.size + width * height * 4:
+            return None
+        pixels = memoryview(data)[BAKED_HEADER.size:]
+        surface = pygame.image.frombuffer(pixels, (width, height), "BGRA")
+        self.baked_loads += 1
+        return surface.convert_alpha() if alpha else surface.convert()
+
+    def _save_baked(self, key, path, surface):
+        """
+        Copies a variant's pixels and has io_worker write them to
+        cache_dir.
+        """
+        if self.cache_dir is None:
+            return
+        data = BAKED_HEADER.pack(b"BAKE", *surface.get_size())
+        data += pygame.image.tobytes(surface, "BGRA")
+        io_worker.submit(self._write_baked, self._baked_path(key, path), data)
+
+    def _write_baked(self, target, data):
+        """
+        Runs on io_worker. A cache that can't be written (read-only
+        checkout, full disk) is simply skipped.
+        """
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            write_file(target, data)
+        except OSError:
+            pass
+
+    def source(self, path):
+        """
+        Returns the decoded image for path, reading the file
+        only if it hasn't been decoded yet (or was trimmed).
+        """
+        source = self.sources.get(path)
+        if source is None:
+            source = pygame.image.load(path)
+            self.sources[path] = source
+            self.decodes[path] = self.decodes.get(path, 0) + 1
+        return source
+
+    def derived(self, key, path, build, alpha=True):
+        """
+        Returns the Surface stored under key, calling build() to
+        make it only if it is neither in memory nor in cache_dir.
+        path: source file the Surface is made from, or a tuple of
+        them (a new version of any file makes a new cache entry)
+        """
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.hits += 1
+            return surface
+        self.misses += 1
+        surface = self._load_baked(key, path, alpha)
+        if surface is None:
+            surface = build()
+            self._save_baked(key, path, surface)
+        self.surfaces[key] = surface
+        return surface
+
+    def image(self, path, size=None, scale=None, alpha=False):
+        """
+        Returns a display-converted Surface for path.
+        size: (w, h) to stretch to with transform.scale
+        scale: zoom factor applied with rotozoom (smooth)
+        alpha: keep per-pixel transparency
+        """
+        def build():
+            source = self.source(path)
+            surface = source.convert_alpha() if alpha else source.convert()
+            if scale is not None:
+                surface = pygame.transform.rotozoom(surface, 0, scale)
+            if size is not None:
+                surface = pygame.transform.scale(surface, size)
+            return surface
+        return self.derived((path, size, scale, alpha), path, build, alpha)
+
+    def tile(self, path, cell, cell_size, size):
+        """
+        Returns one cell of a tile sheet, converted and scaled.
+        cell: (column, row) in the sheet
+        cell_size: sheet cell width/height in pixels
+        size: (w, h) to scale the cell to
+        """
+        def build():
+            col, row = cell
+            area = pygame.Rect(col * cell_size, row * cell_size, cell_size, cell_size)
+            return pygame.transform.scale(self.source(path).subsurface(area).convert(), size)
+        return self.derived((path, cell, cell_size, size), path, build, alpha=False)
+
+    def sheet_parts(self, path):
+        """
+        Bounding rects of every separate shape on a sprite sheet,
+        found from its alpha once, so sheets whose parts aren't
+        on a regular grid need no hard-coded coordinates.
+        """
+        rects = self.parts.get(path)
+        if rects is None:
+            rects = pygame.mask.from_surface(self.source(path)).get_bounding_rects()
+            self.parts[path] = rects
+        return rects
+
+    def circle(self, color, radius):
+        """
+        Returns a shared transparent Surface with a filled circle,
+        used for bullets of the given color and radius.
+        """
+        key = ("circle", color, radius, True)
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.hits += 1
+            return surface
+        self.misses += 1
+        surface = pygame.Surface((radius*2, radius*2), pygame.SRCALPHA)
+        pygame.draw.circle(surface, color, (radius, radius), radius)
+        self.surfaces[key] = surface
+        return surface
+
+    def font(self, path, size):
+        """
+        Returns a cached Font so menus don't reopen the .ttf file.
+        Builds it from the bytes preload_font() read if they're in,
+        otherwise opens the file as before.
+        """
+        key = (path, size)
+        font = self.fonts.get(key)
+        if font is not None:
+            self.hits += 1
+            return font
+        self.misses += 1
+        pending = self.font_files.get(path)
+        data = pending.result() if pending is not None and pending.done() else None
+        font = pygame.font.Font(io.BytesIO(data) if data else path, size)
+        self.fonts[key] = font
+        return font
+
+    def preload_font(self, path):
+        """
+        Has io_worker read a .ttf file's bytes. Only the read happens
+        there: Fonts aren't safe to build off the main thread, and
+        the worker never touches the cache's dicts or counters.
+        """
+        if path not in self.font_files:
+            self.font_files[path] = io_worker.submit(read_file, path)
+
+    def trim(self):
+        """
+        Drops the unscaled source images once all the variants
+        we need are built (ground.png alone is ~50 MB decoded).
+        """
+        self.sources.clear()
+
+    def memory_bytes(self):
+        """
+        Approximate pixel memory held by cached Surfaces.
+        """
+        total = 0
+        for surface in list(self.sources.values()) + list(self.surfaces.values()):
+            total += surface.get_width() * surface.get_height() * surface.get_bytesize()
+        return total
+
+    def report(self):
+        """
+        Returns a short summary of cache hits/misses, memory use
+        and how many times each file was decoded.
+        """
+        lines = [
+            f"Assets: {self.hits} hits, {self.misses} misses "
+            f"({self.baked_loads} from the disk cache), {len(self.surfaces)} surfaces, "
+            f"{self.memory_bytes() / (1024 * 1024):.1f} MB"
+        ]
+        for path, count in sorted(self.decodes.items()):
+            lines.append(f"  decoded x{count}: {path}")
+        return "\n".join(lines)
+
+assets = AssetCache()  # Shared by every sprite and menu
+
+# Images shared by every sprite and menu, loaded by load_assets()
+menu_background = None
+play_button_img = play_button_img_replay = quit_button_img = None
+crosshair = None
+player_image = enemy_image = None
+
+# --- Tile Map ---
+TILE_SIZE = 128   # On-screen size of one ground tile
+CHUNK_TILES = 4   # Tiles along each side of a baked chunk (512 px)
+MAX_CHUNKS = 16   # Baked chunks kept in memory (a 1000x1000 view needs at most 9)
+TILESET_PLATES = [(6, 3), (8, 3)]  # Dark floor plates in the tileset sheet
+
+class TileMap:
+    """
+    The map's ground, built from small tiles instead of one huge
+    image. Tiles are grouped into chunks that are baked onto their
+    own Surface the first time they come into view and kept in an
+    LRU, so memory stays the same however big the map is.
+    """
+    def __init__(self, width, height, seed=1010):
+        self.width = width
+        self.height = height
+        self.seed = seed
+        self.chunk_px = TILE_SIZE * CHUNK_TILES
+        size = (TILE_SIZE, TILE_SIZE)
+        self.ground = assets.image(GROUND_TILE, size=size)
+        self.overlays = [assets.image(path, size=size, alpha=True) for path in GROUND_OVERLAYS]
+        self.plates = [assets.tile(TILESET_IMAGE, cell, 256, size) for cell in TILESET_PLATES]
+        self.chunks = OrderedDict()  # (cx, cy) -> baked Surface
+        self.baked = 0
+        self.evicted = 0
+
+    def tile_at(self, tx, ty):
+        """
+        Picks the tiles for one map cell: a list of Surfaces drawn
+        bottom to top. The pick is a hash of the cell, so the same
+        map comes out every time without storing it.
+        """
+        h = (tx * 73856093 ^ ty * 19349663 ^ self.seed * 83492791) & 0xffff
+        roll = h % 100
+        if roll < 3:
+            return [self.plates[h // 100 % len(self.plates)]]
+        if roll < 30:
+            return [self.ground, self.overlays[h // 100 % len(self.overlays)]]
+        return [self.ground]
+
+    def bake(self, cx, cy):
+        """
+        Draws every tile of chunk (cx, cy) onto a new Surface.
+        Chunks on the map edge are cut down to the map size.
+        """
+        x0, y0 = cx * self.chunk_px, cy * self.chunk_px
+        w = min(self.chunk_px, self.width - x0)
+        h = min(self.chunk_px, self.height - y0)
+        surface = pygame.Surface((w, h)).convert()
+        blits = []
+        for ty in range(CHUNK_TILES):
+            for tx in range(CHUNK_TILES):
+                pos = (tx * TILE_SIZE, ty * TILE_SIZE)
+                for image in self.tile_at(cx * CHUNK_TILES + tx, cy * CHUNK_TILES + ty):
+                    blits.append((image, pos))
+        surface.blits(blits, doreturn=False)
+        self.baked += 1
+        return surface
+
+    def chunk(self, cx, cy):
+        """
+        Returns the baked Surface for a chunk, baking it if needed
+        and evicting the least recently used chunk past MAX_CHUNKS.
+        """
+        key = (cx, cy)
+        surface = self.chunks.get(key)
+        if surface is None:
+            surface = self.bake(cx, cy)
+            self.chunks[key] = surface
+            if len(self.chunks) > MAX_CHUNKS:
+                self.chunks.popitem(last=False)
+                self.evicted += 1
+        else:
+            self.chunks.move_to_end(key)
+        return surface
+
+    def draw(self, surface, view):
+        """
+        Blits only the chunks overlapping the world-space view
+        rect, in one batched call. Returns how many were drawn.
+        """
+        size = self.chunk_px
+        x0 = max(0, view.left // size)
+        y0 = max(0, view.top // size)
+        x1 = min((self.width - 1) // size, (view.right - 1) // size)
+        y1 = min((self.height - 1) // size, (view.bottom - 1) // size)
+        blits = []
+        for cy in range(y0, y1 + 1):
+            for cx in range(x0, x1 + 1):
+                blits.append((self.chunk(cx, cy), (cx * size - view.x, cy * size - view.y)))
+        surface.blits(blits, doreturn=False)
+        return len(blits)
+
+    def memory_bytes(self):
+        return sum(s.get_width() * s.get_height() * s.get_bytesize()
+                   for s in self.chunks.values())
+
+    def report(self):
+        return (f"Tile map {self.width}x{self.height}: {len(self.chunks)} chunks cached "
+                f"({self.memory_bytes() / (1024 * 1024):.1f} MB), "
+                f"{self.baked} baked, {self.evicted} evicted")
+
+tile_map = None  # Built by load_assets()
+
+# --- Text Cache ---
+class TextCache:
+    """
+    Remembers rendered text Surfaces keyed by (font, text, color),
+    so labels that don't change aren't re-rendered every frame.
+    Least recently used entries are dropped past max_entries.
+    """
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # (font, text, color, antialias) -> Surface
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, font, text, color, antialias=True):
+        """
+        Same as font.render(text, antialias, color), but cached.
+        """
+        key = (font, text, color, antialias)
+        surface = self.entries.get(key)
+        if surface is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return surface
+        self.misses += 1
+        surface = font.render(text, antialias, color)
+        self.entries[key] = surface
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return surface
+
+    def report(self):
+        return (f"Text cache: {len(self.entries)} entries, "
+                f"{self.hits} hits, {self.misses} misses")
+
+text_cache = TextCache()  # Shared by the HUD and menus
+
+# --- Rotation Atlas ---
+PLAYER_ROTATION_BUCKETS = 360  # Distinct facing angles for the player
+ENEMY_ROTATION_BUCKETS = 72    # Distinct facing angles for enemies (5 degrees)
+
+class RotationAtlas:
+    """
+    Rotated copies of one image, one per angle bucket. Frames are
+    rotated the first time they're asked for and kept in an LRU,
+    so sprites that share an atlas never call transform.rotate
+    for an angle that has been seen before.
+    """
+    def __init__(self, image, buckets=PLAYER_ROTATION_BUCKETS, max_frames=None):
+        self.image = image
+        self.buckets = buckets
+        self.step = 360 / buckets       # Degrees per bucket
+        self.max_frames = max_frames or buckets
+        self.frames = OrderedDict()     # bucket -> rotated Surface
+        self.hits = 0
+        self.misses = 0
+
+    def bucket(self, angle):
+        """
+        Maps an angle in degrees (pygame's counter-clockwise) to a bucket.
+        """
+        return round(angle / self.step) % self.buckets
+
+    def frame(self, bucket):
+        """
+        Returns the rotated Surface for a bucket, building it if needed.
+        """
+        surface = self.frames.get(bucket)
+        if surface is not None:
+            self.hits += 1
+            self.frames.move_to_end(bucket)
+            return surface
+        self.misses += 1
+        surface = pygame.transform.rotate(self.image, bucket * self.step)
+        self.frames[bucket] = surface
+        if len(self.frames) > self.max_frames:
+            self.frames.popitem(last=False)  # Evict least recently used
+        return surface
+
+    def prebuild(self):
+        """
+        Builds every frame up front (e.g. at startup).
+        """
+        for bucket in range(self.buckets):
+            self.frame(bucket)
+
+    def report(self):
+        return (f"Rotation atlas ({self.buckets} buckets): {len(self.frames)} frames, "
+                f"{self.hits} hits, {self.misses} misses")
+
+enemy_atlas = None  # Built by load_assets()
+
+# --- Sprite Sheets & Animation ---
+SKINS_IMAGE = ASSET_DIR + "/Premium Content/Skins.png"
+WEAPONS_IMAGE = ASSET_DIR + "/Premium Content/Weapons.png"
+SKIN_GRID = (4, 8)          # Columns and rows of skin sets on the skins sheet
+LOOK_CANVAS = (300, 510)    # Sheet pixels one skin + gun is laid out on
+GUN_PARTS = {"Handgun": 2, "Rifle": 3, "Shotgun": 4}  # Gun name -> shape on the weapons sheet
+MAX_LOOKS = 6               # Skin/gun looks with a rotation atlas kept in memory
+SWAP_FRAMES = 6             # Cross-fade frames when the player changes skin or gun
+SWAP_FRAME_MS = 40
+HIT_FLASH_MS = 40           # Each of the two frames an enemy flashes for when hit
+DEATH_FRAMES = 6            # Frames of an enemy shrinking away
+DEATH_FRAME_MS = 50
+SPARKS_PER_DEATH = 6        # Goo drops thrown out when an enemy dies
+SPARK_SPEED = 160           # Fastest drop, pixels per second
+PLAYER_SKIN = 1             # Starting skin (0-31), e.g. --skin=12; K cycles through them
+
+class Animation:
+    """
+    Frames shown one after another for frame_ms each, built once
+    and shared by everything that plays it; players only keep the
+    time they started. Every frame is a RotationAtlas, so it can
+    be played at any facing.
+    """
+    def __init__(self, images, frame_ms, buckets=1, max_frames=None):
+        self.frames = [RotationAtlas(image, buckets, max_frames) for image in images]
+        self.frame_ms = frame_ms
+        self.duration = frame_ms * len(images)  # ms until the last frame ends
+
+    def frame(self, elapsed, bucket=0):
+        """
+        The Surface to show elapsed ms after starting, turned to
+        an angle bucket. Holds the last frame once it's over.
+        """
+        index = min(int(elapsed // self.frame_ms), len(self.frames) - 1)
+        return self.frames[index].frame(bucket)
+
+def faded(image, alpha, scale=1.0):
+    """
+    Copy of image with its transparency multiplied by alpha/255,
+    optionally shrunk.
+    """
+    if scale != 1.0:
+        image = pygame.transform.rotozoom(image, 0, scale)
+    image = image.copy()
+    image.fill((255, 255, 255, alpha), special_flags=pygame.BLEND_RGBA_MULT)
+    return image
+
+def flashed(image, amount):
+    """
+    Copy of image brightened toward white by amount (0-255).
+    """
+    image = image.copy()
+    image.fill((amount, amount, amount), special_flags=pygame.BLEND_RGB_ADD)
+    return image
+
+def cross_fade(old, new, steps):
+    """
+    Frames blending from old into new (same size Surfaces).
+    """
+    frames = []
+    for i in range(1, steps + 1):
+        alpha = 255 * i // (steps + 1)
+        frame = faded(old, 255 - alpha)
+        frame.blit(faded(new, alpha), (0, 0))
+        frames.append(frame)
+    return frames
+
+def goo_drop(radius, alpha):
+    """
+    A round drop of bug goo, for death bursts.
+    """
+    surface = pygame.Surface((radius * 2, radius * 2), pygame.SRCALPHA)
+    pygame.draw.circle(surface, (110, 190, 40, alpha), (radius, radius), radius)
+    return surface
+
+class PlayerLooks:
+    """
+    Player images put together from the skins and weapons sheets:
+    a skin set (backpack, torso, head and two arms) holding the
+    current gun. Both sheets are cut into parts once, scaled for
+    the player, and every look is composed from those parts the
+    first time it's worn (then baked to the asset cache, so later
+    launches don't open the sheets at all). Looks fit the box of
+    player_image, so hitboxes don't depend on the skin.
+    """
+    def __init__(self, size):
+        self.size = size
+        self.scale = min(size[0] / LOOK_CANVAS[0], size[1] / LOOK_CANVAS[1])
+        self.skins = SKIN_GRID[0] * SKIN_GRID[1]
+        self.parts = None   # skin -> [backpack, torso, head, left arm, right arm]
+        self.guns = None    # gun name -> scaled gun part
+        self.atlases = OrderedDict()  # (skin, gun name) -> RotationAtlas
+        self.swaps = OrderedDict()    # (old look, new look) -> Animation
+        self.slices = 0
+        # Changing how looks are laid out (the constants, or the
+        # offsets in compose()) changes every baked look's key
+        layout = (SKIN_GRID, LOOK_CANVAS, sorted(GUN_PARTS.items()),
+                  [c for c in PlayerLooks.compose.__code__.co_consts
+                   if isinstance(c, (int, float))])
+        self.layout = hashlib.sha1(repr(layout).encode()).hexdigest()[:12]
+
+    def _cut(self, sheet, rect):
+        w = max(1, round(rect.width * self.scale))
+        h = max(1, round(rect.height * self.scale))
+        return pygame.transform.smoothscale(sheet.subsurface(rect), (w, h))
+
+    def slice(self):
+        """
+        Cuts both sheets into scaled parts. The skin sets are on a
+        SKIN_GRID, each part found by its shape rather than by
+        coordinates (they shift a little from set to set).
+        """
+        sheet = assets.source(SKINS_IMAGE)
+        cols, rows = SKIN_GRID
+        cell_w, cell_h = sheet.get_width() // cols, sheet.get_height() // rows
+        sets = [[] for _ in range(self.skins)]
+        for rect in assets.sheet_parts(SKINS_IMAGE):
+            sets[rect.centery // cell_h * cols + rect.centerx // cell_w].append(rect)
+        self.parts = []
+        for rects in sets:
+            # Left to right: backpack over torso, head, left arm, right arm
+            rects.sort(key=lambda r: r.x)
+            rects[:2] = sorted(rects[:2], key=lambda r: r.y)
+            self.parts.append([self._cut(sheet, rect) for rect in rects])
+        sheet = assets.source(WEAPONS_IMAGE)
+        rects = sorted(assets.sheet_parts(WEAPONS_IMAGE), key=lambda r: r.x)
+        self.guns = {name: self._cut(sheet, rects[i]) for name, i in GUN_PARTS.items()}
+        assets.trim()  # The sheets are ~60 MB decoded; the parts are all we need
+        self.slices += 1
+
+    def compose(self, skin, gun):
+        """
+        Lays out one skin holding one gun, facing down like the
+        rest of the player art.
+        """
+        if self.parts is None:
+            self.slice()
+        backpack, torso, head, left_arm, right_arm = self.parts[skin]
+        gun_part = self.guns[gun]
+        canvas = pygame.Surface(self.size, pygame.SRCALPHA)
+        s = self.scale
+        left = (self.size[0] - LOOK_CANVAS[0] * s) / 2
+        top = (self.size[1] - LOOK_CANVAS[1] * s) / 2
+        middle = LOOK_CANVAS[0] / 2
+        def put(part, x, y):
+            # x, y: top-left in LOOK_CANVAS (sheet) pixels
+            canvas.blit(part, (round(left + x * s), round(top + y * s)))
+        def centered(part, y, shift=0):
+            put(part, middle + shift - part.get_width() / s / 2, y)
+        centered(backpack, 0)
+        centered(torso, 100)
+        # The gun's grip sits in the hands; long guns poke out past them
+        centered(gun_part, max(140, 380 - gun_part.get_height() / s), shift=8)
+        put(left_arm, middle - 128, 120)
+        put(right_arm, middle + 128 - right_arm.get_width() / s, 120)
+        centered(head, 80)
+        return canvas.convert_alpha()
+
+    def image(self, skin, gun):
+        return assets.derived(("look", skin, gun, self.size, self.layout),
+                              (SKINS_IMAGE, WEAPONS_IMAGE), lambda: self.compose(skin, gun))
+
+    def atlas(self, skin, gun):
+        """
+        RotationAtlas for a skin holding a gun (by name).
+        """
+        key = (skin, gun)
+        atlas = self.atlases.get(key)
+        if atlas is None:
+            atlas = RotationAtlas(self.image(skin, gun), PLAYER_ROTATION_BUCKETS, max_frames=120)
+            self.atlases[key] = atlas
+            if len(self.atlases) > MAX_LOOKS:
+                self.atlases.popitem(last=False)
+        else:
+            self.atlases.move_to_end(key)
+        return atlas
+
+    def swap(self, old, new):
+        """
+        Cross-fade Animation between two looks, each a (skin, gun name).
+        """
+        key = (old, new)
+        animation = self.swaps.get(key)
+        if animation is None:
+            frames = cross_fade(self.image(*old), self.image(*new), SWAP_FRAMES)
+            animation = Animation(frames, SWAP_FRAME_MS, PLAYER_ROTATION_BUCKETS, max_frames=12)
+            self.swaps[key] = animation
+            if len(self.swaps) > MAX_LOOKS:
+                self.swaps.popitem(last=False)
+        else:
+            self.swaps.move_to_end(key)
+        return animation
+
+    def report(self):
+        hits = sum(a.hits for a in self.atlases.values())
+        misses = sum(a.misses for a in self.atlases.values())
+        return (f"Player looks: {len(self.atlases)} in memory, sheets sliced "
+                f"{self.slices}x, rotations {hits} hits, {misses} misses")
+
+player_looks = None  # Built by load_assets()
+# Shared enemy animations, built by load_assets()
+enemy_hit_animation = enemy_death_animation = spark_animation = None
+
+# --- Effects ---
+EFFECT_CAPACITY = 1024    # Effect slots; a full ring reuses the oldest
+EFFECT_DRAW_BUDGET = 400  # Most effects blitted in one frame
+
+class EffectPool:
+    """
+    Fixed ring of effect slots, each an Animation playing at a
+    point and drifting at a constant speed. Spawning fills the
+    next slot in place, so effects never allocate, and when the
+    ring is full the oldest effect is the one cut short. Positions
+    are worked out from the start time when drawn, so there is no
+    per-effect work in sim ticks, and draw() stops after
+    EFFECT_DRAW_BUDGET blits however many effects are playing.
+    """
+    def __init__(self, capacity=EFFECT_CAPACITY, seed=1010):
+        # [animation, x, y, vx, vy, start ms, bucket]; no animation = free
+        self.slots = [[None, 0.0, 0.0, 0.0, 0.0, 0, 0] for _ in range(capacity)]
+        self.next = 0      # Slot the next effect goes in
+        self.longest = 0   # Longest animation spawned so far, in ms
+        self.random = random.Random(seed)  # Own generator: effects never touch the game's random
+        self.spawned = 0
+        self.recycled = 0     # Effects cut short because the ring came round
+        self.over_budget = 0  # Frames that hit EFFECT_DRAW_BUDGET
+
+    def spawn(self, animation, x, y, vx=0.0, vy=0.0, bucket=0):
+        """
+        Starts animation at world point (x, y), moving at (vx, vy)
+        pixels per second, turned to an angle bucket.
+        """
+        slot = self.slots[self.next]
+        now = sim_clock.now()
+        if slot[0] is not None and now - slot[5] < slot[0].duration:
+            self.recycled += 1
+        slot[0], slot[1], slot[2], slot[3] = animation, x, y, vx
+        slot[4], slot[5], slot[6] = vy, now, bucket
+        self.next = (self.next + 1) % len(self.slots)
+        self.longest = max(self.longest, animation.duration)
+        self.spawned += 1
+
+    def burst(self, animation, x, y, count, speed):
+        """
+        Throws count copies of animation out from (x, y) in random
+        directions at up to speed pixels per second.
+        """
+        for _ in range(count):
+            angle = self.random.uniform(0, math.tau)
+            v = speed * self.random.uniform(0.3, 1.0)
+            self.spawn(animation, x, y, math.cos(angle) * v, math.sin(angle) * v)
+
+    def draw(self, surface, view, now):
+        """
+        Blits the effects inside the world-space view rect, newest
+        first, up to EFFECT_DRAW_BUDGET. Slots are walked back from
+        the newest and the walk stops at the first one older than
+        the longest animation, since every slot before it has
+        finished too. Returns how many were drawn.
+        now: sim time to draw at, in ms (between ticks when interpolating)
+        """
+        slots = self.slots
+        capacity = len(slots)
+        area = view.inflate(CULL_MARGIN * 2, CULL_MARGIN * 2)
+        left, top, right, bottom = area.left, area.top, area.right, area.bottom
+        blits = []
+        i = self.next
+        for _ in range(capacity):
+            i = (i - 1) % capacity
+            animation, x, y, vx, vy, start, bucket = slots[i]
+            if animation is None:
+                break
+            elapsed = max(0.0, now - start)
+            if elapsed >= self.longest:
+                break
+            if elapsed >= animation.duration:
+                continue
+            x += vx * elapsed / 1000
+            y += vy * elapsed / 1000
+            if not (left < x < right and top < y < bottom):
+                continue
+            if len(blits) == EFFECT_DRAW_BUDGET:
+                self.over_budget += 1
+                break
+            image = animation.frame(elapsed, bucket)
+            blits.append((image, (x - image.get_width() // 2 - view.x,
+                                  y - image.get_height() // 2 - view.y)))
+        blits.reverse()  # Oldest underneath
+        surface.blits(blits, doreturn=False)
+        return len(blits)
+
+    def clear(self):
+        for slot in self.slots:
+            slot[0] = None
+        self.next = 0
+
+    def report(self):
+        return (f"Effects: {len(self.slots)} slots, {self.spawned} spawned, "
+                f"{self.recycled} cut short, {self.over_budget} frames over the draw budget")
+
+effects = EffectPool()  # Hit, death and swap effects in world space
+
+def enemy_death_effect(x, y, bucket):
+    """
+    An enemy centered at (x, y) facing bucket shrinks away and
+    throws out goo.
+    """
+    effects.spawn(enemy_death_animation, x, y, bucket=bucket)
+    effects.burst(spark_animation, x, y, SPARKS_PER_DEATH, SPARK_SPEED)
+
+def load_assets():
+    """
+    Loads and scales every image the game starts with (from the
+    disk cache when it can) and builds what depends on them.
+    """
+    global menu_background, play_button_img, play_button_img_replay, quit_button_img
+    global crosshair, player_image, enemy_image, tile_map, player_looks, enemy_atlas
+    global enemy_hit_animation, enemy_death_animation, spark_animation
+    # Load and scale the menu background
+    menu_background = assets.image(MENU_BACKGROUND_IMAGE, size=screen_size)
+    # Load UI button images and scale them
+    play_button_img = assets.image(PLAY_BUTTON_IMAGE, size=(400, 125), alpha=True)
+    play_button_img_replay = assets.image(PLAY_BUTTON_IMAGE, size=(600, 130), alpha=True)
+    quit_button_img = assets.image(QUIT_BUTTON_IMAGE, size=(400, 125), alpha=True)
+    # Crosshair sprite for aiming
+    crosshair = assets.image(CROSSHAIR_IMAGE, alpha=True)
+    # Sprites for the player and enemies, scaled once and shared
+    player_image = assets.image(PLAYER_IMAGE, scale=player_size, alpha=True)
+    enemy_image = assets.image(ENEMY_IMAGE, scale=player_size, alpha=True)
+    tile_map = TileMap(MAP_WIDTH, MAP_HEIGHT)
+    assets.trim()
+    # Player art faces down, the bug faces right
+    player_looks = PlayerLooks(player_image.get_size())
+    player_looks.atlas(PLAYER_SKIN, AssaultRifle.name)  # The look every game starts in
+    enemy_atlas = RotationAtlas(enemy_image, ENEMY_ROTATION_BUCKETS)
+    enemy_hit_animation = Animation([flashed(enemy_image, 200), flashed(enemy_image, 100)],
+                                    HIT_FLASH_MS, ENEMY_ROTATION_BUCKETS)
+    shrinking = [faded(enemy_image, 255 * (DEATH_FRAMES - i) // DEATH_FRAMES,
+                       1 - i / DEATH_FRAMES / 1.5) for i in range(DEATH_FRAMES)]
+    enemy_death_animation = Animation(shrinking, DEATH_FRAME_MS, ENEMY_ROTATION_BUCKETS,
+                                      max_frames=24)
+    drops = [goo_drop(radius, alpha) for radius, alpha in ((4, 255), (4, 200), (3, 150), (2, 100))]
+    spark_animation = Animation(drops, 60)
+
+# --- Spatial Hash Grid ---
+GRID_CELL_SIZE = 100  # Size of one broadphase cell in world pixels
+
+class SpatialGrid:
+    """
+    Uniform grid over the map that buckets sprites by the cells
+    their rect overlaps. Collision checks only look at sprites
+    in nearby cells instead of testing every pair.
+    """
+    def __init__(self, cell_size=GRID_CELL_SIZE):
+        self.cell_size = cell_size
+        self.cells = {}         # (cx, cy) -> {sprite: None}, keeps insert order
+        self.sprite_cells = {}  # sprite -> (x0, y0, x1, y1) cell range
+
+    def cell_range(self, rect):
+        """
+        Returns the inclusive range of cells a rect overlaps.
+        """
+        size = self.cell_size
+        return (rect.left // size, rect.top // size,
+                (rect.right - 1) // size, (rect.bottom - 1) // size)
+
+    def move(self, sprite):
+        """
+        Inserts the sprite or updates its cells after it moved.
+        Does nothing if it is still inside the same cells.
+        """
+        new_range = self.cell_range(sprite.rect)
+        old_range = self.sprite_cells.get(sprite)
+        if old_range == new_range:
+            return
+        if old_range is not None:
+            self._unlink(sprite, old_range)
+        x0, y0, x1, y1 = new_range
+        for cx in range(x0, x1 + 1):
+            for cy in range(y0, y1 + 1):
+                self.cells.setdefault((cx, cy), {})[sprite] = None
+        self.sprite_cells[sprite] = new_range
+
+    def remove(self, sprite):
+        """
+        Takes a sprite out of the grid (safe to call twice).
+        """
+        old_range = self.sprite_cells.pop(sprite, None)
+        if old_range is not None:
+            self._unlink(sprite, old_range)
+
+    def _unlink(self, sprite, cell_range):
+        x0, y0, x1, y1 = cell_range
+        for cx in range(x0, x1 + 1):
+            for cy in range(y0, y1 + 1):
+                bucket = self.cells.get((cx, cy))
+                if bucket is not None:
+                    bucket.pop(sprite, None)
+                    if not bucket:
+                        del self.cells[(cx, cy)]
+
+    def query(self, rect):
+        """
+        Returns the sprites in every cell the rect overlaps,
+        in a stable order. These are only candidates; callers
+        still need an exact colliderect check.
+        """
+        found = {}
+        x0, y0, x1, y1 = self.cell_range(rect)
+        for cx in range(x0, x1 + 1):
+            for cy in range(y0, y1 + 1):
+                bucket = self.cells.get((cx, cy))
+                if bucket:
+                    found.update(bucket)
+        return found
+
+    def collide(self, rect):
+        """
+        Returns the sprites whose rect actually overlaps rect.
+        """
+        return [s for s in self.query(rect) if rect.colliderect(s.rect)]
+
+    def clear(self):
+        self.cells.clear()
+        self.sprite_cells.clear()
+
+enemy_grid = SpatialGrid()   # Broadphase for enemy sprites
+bullet_grid = SpatialGrid()  # Broadphase for bullet sprites
+world_rect = pygame.Rect(0, 0, MAP_WIDTH, MAP_HEIGHT)  # Whole map in world space
+
+# --- Flow Field ---
+FLOW_CELL_SIZE = 64     # Size of one flow field cell in world pixels
+FLOW_BUDGET = 8000      # Cells a rebuild may visit per sim tick
+FLOW_LOOKAHEAD = 4      # Cells ahead on the path each arrow points at
+FLOW_RADIUS = 32        # Rings of cells searched around the players (the default map is 32x32)
+SEPARATION_RADIUS = 48  # Enemies closer than this push each other apart
+SEPARATION_WEIGHT = 0.6  # How strongly separation bends the flow direction
+SEPARATION_NEIGHBOURS = 12  # Most neighbours one sprite enemy checks
+SEPARATION_EVERY = 4     # Sprite enemies refresh their push every N ticks
+# Neighbour steps, straight ones first so they win ties
+FLOW_STEPS = [(1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (-1, 1), (1, -1), (-1, -1)]
+
+class FlowField:
+    """
+    Grid over the map where every cell stores which way to walk to
+    reach the player, found with one breadth-first search out from
+    the player's cell. Enemies then steer with a single lookup
+    instead of each searching for a path. In co-op the search
+    starts from every player's cell at once, so each cell leads to
+    the nearest player.
+
+    The field is only rebuilt when the player enters a new cell,
+    and a rebuild is spread over as many ticks as it needs
+    (FLOW_BUDGET cells each). Enemies keep following the old field
+    until the new one is finished. Cells marked with block() are
+    walls the search goes around (diagonals never cut their corners).
+
+    The search stops FLOW_RADIUS cells out from the players, so a
+    rebuild costs the same on any map size; enemies beyond that
+    (or cut off) steer straight at the nearest player until they
+    are close enough to follow the field.
+    """
+    def __init__(self, width, height, cell_size=FLOW_CELL_SIZE):
+        self.cell_size = cell_size
+        self.cols = -(-width // cell_size)
+        self.rows = -(-height // cell_size)
+        self.cells = self.cols * self.rows
+        self.blocked = bytearray(self.cells)  # 1 = obstacle
+        self.has_obstacles = False
+        self.target = None    # Goal (player cells) the finished field leads to
+        self.building = None  # Goal being searched from, if any
+        self.pending = None   # Newest goal, waiting for the build to end
+        self.flow = None      # Finished field, see finish()
+        self.dist = None      # Ring each cell was reached on, -1 if not (kept between builds)
+        self.parent = None    # Cell each one was reached from, itself if not
+        self.reached = []     # Cells the current search reached, one list/array per ring
+        self.near = None      # Cells on or next to a wall, worked out once per block()
+        self.rebuilds = 0
+        self.build_ms = 0.0   # Total time spent on the last rebuild
+        self.searched = 0     # Cells the last rebuild reached
+
+    def cell_index(self, x, y):
+        """
+        Cell index for a world position, clamped to the map.
+        """
+        cx = min(max(int(x) // self.cell_size, 0), self.cols - 1)
+        cy = min(max(int(y) // self.cell_size, 0), self.rows - 1)
+        return cy * self.cols + cx
+
+    def block(self, rect):
+        """
+        Marks every cell the world-space rect overlaps as an
+        obstacle. Takes effect from the next rebuild.
+        """
+        size = self.cell_size
+        for cy in range(max(rect.top // size, 0), min((rect.bottom - 1) // size + 1, self.rows)):
+            for cx in range(max(rect.left // size, 0), min((rect.right - 1) // size + 1, self.cols)):
+                self.blocked[cy * self.cols + cx] = 1
+                self.has_obstacles = True
+        self.near = None
+
+    def goal(self, positions):
+        """
+        Sorted tuple of the cells holding positions, which is what
+        a search starts from.
+        """
+        return tuple(sorted({self.cell_index(*pos) for pos in positions}))
+
+    def reset(self, *positions):
+        """
+        Builds the whole field toward positions right away (new game).
+        """
+        self.pending = None
+        self.start(self.goal(positions))
+        while self.building is not None:
+            self.step(self.cells)
+
+    def update(self, *positions):
+        """
+        Called once per tick with every living player's position.
+        Starts a rebuild when a player changed cell and advances the
+        current one by FLOW_BUDGET cells.
+        """
+        goal = self.goal(positions)
+        if self.building is None:
+            if goal != self.target:
+                self.start(goal)
+        elif goal != self.building:
+            self.pending = goal
+        if self.building is not None:
+            self.step(FLOW_BUDGET)
+
+    def start(self, goal):
+        self.building = goal
+        self.build_ms = 0.0
+        if self.dist is None:
+            if np is not None:
+                self.dist = np.full(self.cells, -1, dtype=np.int32)
+                self.parent = np.arange(self.cells, dtype=np.int32)
+            else:
+                self.dist = [-1] * self.cells
+                self.parent = list(range(self.cells))
+        if np is not None:
+            self.frontier = np.array(goal, dtype=np.int32)
+            self.walls = None
+            if self.has_obstacles:  # Walls as they were when this build began
+                self.walls = np.frombuffer(self.blocked, dtype=np.uint8).astype(bool)
+        else:
+            self.frontier = list(goal)
+        for cell in goal:
+            self.dist[cell] = 0
+        self.reached = [self.frontier]
+        self.ring = 0
+
+    def step(self, budget):
+        """
+        Expands the search one ring of cells at a time until
+        'budget' cells have been visited or every cell within
+        FLOW_RADIUS rings is covered.
+        """
+        start = time.perf_counter()
+        visited = 0
+        while len(self.frontier) and self.ring < FLOW_RADIUS and visited < budget:
+            visited += len(self.frontier)
+            self.ring += 1
+            if np is not None:
+                self._expand_array()
+            else:
+                self._expand_list()
+            self.reached.append(self.frontier)
+        if not len(self.frontier) or self.ring >= FLOW_RADIUS:
+            self.finish()
+        self.build_ms += (time.perf_counter() - start) * 1000
+
+    def _expand_array(self):
+        """
+        One ring of the search as NumPy operations on the whole
+        frontier at once.
+        """
+        cols, rows = self.cols, self.rows
+        frontier = self.frontier
+        fx, fy = (frontier % cols)[:, None], (frontier // cols)[:, None]
+        dx, dy = np.array(FLOW_STEPS, dtype=np.int32).T
+        nx, ny = fx + dx, fy + dy
+        ok = (nx >= 0) & (nx < cols) & (ny >= 0) & (ny < rows)
+        nx, ny = np.where(ok, nx, fx), np.where(ok, ny, fy)
+        index = ny * cols + nx
+        ok &= self.dist[index] < 0
+        if self.walls is not None:
+            walls = self.walls
+            ok &= ~(walls[index] | walls[fy * cols + nx] | walls[ny * cols + fx])
+        parents = np.broadcast_to(frontier[:, None], index.shape)[ok]
+        found, first = np.unique(index[ok], return_index=True)
+        self.dist[found] = self.ring
+        self.parent[found] = parents[first]
+        self.frontier = found.astype(np.int32)
+
+    def _expand_list(self):
+        """
+        Same as _expand_array in plain Python (no NumPy).
+        """
+        cols, rows = self.cols, self.rows
+        dist, parent, blocked = self.dist, self.parent, self.blocked
+        found = []
+        for cell in self.frontier:
+            fx, fy = cell % cols, cell // cols
+            for dx, dy in FLOW_STEPS:
+                nx, ny = fx + dx, fy + dy
+                if not (0 <= nx < cols and 0 <= ny < rows):
+                    continue
+                index = ny * cols + nx
+                if dist[index] >= 0:
+                    continue
+                if blocked[index] or blocked[fy * cols + nx] or blocked[ny * cols + fx]:
+                    continue
+                dist[index] = self.ring
+                parent[index] = cell
+                found.append(index)
+        self.frontier = found
+
+    def finish(self):
+        """
+        Turns the search result into one unit vector per cell,
+        pointing FLOW_LOOKAHEAD steps ahead along the path (this
+        smooths out the 8-way grid moves). Cells touching a wall
+        point just one step ahead so they don't cut its corner.
+        Cells next to the player, cut off from it or beyond the
+        search get (0, 0), which means "steer straight at the player".
+        Only the cells the search reached are worked on, and their
+        dist/parent entries are cleared again for the next search.
+        """
+        cols = self.cols
+        if np is not None:
+            cell = np.concatenate(self.reached)
+            ahead = self.parent[cell]
+            for _ in range(FLOW_LOOKAHEAD - 1):
+                ahead = self.parent[ahead]
+            if self.has_obstacles:
+                ahead = np.where(self.near_walls()[cell], self.parent[cell], ahead)
+            vectors = np.stack([ahead % cols - cell % cols,
+                                ahead // cols - cell // cols], axis=1).astype(np.float32)
+            length = np.hypot(vectors[:, 0], vectors[:, 1])
+            direct = (self.dist[cell] <= 1) | (length == 0)
+            length[direct] = 1
+            vectors /= length[:, None]
+            vectors[direct] = 0
+            flow = np.zeros((self.cells, 2), dtype=np.float32)
+            flow[cell] = vectors
+            self.dist[cell] = -1
+            self.parent[cell] = cell
+        else:
+            flow = [(0.0, 0.0)] * self.cells
+            cells = [cell for ring in self.reached for cell in ring]
+            for cell in cells:
+                ahead = cell
+                steps = 1 if self.near_wall(cell) else FLOW_LOOKAHEAD
+                for _ in range(steps):
+                    ahead = self.parent[ahead]
+                vx, vy = ahead % cols - cell % cols, ahead // cols - cell // cols
+                length = math.hypot(vx, vy)
+                if self.dist[cell] > 1 and length > 0:
+                    flow[cell] = (vx / length, vy / length)
+            for cell in cells:
+                self.dist[cell] = -1
+                self.parent[cell] = cell
+        self.flow = flow
+        self.target, self.building = self.building, None
+        self.searched = sum(len(ring) for ring in self.reached)
+        self.reached = []
+        self.frontier = self.walls = None
+        self.rebuilds += 1
+        if self.pending is not None:
+            goal, self.pending = self.pending, None
+            if goal != self.target:
+                self.start(goal)
+
+    def near_walls(self):
+        """
+        Bool array of the cells on or next to a wall (NumPy path).
+        """
+        if self.near is None:
+            walls = np.pad(np.frombuffer(self.blocked, dtype=np.uint8).astype(bool)
+                           .reshape(self.rows, self.cols), 1)
+            near = np.zeros((self.rows, self.cols), dtype=bool)
+            for dy in range(3):
+                for dx in range(3):
+                    near |= walls[dy:dy + self.rows, dx:dx + self.cols]
+            self.near = near.ravel()
+        return self.near
+
+    def near_wall(self, cell):
+        """
+        True if the cell or one of its 8 neighbours is blocked.
+        """
+        if not self.has_obstacles:
+            return False
+        cx, cy = cell % self.cols, cell // self.cols
+        for ny in range(max(cy - 1, 0), min(cy + 2, self.rows)):
+            for nx in range(max(cx - 1, 0), min(cx + 2, self.cols)):
+                if self.blocked[ny * self.cols + nx]:
+                    return True
+        return False
+
+    def direction(self, x, y):
+        """
+        Flow vector (dx, dy) for the cell containing the integer
+        point (x, y), which must be inside the map.
+        """
+        size = self.cell_size
+        vx, vy = self.flow[y // size * self.cols + x // size]
+        return float(vx), float(vy)
+
+    def directions(self, points):
+        """
+        Flow vectors for an (n, 2) array of world positions,
+        one array lookup for all of them.
+        """
+        cells = np.clip((points // self.cell_size).astype(np.int32), 0,
+                        (self.cols - 1, self.rows - 1))
+        return self.flow[cells[:, 1] * self.cols + cells[:, 0]]
+
+    def report(self):
+        return (f"Flow field: {self.cols}x{self.rows} cells, {self.rebuilds} rebuilds, "
+                f"last reached {self.searched} cells in {self.build_ms:.2f} ms")
+
+flow_field = FlowField(MAP_WIDTH, MAP_HEIGHT)  # Shared path to the player
+
+def set_map(width, height):
+    """
+    Changes the map size (--map=WxH) and remakes everything sized
+    by it. Call it before new_game().
+    """
+    global MAP_WIDTH, MAP_HEIGHT, world_rect, flow_field, tile_map
+    MAP_WIDTH, MAP_HEIGHT = width, height
+    world_rect = pygame.Rect(0, 0, width, height)
+    flow_field = FlowField(width, height)
+    if tile_map is not None:
+        tile_map = TileMap(width, height)
+
+# --- Controls ---
+class Controls:
+    """
+    Everything the player asked for during one sim tick: held
+    movement keys, the cursor, and one-shot actions (fire, reload,
+    weapon switch). Kept up to date by InputDispatcher in a normal
+    game or built by a script when running headless.
+    """
+    def __init__(self, up=False, left=False, down=False, right=False,
+                 cursor=SCREEN_CENTER,
+                 fire=False, reload=False, weapon=None, quit=False):
+        self.up, self.left, self.down, self.right = up, left, down, right
+        self.cursor = cursor  # Mouse position in screen coordinates
+        self.fire = fire      # Left click this tick
+        self.reload = reload  # R pressed this tick
+        self.weapon = weapon  # Weapon slot 1/2/3 picked this tick, or None
+        self.quit = quit      # Window closed
+
+    def consume(self):
+        """
+        Clears the one-shot actions once a sim tick has used them,
+        so one click only fires once even if a frame runs many ticks.
+        """
+        self.fire = self.reload = False
+        self.weapon = None
+
+# Every key the game listens to, and what it does. Add a second
+# key for an action by giving it its own entry.
+KEY_BINDINGS = {
+    pygame.K_w: "up", pygame.K_a: "left", pygame.K_s: "down", pygame.K_d: "right",
+    pygame.K_UP: "up", pygame.K_LEFT: "left", pygame.K_DOWN: "down", pygame.K_RIGHT: "right",
+    pygame.K_r: "reload",
+    pygame.K_1: "weapon_1", pygame.K_2: "weapon_2", pygame.K_3: "weapon_3",
+    pygame.K_k: "skin",
+    pygame.K_F3: "profiler",
+}
+MOUSE_BINDINGS = {1: "fire"}  # Mouse button -> action
+MOVE_ACTIONS = ("up", "left", "down", "right")
+
+class InputDispatcher:
+    """
+    Turns pygame events into Controls. dispatch() drains the event
+    queue once per frame and hands each event to the handlers
+    registered for its type with on(); the built-in ones keep one
+    Controls up to date (held keys from KEYDOWN/KEYUP, the cursor
+    from mouse motion, clicks and key presses as one-shot actions),
+    so a frame with no input costs next to nothing.
+    """
+    def __init__(self, bindings=KEY_BINDINGS, mouse_bindings=MOUSE_BINDINGS):
+        self.bindings = bindings
+        self.mouse_bindings = mouse_bindings
+        self.handlers = {}      # Event type -> list of handler(event)
+        self.held_keys = set()  # Bound keys currently down
+        self.controls = Controls()
+        self.on(pygame.KEYDOWN, self.key_down)
+        self.on(pygame.KEYUP, self.key_up)
+        self.on(pygame.MOUSEBUTTONDOWN, self.mouse_down)
+        self.on(pygame.MOUSEMOTION, self.mouse_motion)
+        self.on(pygame.QUIT, self.quit)
+        self.on(pygame.WINDOWFOCUSLOST, self.release_all)
+
+    def on(self, event_type, handler):
+        """
+        Registers handler(event) for every event of event_type.
+        """
+        self.handlers.setdefault(event_type, []).append(handler)
+
+    def reset(self):
+        """
+        Forgets held keys and pending actions (new game).
+        """
+        self.held_keys.clear()
+        self.controls = Controls(cursor=pygame.mouse.get_pos())
+
+    def poll(self):
+        """
+        Dispatches this frame's events and returns the Controls.
+        It is the same object every frame; sim ticks consume()
+        its one-shot actions.
+        """
+        for event in pygame.event.get():
+            for handler in self.handlers.get(event.type, ()):
+                handler(event)
+        return self.controls
+
+    def _update_moves(self):
+        held = {self.bindings[key] for key in self.held_keys}
+        for action in MOVE_ACTIONS:
+            setattr(self.controls, action, action in held)
+
+    def key_down(self, event):
+        action = self.bindings.get(event.key)
+        if action is None:
+            return
+        if action in MOVE_ACTIONS:
+            self.held_keys.add(event.key)
+            self._update_moves()
+        elif action == "reload":
+            self.controls.reload = True
+        elif action.startswith("weapon_"):
+            self.controls.weapon = int(action[7:])
+        elif action == "profiler":
+            profiler.toggle_overlay()  # Debug overlay, not part of the sim
+        elif action == "skin" and player is not None:
+            player.next_skin()  # Looks only, not part of the sim
+
+    def key_up(self, event):
+        if event.key in self.held_keys:
+            self.held_keys.discard(event.key)
+            self._update_moves()
+
+    def mouse_down(self, event):
+        self.controls.cursor = event.pos
+        if self.mouse_bindings.get(event.button) == "fire":
+            self.controls.fire = True
+
+    def mouse_motion(self, event):
+        self.controls.cursor = event.pos
+
+    def quit(self, event):
+        self.controls.quit = True
+
+    def release_all(self, event):
+        """
+        Drops held keys when the window loses focus, since their
+        KEYUP events will go to another window.
+        """
+        self.held_keys.clear()
+        self._update_moves()
+
+input_dispatcher = InputDispatcher()  # Feeds the game loop
 
 # -- HEALTH BAR HELPER --
 def draw_health_bar(surface, x, y, width, height, current, maximum):
@@ -88,24 +1564,72 @@ def draw_health_bar(surface, x, y, width, height, current, maximum):
     # Draw a black border around the health bar
     pygame.draw.rect(surface, (0, 0, 0), (x, y, width, height), 2)
 
+# -- HUD --
+class Hud:
+    """
+    Health bar, wave counter and ammo/reload state. They are drawn
+    onto a cached overlay Surface that is only redrawn when one of
+    the values changes; every other frame it's a single blit.
+    """
+    def __init__(self, pos=(20, 20)):
+        self.pos = pos
+        self.surface = pygame.Surface((260, 100), pygame.SRCALPHA)
+        self.state = None   # Values the overlay was last drawn with
+        self.redraws = 0
+
+    def draw(self, target):
+        gun = player.gun
+        self.draw_state(target, (player.health, player.max_health, spawner.wave,
+                                 gun.name, gun.ammo, gun.clip_size, gun.is_reloading))
+
+    def draw_state(self, target, state):
+        """
+        Draws the overlay for a (health, max health, wave, gun name,
+        ammo, clip size, reloading) tuple. Co-op clients pass in
+        what the server sent them.
+        """
+        if state != self.state:
+            self.state = state
+            self.redraws += 1
+            health, max_health, wave, gun_name, ammo, clip_size, reloading = state
+            self.surface.fill((0, 0, 0, 0))
+            # Draw the player's health bar
+            draw_health_bar(self.surface, 0, 0, 200, 20, health, max_health)
+            # Draw wave counter
+            white = (255, 255, 255)
+            self.surface.blit(text_cache.render(wave_font, f"Wave: {wave}", white), (0, 30))
+            # Draw ammo or reload state
+            if reloading:
+                ammo = f"{gun_name}: reloading..."
+            else:
+                ammo = f"{gun_name}: {ammo}/{clip_size}"
+            self.surface.blit(text_cache.render(wave_font, ammo, white), (0, 60))
+        target.blit(self.surface, self.pos)
+
 # --- Player Class ---
 class Player(pygame.sprite.Sprite):
     """
     Represents the player character, handling movement, rotation,
     health status, and hitbox management.
     """
-    def __init__(self):
+    def __init__(self, pos=player_start_pos, skin=None):
         super().__init__()
-        # Load and scale the player sprite
-        self.image = pygame.transform.rotozoom(
-            pygame.image.load(
-                "Premium top-down shooter asset pack/Player with AK.png"
-            ).convert_alpha(),
-            0, player_size
-        )
+        # Weapon slots, kept for the whole game so each gun keeps
+        # its ammo and reload progress while it's put away
+        self.inventory = {1: Handgun(self), 2: Shotgun(self), 3: AssaultRifle(self)}
+        self.gun = self.inventory[3]  # Starting weapon
+        # Looks come from player_looks, all the size of player_image
+        self.skin = PLAYER_SKIN if skin is None else skin
+        self.atlas = player_looks.atlas(self.skin, self.gun.name)
+        self.swap = None      # Animation playing while the look changes
+        self.swap_start = 0   # sim_clock time it started
+        self.image = self.atlas.image
         self.rect = self.image.get_rect()  # Rectangle for blitting
-        self.pos = vector(player_start_pos)  # Float-based position vector
+        self.pos = vector(pos)  # Float-based position vector
+        self.angle = 0.0  # Facing in atlas degrees, set by rotation()
+        self.prev_center = self.rect.center  # Center before the last sim tick
         self.original_character = self.image  # Store unrotated sprite
+        self.rotation_bucket = None  # Angle bucket of the current image
         # Hitbox for collision detection, centered in the sprite
         self.hitbox = self.original_character.get_rect(
             center=(self.rect.width / 2, self.rect.height / 2)
@@ -117,18 +1641,47 @@ class Player(pygame.sprite.Sprite):
         self.invincibility_duration = 1000  # ms of invincibility after hit
         self.last_hit_time = 0  # Timestamp of last damage taken
 
-    def movementinputs(self):
+    def change_look(self, skin, gun):
+        """
+        Wears another skin and/or holds another gun, cross-fading
+        from the old look.
+        """
+        old = (self.skin, self.gun.name)
+        self.skin, self.gun = skin, gun
+        new = (skin, gun.name)
+        if new == old:
+            return
+        self.atlas = player_looks.atlas(*new)
+        self.swap = player_looks.swap(old, new)
+        self.swap_start = sim_clock.now()
+        self.rotation_bucket = None  # Redraw on the next rotation()
+
+    def equip(self, slot):
+        """
+        Switches to the gun in an inventory slot (1/2/3).
+        """
+        gun = self.inventory.get(slot)
+        if gun is not None:
+            self.change_look(self.skin, gun)
+
+    def next_skin(self):
+        """
+        Puts on the next skin from the skins sheet. Only the look
+        changes, so it isn't part of the recorded input.
+        """
+        self.change_look((self.skin + 1) % player_looks.skins, self.gun)
+
+    def movementinputs(self, controls):
         """
-        Reads keyboard input (WASD) and sets movement speed in x/y.
+        Reads the WASD state from controls and sets movement speed in x/y.
         """
-        keys = pygame.key.get_pressed()
         self.move_speedx, self.move_speedy = 0, 0
-        if keys[pygame.K_w]: self.move_speedy -= player_speed
-        if keys[pygame.K_a]: self.move_speedx -= player_speed
-        if keys[pygame.K_s]: self.move_speedy += player_speed
-        if keys[pygame.K_d]: self.move_speedx += player_speed
+        if controls.up: self.move_speedy -= player_speed
+        if controls.left: self.move_speedx -= player_speed
+        if controls.down: self.move_speedy += player_speed
+        if controls.right: self.move_speedx += player_speed
         # Normalize diagonal movement
-        if (keys[pygame.K_w] or keys[pygame.K_s]) and (keys[pygame.K_a] or keys[pygame.K_d]):
+        if (controls.up or controls.down) and (controls.left or controls.right):
             self.move_speedx /= math.sqrt(2)
             self.move_speedy /= math.sqrt(2)
 
@@ -150,7 +1703,20 @@ class Player(pygame.sprite.Sprite):
         dx = cursor_pos[0] - SCREEN_WIDTH / 2
         dy = cursor_pos[1] - SCREEN_HEIGHT / 2
         angle = math.degrees(math.atan2(dy, dx))
-        self.image = pygame.transform.rotate(self.original_character, -angle + 90)
+        self.angle = -angle + 90
+        bucket = self.atlas.bucket(self.angle)
+        if self.swap is not None:
+            elapsed = sim_clock.now() - self.swap_start
+            if elapsed < self.swap.duration:
+                self.image = self.swap.frame(elapsed, bucket)
+                self.rect = self.image.get_rect(center=self.hitbox.center)
+                return
+            self.swap = None
+            self.rotation_bucket = None
+        if bucket == self.rotation_bucket:
+            return  # Still facing the same way, keep the current frame
+        self.rotation_bucket = bucket
+        self.image = self.atlas.frame(bucket)
         self.rect = self.image.get_rect(center=self.hitbox.center)
 
     def boundary(self, direction):
@@ -164,69 +1730,218 @@ class Player(pygame.sprite.Sprite):
         self.pos = vector(self.hitbox.center)
         self.rect.center = self.hitbox.center
 
-    def update(self, dt, cursor_pos):
+    def update(self, dt, controls):
         """
-        Called each frame: handles input, movement, and rotation.
-        dt: time since last frame in seconds
-        cursor_pos: current mouse position
+        Called each tick: handles input, movement, and rotation.
+        dt: time since last tick in seconds
+        controls: this tick's Controls
         """
-        self.movementinputs()
+        self.prev_center = self.rect.center  # For render interpolation
+        self.movementinputs(controls)
         self.playermovement(dt)
-        self.rotation(cursor_pos)
+        self.rotation(controls.cursor)
+
+def living_players():
+    """
+    Players still standing (in co-op the game goes on until all
+    of them are down).
+    """
+    return [p for p in players if p.health > 0]
+
+def nearest_player(pos):
+    """
+    The living player closest to pos, whom enemies go after.
+    """
+    return min(living_players(), key=lambda p: p.pos.distance_squared_to(pos),
+               default=player)
 
 # --- Camera Class ---
+CULL_MARGIN = 32  # Extra pixels around the view kept when culling
 class Camera:
     """
     Manages drawing the scrolling background and all sprites
-    relative to the camera offset.
+    relative to the camera offset. Only sprites inside the view
+    are drawn, one batched Surface.blits call per layer.
     """
     def __init__(self):
         self.offset = vector()  # Current camera offset
-        self.bg_rect = background.get_rect(topleft=background_pos)
+        self.view = pygame.Rect(0, 0, SCREEN_WIDTH, SCREEN_HEIGHT)  # World-space viewport
+        self.alpha = 1.0  # Interpolation factor for this frame
+        self.drawn = 0   # Sprites drawn this frame
+        self.culled = 0  # Sprites skipped this frame (off-screen)
+        self.effects_drawn = 0  # Effects drawn this frame, kept apart from the sprite counts
+
+    def visible(self, grid):
+        """
+        Returns the sprites from a spatial grid that overlap the view
+        (padded a little, since rotated images overhang their rects).
+        """
+        return grid.collide(self.view.inflate(CULL_MARGIN * 2, CULL_MARGIN * 2))
 
-    def move_bg(self):
+    def blit_layer(self, sprites, total):
+        """
+        Draws one layer with a single display.blits call and
+        updates the drawn/culled counters. Each sprite is drawn
+        between its previous and current position by self.alpha.
+        total: how many sprites the layer had before culling
+        """
+        ox, oy = self.offset
+        lag = 1 - self.alpha
+        blits = []
+        for s in sprites:
+            # Images are centered on the rect, so rotated frames
+            # (bigger than the hitbox) stay lined up
+            image = s.image
+            px, py = s.prev_center
+            cx, cy = s.rect.center
+            blits.append((image, (cx + (px - cx) * lag - image.get_width() // 2 - ox,
+                                  cy + (py - cy) * lag - image.get_height() // 2 - oy)))
+        display.blits(blits, doreturn=False)
+        self.drawn += len(blits)
+        self.culled += total - len(blits)
+
+    def move_bg(self, alpha=1.0):
         """
         Updates the offset based on player position and
-        blits background and sprites accordingly.
+        blits background, enemies and the player accordingly.
+        alpha: 0..1 blend between the last two sim ticks
+        """
+        self.alpha = alpha
+        px, py = player.prev_center
+        cx, cy = player.rect.center
+        self.offset.x = round(px + (cx - px) * alpha - SCREEN_WIDTH / 2)
+        self.offset.y = round(py + (cy - py) * alpha - SCREEN_HEIGHT / 2)
+        self.view.topleft = (self.offset.x, self.offset.y)
+        self.drawn = self.culled = 0
+        if not world_rect.contains(self.view):
+            display.fill((0, 0, 0))  # Clear what the background won't cover
+        tile_map.draw(display, self.view)
+        if swarm is not None:
+            drawn = swarm.draw(display, self.view, alpha)
+            self.drawn += drawn
+            self.culled += len(swarm) - drawn
+        else:
+            self.blit_layer(self.visible(enemy_grid), len(enemies))
+        # Effects are timed in sim ms, drawn at the same point between ticks
+        self.effects_drawn = effects.draw(display, self.view,
+                                          sim_clock.now() - (1 - alpha) * 1000 / SIM_HZ)
+        self.blit_layer(players, len(players))
+
+    def draw_overlay(self, cursor):
         """
-        self.offset.x = player.rect.centerx - SCREEN_WIDTH / 2
-        self.offset.y = player.rect.centery - SCREEN_HEIGHT / 2
-        bg_offset = self.bg_rect.topleft - self.offset
-        display.blit(background, bg_offset)
-        for sprite in game_sprites:
-            pos = sprite.rect.topleft - self.offset
-            display.blit(sprite.image, pos)
+        Blits visible bullets, then the crosshair on top of them.
+        """
+        self.blit_layer(bullet_group.visible(self.view), len(bullet_group))
+        display.blit(
+            crosshair,
+            (cursor[0] - crosshair.get_width() // 2,
+             cursor[1] - crosshair.get_height() // 2)
+        )
 
 # --- Bullet & Gun Classes ---
 class Bullet(pygame.sprite.Sprite):
     """
     Represents a bullet fired from a gun, handles movement
-    and self-removal when off-screen.
+    and self-removal when off-screen. Bullets are recycled by
+    bullet_pool, so Bullet() with no position makes an idle one.
     """
-    def __init__(self, pos, direction, speed=500, color=(255, 0, 0), radius=3):
+    def __init__(self, pos=None, direction=None, speed=500, color=(255, 0, 0), radius=3):
         super().__init__()
-        self.image = pygame.Surface((radius*2, radius*2), pygame.SRCALPHA)
-        pygame.draw.circle(self.image, color, (radius, radius), radius)
-        self.rect = self.image.get_rect(center=pos)
-        self.velocity = pygame.math.Vector2(direction).normalize() * speed
+        self.rect = pygame.Rect(0, 0, 0, 0)
+        self.velocity = pygame.math.Vector2()
+        self.pooled = False  # True while on loan from bullet_pool
+        if pos is not None:
+            self.reset(pos, direction, speed, color, radius)
+
+    def reset(self, pos, direction, speed=500, color=(255, 0, 0), radius=3):
+        """
+        (Re)fires this bullet from pos toward direction, reusing
+        its Rect/Vector2 and the shared image for color and radius.
+        """
+        self.image = assets.circle(color, radius)
+        self.rect.size = self.image.get_size()
+        self.rect.center = pos
+        self.velocity.update(direction)
+        self.velocity.scale_to_length(speed)
+        self.range_left = BULLET_RANGE  # Pixels left before it fizzles out
+        self.prev_center = self.rect.center  # Center before the last sim tick
+        bullet_grid.move(self)
 
     def update(self, dt):
         """
-        Moves bullet by its velocity and kills it if it leaves display.
+        Moves bullet by its velocity and kills it once it leaves
+        the map or has flown BULLET_RANGE pixels (both in world space).
         dt: time since last frame
         """
+        self.prev_center = self.rect.center
         self.rect.x += self.velocity.x * dt
         self.rect.y += self.velocity.y * dt
-        if not display.get_rect().colliderect(self.rect):
+        self.range_left -= self.velocity.length() * dt
+        if self.range_left <= 0 or not world_rect.colliderect(self.rect):
             self.kill()
+        else:
+            bullet_grid.move(self)
+
+    def kill(self):
+        """
+        Removes the bullet from its groups and the broadphase grid
+        and hands it back to the pool.
+        """
+        bullet_grid.remove(self)
+        super().kill()
+        if self.pooled:
+            self.pooled = False
+            bullet_pool.release(self)
+
+class BulletPool:
+    """
+    Pre-allocated Bullets that are recycled as they die, so firing
+    doesn't allocate a new sprite (and Rect/Vector2) per shot.
+    Grows if it ever runs dry and tracks how many are in use.
+    """
+    def __init__(self, capacity=256):
+        self.free = [Bullet() for _ in range(capacity)]
+        self.capacity = capacity  # Bullets owned by the pool
+        self.in_use = 0
+        self.high_water = 0       # Most bullets in flight at once
+        self.grown = 0            # Bullets allocated after startup
+
+    def acquire(self, pos, direction, speed=500, color=(255, 0, 0), radius=3):
+        """
+        Returns a live bullet fired from pos toward direction.
+        """
+        if self.free:
+            bullet = self.free.pop()
+        else:
+            bullet = Bullet()
+            self.capacity += 1
+            self.grown += 1
+        bullet.reset(pos, direction, speed, color, radius)
+        bullet.pooled = True
+        self.in_use += 1
+        self.high_water = max(self.high_water, self.in_use)
+        return bullet
+
+    def release(self, bullet):
+        """
+        Takes back a bullet that was killed.
+        """
+        self.free.append(bullet)
+        self.in_use -= 1
+
+    def report(self):
+        return (f"Bullet pool: capacity {self.capacity}, in use {self.in_use}, "
+                f"high-water {self.high_water}, grown {self.grown}")
 
 class Gun:
     """
     Base class for all guns. Handles ammo, reloading,
     and shooting cooldown.
     """
-    def __init__(self, owner, clip_size, reload_time, cooldown_ms):
+    name = "Gun"  # Shown in the HUD
+    def __init__(self, owner, clip_size, reload_time, cooldown_ms, clock=None):
         self.owner = owner
+        self.clock = clock or sim_clock  # Anything with a now() in ms
         self.clip_size = clip_size
         self.ammo = clip_size
         self.reload_time = reload_time * 1000  # convert to ms
@@ -240,7 +1955,7 @@ class Gun:
         Completes reload if reload_time has elapsed.
         """
         if self.is_reloading:
-            now = pygame.time.get_ticks()
+            now = self.clock.now()
             if now - self.reload_start >= self.reload_time:
                 self.ammo = self.clip_size
                 self.is_reloading = False
@@ -251,39 +1966,41 @@ class Gun:
         """
         if not self.is_reloading and self.ammo < self.clip_size:
             self.is_reloading = True
-            self.reload_start = pygame.time.get_ticks()
+            self.reload_start = self.clock.now()
 
     def shoot(self, pos, direction, bullet_group):
         """
         Fires a single bullet if not reloading, has ammo,
-        and cooldown has passed. Returns bullet or None.
+        and cooldown has passed. Returns True if fired, else None.
         """
-        now = pygame.time.get_ticks()
+        now = self.clock.now()
         if self.is_reloading or self.ammo <= 0 or (now - self.last_shot) < self.cooldown:
             return None
         self.last_shot = now
         self.ammo -= 1
-        bullet = Bullet(pos, direction)
-        bullet_group.add(bullet)
-        return bullet
+        bullet_group.fire(pos, direction)
+        return True
 
 class Handgun(Gun):
     """ Simple handgun: small clip, moderate cooldown. """
-    def __init__(self, owner):
-        super().__init__(owner, clip_size=12, reload_time=1.5, cooldown_ms=400)
+    name = "Handgun"
+    def __init__(self, owner, clock=None):
+        super().__init__(owner, clip_size=12, reload_time=1.5, cooldown_ms=400, clock=clock)
 
 class AssaultRifle(Gun):
     """ Assault rifle: larger clip, faster fire rate. """
-    def __init__(self, owner):
-        super().__init__(owner, clip_size=24, reload_time=2.5, cooldown_ms=100)
+    name = "Rifle"
+    def __init__(self, owner, clock=None):
+        super().__init__(owner, clip_size=24, reload_time=2.5, cooldown_ms=100, clock=clock)
 
 class Shotgun(Gun):
     """
     Shotgun: fires multiple pellets in a spread.
     Overrides shoot to emit several Bullet instances.
     """
-    def __init__(self, owner):
-        super().__init__(owner, clip_size=8, reload_time=2.0, cooldown_ms=800)
+    name = "Shotgun"
+    def __init__(self, owner, clock=None):
+        super().__init__(owner, clip_size=8, reload_time=2.0, cooldown_ms=800, clock=clock)
         self.pellets = 7
         self.spread_angle = 45
 
@@ -292,7 +2009,7 @@ class Shotgun(Gun):
         Fires a spread of pellets if conditions are met.
         Returns True if fired, else None.
         """
-        now = pygame.time.get_ticks()
+        now = self.clock.now()
         if self.is_reloading or self.ammo <= 0 or (now - self.last_shot) < self.cooldown:
             return None
         self.last_shot = now
@@ -304,9 +2021,227 @@ class Shotgun(Gun):
             angle = base_angle - self.spread_angle/2 + i*step
             rad = math.radians(angle)
             pellet_dir = pygame.math.Vector2(math.cos(rad), math.sin(rad))
-            bullet_group.add(Bullet(pos, pellet_dir))
+            bullet_group.fire(pos, pellet_dir)
+        return True
+
+class BulletGroup(pygame.sprite.Group):
+    """
+    Sprite-based bullet container: pooled Bullet sprites tracked
+    in bullet_grid. Used when NumPy isn't installed; has the same
+    fire/update/hit_enemies/visible interface as ProjectileStore.
+    """
+    def fire(self, pos, direction, speed=500, color=(255, 0, 0), radius=3):
+        """
+        Launches a bullet and returns it.
+        """
+        bullet = bullet_pool.acquire(pos, direction, speed, color, radius)
+        self.add(bullet)
+        return bullet
+
+    def hit_enemies(self):
+        """
+        Applies bullet hits to enemies, kills the bullets that hit
+        and returns how many enemies died.
+        """
+        if swarm is not None:
+            return swarm.apply_bullet_hits(self)
+        kills = 0
+        for enemy_sprite, bullets in bullet_hits(self).items():
+            for bullet in bullets:
+                bullet.kill()
+            kills += enemy_sprite.hit(len(bullets))
+        return kills
+
+    def visible(self, view):
+        """
+        Bullet sprites overlapping the world-space view rect.
+        """
+        return bullet_grid.collide(view)
+
+    def clear(self):
+        for bullet in list(self):
+            bullet.kill()
+
+    def report(self):
+        return bullet_pool.report()
+
+class ProjectileView(pygame.sprite.Sprite):
+    """
+    Throwaway sprite the camera draws for one on-screen projectile.
+    A handful are reused every frame; the simulation never sees them.
+    """
+    def __init__(self):
+        super().__init__()
+        self.image = None
+        self.rect = pygame.Rect(0, 0, 0, 0)
+        self.prev_center = (0, 0)
+
+class ProjectileStore:
+    """
+    Structure-of-arrays bullet store. Position, velocity and the
+    range left for every bullet sit in NumPy arrays, so all bullets
+    move, get culled (leaving the map or out of range, in world
+    space) and hit enemies in one batched step per tick. Sprites
+    are only made for the bullets the camera actually draws.
+    """
+    def __init__(self, capacity=256):
+        self.count = 0       # Live bullets are rows 0..count-1
+        self.capacity = 0
+        self.high_water = 0  # Most bullets in flight at once
+        self.styles = []     # style index -> (color, radius)
+        self.style_ids = {}  # (color, radius) -> style index
+        self.views = []      # Reused ProjectileView sprites
+        self._grow(capacity)
+
+    def _grow(self, capacity):
+        n = self.count
+        arrays = {
+            "pos": np.zeros((capacity, 2)),
+            "prev_pos": np.zeros((capacity, 2)),
+            "vel": np.zeros((capacity, 2)),
+            "speed": np.zeros(capacity),
+            "range_left": np.zeros(capacity),
+            "radius": np.zeros(capacity, dtype=np.int32),
+            "style": np.zeros(capacity, dtype=np.int32),
+        }
+        for name, array in arrays.items():
+            if n:
+                array[:n] = getattr(self, name)[:n]
+            setattr(self, name, array)
+        self.capacity = capacity
+
+    def __len__(self):
+        return self.count
+
+    def fire(self, pos, direction, speed=500, color=(255, 0, 0), radius=3):
+        """
+        Adds one bullet at pos heading along direction. Returns True.
+        """
+        if self.count == self.capacity:
+            self._grow(self.capacity * 2)
+        key = (tuple(color), radius)
+        if key not in self.style_ids:
+            self.style_ids[key] = len(self.styles)
+            self.styles.append(key)
+        i = self.count
+        dx, dy = direction
+        length = math.hypot(dx, dy)
+        self.pos[i] = self.prev_pos[i] = pos
+        self.vel[i] = (dx / length * speed, dy / length * speed)
+        self.speed[i] = speed
+        self.range_left[i] = BULLET_RANGE
+        self.radius[i] = radius
+        self.style[i] = self.style_ids[key]
+        self.count += 1
+        self.high_water = max(self.high_water, self.count)
         return True
 
+    def update(self, dt):
+        """
+        Moves every bullet and drops the ones that left the map
+        or ran out of range.
+        """
+        n = self.count
+        if n == 0:
+            return
+        pos = self.pos[:n]
+        self.prev_pos[:n] = pos
+        pos += self.vel[:n] * dt
+        self.range_left[:n] -= self.speed[:n] * dt
+        r = self.radius[:n]
+        alive = ((self.range_left[:n] > 0) &
+                 (pos[:, 0] + r > 0) & (pos[:, 0] - r < MAP_WIDTH) &
+                 (pos[:, 1] + r > 0) & (pos[:, 1] - r < MAP_HEIGHT))
+        if not alive.all():
+            self.keep(alive)
+
+    def keep(self, mask):
+        """
+        Compacts the arrays down to the rows where mask is True.
+        """
+        n = self.count
+        survivors = int(mask.sum())
+        for array in (self.pos, self.prev_pos, self.vel, self.speed,
+                      self.range_left, self.radius, self.style):
+            array[:survivors] = array[:n][mask]
+        self.count = survivors
+
+    def boxes(self):
+        """
+        (count, 4) int array of x, y, w, h — the same rects a Bullet
+        sprite would have.
+        """
+        n = self.count
+        r = self.radius[:n]
+        boxes = np.empty((n, 4), dtype=np.int32)
+        boxes[:, 0] = self.pos[:n, 0].astype(np.int32) - r
+        boxes[:, 1] = self.pos[:n, 1].astype(np.int32) - r
+        boxes[:, 2] = boxes[:, 3] = r * 2
+        return boxes
+
+    def hit_enemies(self):
+        """
+        Applies bullet hits to enemies, removes the bullets that hit
+        and returns how many enemies died. Each bullet hurts only
+        one enemy, as with groupcollide.
+        """
+        if self.count == 0:
+            return 0
+        boxes = self.boxes()
+        if swarm is not None:
+            hit, kills = swarm.apply_hits(boxes)
+            if hit.any():
+                self.keep(~hit)
+            return kills
+        hit = np.zeros(self.count, dtype=bool)
+        hits = {}
+        rect = pygame.Rect(0, 0, 0, 0)
+        for i, box in enumerate(boxes.tolist()):
+            rect.update(box)
+            for enemy_sprite in enemy_grid.query(rect):
+                if enemy_sprite.rect.colliderect(rect):
+                    hits[enemy_sprite] = hits.get(enemy_sprite, 0) + 1
+                    hit[i] = True
+                    break
+        kills = 0
+        for enemy_sprite, count in hits.items():
+            kills += enemy_sprite.hit(count)
+        if hits:
+            self.keep(~hit)
+        return kills
+
+    def visible(self, view):
+        """
+        Returns ProjectileView sprites for the bullets overlapping
+        the world-space view rect, reusing the same few objects.
+        """
+        boxes = self.boxes()
+        inside = np.flatnonzero(
+            (boxes[:, 0] < view.right) & (boxes[:, 0] + boxes[:, 2] > view.left) &
+            (boxes[:, 1] < view.bottom) & (boxes[:, 1] + boxes[:, 3] > view.top))
+        while len(self.views) < len(inside):
+            self.views.append(ProjectileView())
+        prev = self.prev_pos[inside].astype(np.int32).tolist()
+        views = self.views[:len(inside)]
+        for view_sprite, i, box, center in zip(views, inside.tolist(),
+                                                boxes[inside].tolist(), prev):
+            color, radius = self.styles[self.style[i]]
+            view_sprite.image = assets.circle(color, radius)
+            view_sprite.rect.update(box)
+            view_sprite.prev_center = center
+        return views
+
+    def clear(self):
+        self.count = 0
+
+    def report(self):
+        return (f"Projectiles: capacity {self.capacity}, in flight {self.count}, "
+                f"high-water {self.high_water}")
+
+bullet_pool = None  # Shared by every gun (sprite bullets), made by init() without NumPy
+# Every live bullet: batched arrays with NumPy, pooled sprites without
+bullet_group = ProjectileStore() if np is not None else BulletGroup()
+
 # --- Menu & Game Over Screens ---
 class Menu():
     """
@@ -324,7 +2259,7 @@ class Menu():
         """
         Renders button image and text to the display.
         """
-        self.text = self.font.render(self.text_input, True, "black")
+        self.text = text_cache.render(self.font, self.text_input, "black")
         self.text_rect = self.text.get_rect(center=(self.pos[0], self.pos[1]))
         display.blit(self.image, self.rect)
         display.blit(self.text, self.text_rect)
@@ -346,29 +2281,36 @@ def main_menu():
     """
     pygame.mouse.set_visible(True)
     display.blit(menu_background, background_pos)
-    font_large = pygame.font.Font("Premium top-down shooter asset pack/font.ttf", 100)
+    font_large = assets.font(MENU_FONT, 100)
     title = Menu(
         pygame.Surface((400,100), pygame.SRCALPHA),
         (500,100),
-        pygame.font.Font("Premium top-down shooter asset pack/font.ttf", 60),
+        assets.font(MENU_FONT, 60),
         "Welcome to Pest!"
     )
     play_button = Menu(play_button_img, (500,600), font_large, "PLAY")
     quit_button = Menu(quit_button_img, (500,900), font_large, "QUIT")
     menu_active = True
+    dirty = [display.get_rect()]  # Screen areas that need pushing
     while menu_active:
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 pygame.quit(); sys.exit()
+            if event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+                dirty = [display.get_rect()]
             if play_button.check_click(event):
                 menu_active = False
             if quit_button.check_click(event):
                 pygame.quit(); sys.exit()
-        display.blit(menu_background, background_pos)
-        title.draw()
-        play_button.draw()
-        quit_button.draw()
-        pygame.display.update()
+        # The menu is static: draw it once, then only when exposed
+        if dirty:
+            display.blit(menu_background, background_pos)
+            title.draw()
+            play_button.draw()
+            quit_button.draw()
+            pygame.display.update(dirty)
+            dirty = []
+            startup_done()
         clock.tick(FPS)
 
 score = 0  # Player's score counter
@@ -376,75 +2318,89 @@ score = 0  # Player's score counter
 def game_over_menu():
     """
     Shows the game over screen with final score and options
-    to replay or quit.
+    to replay or quit. Returns when REPLAY is clicked.
     """
     pygame.mouse.set_visible(True)
-    play_button_img_replay = pygame.transform.scale(
-        pygame.image.load("Premium top-down shooter asset pack/Play Rect.png"),
-        (600, 130)
-    )
     scoreboard = Menu(
         pygame.Surface((400,100), pygame.SRCALPHA),
         (500,100),
-        pygame.font.Font("Premium top-down shooter asset pack/font.ttf", 40),
+        assets.font(MENU_FONT, 40),
         f"Your Final Score was: {score}"
     )
-    font_big = pygame.font.Font("Premium top-down shooter asset pack/font.ttf", 100)
-    go_text = font_big.render("GAME OVER", True, ("black"))
+    font_big = assets.font(MENU_FONT, 100)
+    # Asked for after play_game() queued this run's save, so it includes it
+    best = scores.best(1) if scores is not None else None
+    best_text = None
+    go_text = text_cache.render(font_big, "GAME OVER", "black")
     go_rect = go_text.get_rect(center=(SCREEN_WIDTH//2, SCREEN_HEIGHT//4))
     replay_button = Menu(play_button_img_replay, (SCREEN_WIDTH//2, SCREEN_HEIGHT//2), font_big, "REPLAY")
     quit_button = Menu(quit_button_img, (SCREEN_WIDTH//2, SCREEN_HEIGHT//2 + 200), font_big, "QUIT")
+    dirty = [display.get_rect()]  # Screen areas that need pushing
     while True:
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 pygame.quit(); sys.exit()
+            if event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+                dirty = [display.get_rect()]
             if replay_button.check_click(event):
-                # Restart the script
-                os.execv(sys.executable, [sys.executable] + sys.argv)
+                return  # run_game() starts a new game in this process
             if quit_button.check_click(event):
                 pygame.quit(); sys.exit()
-        display.blit(menu_background, background_pos)
-        display.blit(go_text, go_rect)
-        replay_button.draw()
-        quit_button.draw()
-        scoreboard.draw()
-        pygame.display.update()
+        # The best score shows up once io_worker has read it
+        if best is not None and best.done():
+            rows = best.result()
+            best = None
+            if rows:
+                best_text = text_cache.render(assets.font(MENU_FONT, 40),
+                                              f"Best: {rows[0][0]} (wave {rows[0][1]})", "black")
+                dirty = [display.get_rect()]
+        # The screen is static: draw it once, then only when exposed
+        if dirty:
+            display.blit(menu_background, background_pos)
+            display.blit(go_text, go_rect)
+            replay_button.draw()
+            quit_button.draw()
+            scoreboard.draw()
+            if best_text is not None:
+                display.blit(best_text, best_text.get_rect(center=(SCREEN_WIDTH // 2, 170)))
+            pygame.display.update(dirty)
+            dirty = []
         clock.tick(FPS)
 
 # --- Input Handler ---
-def handle_player_input(player, bullet_group, camera):
-    """
-    Processes keyboard and mouse input for the player,
-    handles weapon switching and shooting, and updates score.
-    """
-    global score
-    keys = pygame.key.get_pressed()
-    # Weapon selection
-    if keys[pygame.K_1]:
-        player.gun = Handgun(player)
-    elif keys[pygame.K_2]:
-        player.gun = Shotgun(player)
-    elif keys[pygame.K_3]:
-        player.gun = AssaultRifle(player)
-
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            pygame.quit()
-            sys.exit()
-        elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
-            mouse_pos = vector(pygame.mouse.get_pos()) + camera.offset
-            direction = mouse_pos - player.rect.center
-            player.gun.shoot(player.rect.center, direction, bullet_group)
-        elif event.type == pygame.KEYDOWN and event.key == pygame.K_r:
-            player.gun.reload()
+def bullet_hits(bullet_group):
+    """
+    Finds which enemy each bullet hit using the enemy grid.
+    Returns {enemy: [bullets]}; like groupcollide, every bullet
+    counts against only one enemy (the first one it overlaps).
+    """
+    hits = {}
+    for bullet in bullet_group:
+        for enemy_sprite in enemy_grid.query(bullet.rect):
+            if enemy_sprite.rect.colliderect(bullet.rect):
+                hits.setdefault(enemy_sprite, []).append(bullet)
+                break
+    return hits
 
-    # Handle bullet hits on enemies and update score
-    hits = pygame.sprite.groupcollide(enemies, bullet_group, False, True)
-    for enemy_sprite, bullets in hits.items():
-        enemy_sprite.health -= len(bullets)
-        if enemy_sprite.health <= 0:
-            enemy_sprite.kill()
-            score += 1
+def handle_player_input(player, bullet_group, controls):
+    """
+    Applies this tick's controls for a player: weapon switching,
+    shooting and reloading.
+    """
+    if controls.weapon is not None:
+        player.equip(controls.weapon)
+
+    if controls.quit:
+        pygame.quit()
+        sys.exit()
+    if controls.fire:
+        # The camera keeps the player centered, so the cursor's
+        # offset from the screen center is the aim direction
+        direction = vector(controls.cursor) - (SCREEN_WIDTH / 2, SCREEN_HEIGHT / 2)
+        if direction.length_squared() > 0:
+            player.gun.shoot(player.rect.center, direction, bullet_group)
+    if controls.reload:
+        player.gun.reload()
 
 # --- Enemy Class ---
 class Enemy(pygame.sprite.Sprite):
@@ -452,108 +2408,1572 @@ class Enemy(pygame.sprite.Sprite):
     Simple enemy that chases the player, has health,
     and removes itself when defeated.
     """
-    def __init__(self):
+    def __init__(self, pos, speed=80, health=5, uid=0):
         super().__init__()
-        self.image = pygame.transform.rotozoom(
-            pygame.image.load("Premium top-down shooter asset pack/Bug_enemy.png").convert_alpha(),
-            0, player_size
-        )
+        self.uid = uid  # Network id for co-op snapshots
+        self.image = enemy_image
         self.rect = self.image.get_rect()
-        # Spawn around the player's start position
-        offset_x = random.randint(-100, 100)
-        offset_y = random.randint(-100, 100)
-        self.pos = vector(player_start_pos[0] + offset_x, player_start_pos[1] + offset_y)
+        self.pos = vector(pos)  # Top-left corner, picked by the spawner
         self.rect.topleft = self.pos
-        self.speed = 80  # Movement speed
-        self.max_health = 5
+        self.speed = speed  # Movement speed
+        self.max_health = health
         self.health = self.max_health
         self.direction = vector(0, 0)
+        self.rotation_bucket = 0  # Facing bucket in enemy_atlas (0 = right)
+        self.hit_time = -enemy_hit_animation.duration  # sim_clock time of the last hit
+        self.flashing = False  # Showing a hit frame instead of the atlas
+        self.prev_center = self.rect.center  # Center before the last sim tick
+        self.push = vector(0, 0)  # Last separation push
+        self.phase = len(enemies) % SEPARATION_EVERY  # Tick it refreshes push on
+        enemy_grid.move(self)
 
     def update(self, dt, placeholder):
         """
-        Moves enemy toward the player each frame.
+        Moves enemy along the flow field toward the player each
+        frame, pushed apart from its neighbours.
         dt: time since last frame
         placeholder: unused but required by group update
         """
-        to_player = player.pos - self.pos
-        if to_player.length_squared() > 0:
-            self.direction = to_player.normalize()
+        self.prev_center = self.rect.center
+        seek = vector(flow_field.direction(*self.rect.center))
+        if seek.length_squared() == 0:
+            # Next to a player (or cut off): head straight for the nearest
+            seek = nearest_player(self.pos).pos - self.pos
+            if seek.length_squared() > 0:
+                seek.normalize_ip()
+        if (sim_clock.ticks + self.phase) % SEPARATION_EVERY == 0:
+            self.push = self.separation() * SEPARATION_WEIGHT
+        steer = seek + self.push
+        if steer.length_squared() > 0:
+            self.direction = steer.normalize()
         self.pos += self.direction * self.speed * dt
         # Keep within map bounds
         self.pos.x = max(0, min(self.pos.x, MAP_WIDTH - self.rect.width))
         self.pos.y = max(0, min(self.pos.y, MAP_HEIGHT - self.rect.height))
         self.rect.topleft = self.pos
+        enemy_grid.move(self)
+        self.face()
+
+    def separation(self):
+        """
+        Sum of pushes away from nearby enemies closer than
+        SEPARATION_RADIUS, stronger the closer they are. Looks at
+        no more than SEPARATION_NEIGHBOURS candidates, so a dense
+        crowd stays cheap.
+        """
+        x, y = self.pos
+        px = py = 0.0
+        reach = SEPARATION_RADIUS * SEPARATION_RADIUS
+        for other in islice(enemy_grid.query(self.rect), SEPARATION_NEIGHBOURS):
+            dx, dy = x - other.pos.x, y - other.pos.y
+            dist_sq = dx * dx + dy * dy
+            if 0 < dist_sq < reach:
+                dist = math.sqrt(dist_sq)
+                scale = (SEPARATION_RADIUS - dist) / (SEPARATION_RADIUS * dist)
+                px += dx * scale
+                py += dy * scale
+        return vector(px, py)
+
+    def face(self):
+        """
+        Turns the image to face the movement direction, using the
+        shared enemy_atlas (or the hit flash right after a hit).
+        The rect (hitbox) keeps its size.
+        """
+        angle = -math.degrees(math.atan2(self.direction.y, self.direction.x))
+        bucket = enemy_atlas.bucket(angle)
+        elapsed = sim_clock.now() - self.hit_time
+        if elapsed < enemy_hit_animation.duration:
+            self.image = enemy_hit_animation.frame(elapsed, bucket)
+            self.rotation_bucket = bucket
+            self.flashing = True
+        elif bucket != self.rotation_bucket or self.flashing:
+            self.rotation_bucket = bucket
+            self.image = enemy_atlas.frame(bucket)
+            self.flashing = False
+
+    def hit(self, damage):
+        """
+        Takes damage from bullets. Returns 1 if it killed the
+        enemy (which then plays its death), else 0.
+        """
+        self.health -= damage
+        if self.health > 0:
+            self.hit_time = sim_clock.now()
+            return 0
+        enemy_death_effect(*self.rect.center, self.rotation_bucket)
+        self.kill()
+        return 1
+
+    def kill(self):
+        """
+        Removes the enemy from its groups and the broadphase grid.
+        """
+        enemy_grid.remove(self)
+        super().kill()
+
+# --- Enemy Swarm (NumPy engine) ---
+# Per-enemy arrays of EnemySwarm: name, shape of one row, dtype
+SWARM_FIELDS = (
+    ("pos", (2,), "f8"),        # Top-left corner
+    ("prev_pos", (2,), "f8"),   # Top-left before the last sim tick
+    ("direction", (2,), "f8"),
+    ("speed", (), "f8"),
+    ("health", (), "i4"),
+    ("hit_time", (), "i8"),     # sim_clock ms of the last hit
+    ("uid", (), "u4"),          # Network id for co-op snapshots
+)
+
+class EnemySwarm:
+    """
+    Structure-of-arrays enemy engine for very large waves.
+    Positions, directions, speeds and health live in NumPy arrays,
+    so seeking, clamping and bullet damage each run as one batched
+    operation per frame instead of one Python call per enemy.
+    """
+    def __init__(self, capacity=1024, size=None, arrays=None):
+        """
+        size: (width, height) of one enemy, enemy_image's by default
+        arrays: existing SWARM_FIELDS arrays to work on instead of
+        allocating new ones (a ShardedSwarm worker's shared memory)
+        """
+        self.count = 0  # Number of live enemies (rows 0..count-1)
+        self.width, self.height = size or enemy_image.get_size()
+        self.capacity = 0
+        if arrays is not None:
+            self._use(arrays)
+        else:
+            self._grow(capacity)
+
+    def _use(self, arrays):
+        for name, _, _ in SWARM_FIELDS:
+            setattr(self, name, arrays[name])
+        self.capacity = len(arrays["pos"])
+
+    def _grow(self, capacity):
+        """
+        Reallocates the arrays with room for 'capacity' enemies,
+        keeping the live rows.
+        """
+        arrays = {name: np.zeros((capacity,) + shape, dtype=dtype)
+                  for name, shape, dtype in SWARM_FIELDS}
+        for name, _, _ in SWARM_FIELDS:
+            if self.capacity:
+                arrays[name][:self.count] = getattr(self, name)[:self.count]
+        self._use(arrays)
+
+    def __len__(self):
+        return self.count
+
+    def spawn(self, points, speed=80, health=5, uids=0):
+        """
+        Adds one enemy at each top-left point, like Enemy().
+        uids: their network ids
+        """
+        count = len(points)
+        if self.count + count > self.capacity:
+            self._grow(max(self.capacity * 2, self.count + count))
+        rows = slice(self.count, self.count + count)
+        self.pos[rows] = points
+        self.prev_pos[rows] = self.pos[rows]
+        self.direction[rows] = 0
+        self.speed[rows] = speed
+        self.health[rows] = health
+        self.hit_time[rows] = -enemy_hit_animation.duration
+        self.uid[rows] = uids
+        self.count += count
+
+    def clear(self):
+        self.count = 0
+
+    def close(self):
+        """
+        Nothing to free here; ShardedSwarm stops its workers.
+        """
+
+    def update(self, dt, target):
+        """
+        Moves every enemy along the flow field toward target,
+        pushed apart from crowded neighbours, and clamps them to
+        the map.
+        target: (x, y), or a list of them (co-op players), in which
+        case each enemy goes for the nearest
+        """
+        if self.count:
+            self.advance(0, self.count, dt, target)
+
+    def advance(self, lo, hi, dt, target, field=None):
+        """
+        update() for rows lo..hi only; separation only looks at
+        enemies in the same rows.
+        field: FlowField to steer by, flow_field by default
+        """
+        field = field or flow_field
+        pos = self.pos[lo:hi]
+        self.prev_pos[lo:hi] = pos
+        direction = self.direction[lo:hi]
+        steer = field.directions(pos + (self.width / 2, self.height / 2)).astype(float)
+        # Cells next to a player (or cut off) head straight for the nearest
+        direct = (steer == 0).all(axis=1)
+        targets = np.asarray(target, dtype=float).reshape(-1, 2)
+        nearest = 0
+        if len(targets) > 1:
+            gaps = targets[None, :, :] - pos[direct][:, None, :]
+            nearest = (gaps ** 2).sum(axis=2).argmin(axis=1)
+        to_target = targets[nearest] - pos[direct]
+        dist = np.hypot(to_target[:, 0], to_target[:, 1])
+        dist[dist == 0] = 1
+        steer[direct] = to_target / dist[:, None]
+        steer += self.separation(pos) * SEPARATION_WEIGHT
+        length = np.hypot(steer[:, 0], steer[:, 1])
+        moving = length > 0
+        direction[moving] = steer[moving] / length[moving, None]
+        pos += direction * (self.speed[lo:hi] * dt)[:, None]
+        np.clip(pos[:, 0], 0, MAP_WIDTH - self.width, out=pos[:, 0])
+        np.clip(pos[:, 1], 0, MAP_HEIGHT - self.height, out=pos[:, 1])
+
+    def separation(self, pos):
+        """
+        Pushes for every enemy: enemies sharing a SEPARATION_RADIUS
+        cell are pushed away from the middle of that group, one
+        batched pass instead of checking every pair.
+        """
+        cells = (pos // SEPARATION_RADIUS).astype(np.int64)
+        keys = cells[:, 1] * (MAP_WIDTH // SEPARATION_RADIUS + 1) + cells[:, 0]
+        _, group, counts = np.unique(keys, return_inverse=True, return_counts=True)
+        middle = np.stack([np.bincount(group, pos[:, 0]),
+                           np.bincount(group, pos[:, 1])], axis=1) / counts[:, None]
+        offset = pos - middle[group]
+        dist = np.hypot(offset[:, 0], offset[:, 1])
+        crowded = (counts[group] > 1) & (dist > 0)
+        push = np.zeros_like(pos)
+        push[crowded] = offset[crowded] / dist[crowded, None]
+        return push
+
+    def overlapping(self, rects, lo=0, hi=None):
+        """
+        Returns a (len(rects), count) bool matrix of which enemy
+        boxes overlap each rect (same test as Rect.colliderect).
+        lo, hi: only test rows lo..hi (then it's hi - lo columns)
+        """
+        boxes = np.array(rects, dtype=np.int32).reshape(-1, 4)
+        x, y, w, h = (boxes[:, i, None] for i in range(4))
+        corner = self.pos[lo:self.count if hi is None else hi].astype(np.int32)
+        ex, ey = corner[:, 0], corner[:, 1]
+        return ((x < ex + self.width) & (ex < x + w) &
+                (y < ey + self.height) & (ey < y + h))
+
+    def apply_bullet_hits(self, bullet_group):
+        """
+        Damages enemies hit by bullets, kills those bullets and
+        removes dead enemies. Like groupcollide, each bullet hurts
+        only one enemy. Returns the number of enemies killed.
+        """
+        bullets = list(bullet_group)
+        if not bullets:
+            return 0
+        hit, kills = self.apply_hits([tuple(b.rect) for b in bullets])
+        for i in np.flatnonzero(hit):
+            bullets[i].kill()
+        return kills
+
+    def apply_hits(self, boxes):
+        """
+        Batched version of apply_bullet_hits for raw bullet boxes
+        (x, y, w, h). Returns (bool array of which boxes hit
+        something, number of enemies killed).
+        """
+        if self.count == 0 or len(boxes) == 0:
+            return np.zeros(len(boxes), dtype=bool), 0
+        first = self.first_hits(np.array(boxes, dtype=np.int32).reshape(-1, 4))
+        hit = first >= 0
+        if not hit.any():
+            return hit, 0
+        first = first[hit]
+        np.subtract.at(self.health, first, 1)
+        self.hit_time[first] = sim_clock.now()
+        return hit, self.remove_dead()
+
+    def first_hits(self, boxes):
+        """
+        Row of the first enemy each (x, y, w, h) box overlaps, or -1.
+        """
+        return self.band_hits(boxes, 0, self.count)
+
+    def band_hits(self, boxes, lo, hi):
+        """
+        first_hits() looking only at rows lo..hi. Enemies are bucketed
+        by the grid cell their corner is in, so each box is only
+        tested against the enemies in the few cells it can reach and
+        the cost grows with enemies + bullets, not their product.
+        """
+        first = np.full(len(boxes), -1)
+        if hi <= lo or len(boxes) == 0:
+            return first
+        size = max(GRID_CELL_SIZE, self.width, self.height)
+        columns = MAP_WIDTH // size + 1
+        rows = MAP_HEIGHT // size + 1
+        corner = self.pos[lo:hi].astype(np.int32)
+        keys = corner[:, 1] // size * columns + corner[:, 0] // size
+        order = np.argsort(keys, kind="stable")
+        keys = keys[order]
+        # Cells an overlapping enemy's corner can be in, per box
+        boxes = np.asarray(boxes, dtype=np.int32).reshape(-1, 4)
+        x, y, w, h = boxes.T
+        x0 = np.clip((x - self.width + 1) // size, 0, columns - 1)
+        x1 = np.clip((x + w - 1) // size, 0, columns - 1)
+        y0 = np.clip((y - self.height + 1) // size, 0, rows - 1)
+        y1 = np.clip((y + h - 1) // size, 0, rows - 1)
+        across = np.maximum(x1 - x0 + 1, 0)
+        cell_counts = across * np.maximum(y1 - y0 + 1, 0)
+        box = np.repeat(np.arange(len(boxes)), cell_counts)
+        step = np.arange(len(box)) - np.repeat(np.cumsum(cell_counts) - cell_counts, cell_counts)
+        cell = (y0[box] + step // across[box]) * columns + x0[box] + step % across[box]
+        # Every enemy in those cells is a candidate for its box
+        start = np.searchsorted(keys, cell, "left")
+        counts = np.searchsorted(keys, cell, "right") - start
+        pair_box = np.repeat(box, counts)
+        offset = np.arange(len(pair_box)) - np.repeat(np.cumsum(counts) - counts, counts)
+        row = order[np.repeat(start, counts) + offset]
+        ex, ey = corner[row, 0], corner[row, 1]
+        hit = ((x[pair_box] < ex + self.width) & (ex < x[pair_box] + w[pair_box]) &
+               (y[pair_box] < ey + self.height) & (ey < y[pair_box] + h[pair_box]))
+        # Lowest row wins, as with a row-by-row scan
+        lowest = np.full(len(boxes), hi - lo)
+        np.minimum.at(lowest, pair_box[hit], row[hit])
+        found = lowest < hi - lo
+        first[found] = lowest[found] + lo
+        return first
+
+    def remove_dead(self):
+        """
+        Compacts the arrays so live enemies stay in rows 0..count-1,
+        starting a death effect for each one removed. Returns how
+        many were removed.
+        """
+        n = self.count
+        alive = self.health[:n] > 0
+        survivors = int(alive.sum())
+        if survivors == n:
+            return 0
+        dead = ~alive
+        centers = self.pos[:n][dead] + (self.width / 2, self.height / 2)
+        buckets = self.buckets(self.direction[:n][dead])
+        for (x, y), bucket in zip(centers.tolist(), buckets.tolist()):
+            enemy_death_effect(x, y, bucket)
+        for name, _, _ in SWARM_FIELDS:
+            array = getattr(self, name)
+            array[:survivors] = array[:n][alive]
+        self.count = survivors
+        return n - survivors
+
+    def buckets(self, direction):
+        """
+        enemy_atlas facing buckets for an array of directions.
+        """
+        angles = -np.degrees(np.arctan2(direction[:, 1], direction[:, 0]))
+        return (np.round(angles / enemy_atlas.step) % enemy_atlas.buckets).astype(np.int32)
+
+    def touching(self, rect):
+        """
+        Returns True if any enemy overlaps rect (player contact).
+        """
+        return self.count > 0 and bool(self.overlapping([tuple(rect)]).any())
+
+    def draw(self, surface, view, alpha=1.0):
+        """
+        Blits the shared enemy image for every enemy inside the
+        world-space view rect in one batched call. This is the only
+        place the swarm is turned into sprites. Returns how many
+        enemies were drawn.
+        alpha: 0..1 blend between the last two sim ticks
+        """
+        n = self.count
+        prev = self.prev_pos[:n]
+        corner = (prev + (self.pos[:n] - prev) * alpha).astype(np.int32)
+        view = view.inflate(CULL_MARGIN * 2, CULL_MARGIN * 2)
+        inside = ((corner[:, 0] < view.right) & (corner[:, 0] + self.width > view.left) &
+                  (corner[:, 1] < view.bottom) & (corner[:, 1] + self.height > view.top))
+        # Facing bucket per visible enemy, then one atlas lookup each
+        buckets = self.buckets(self.direction[:n][inside])
+        centers = corner[inside] + (self.width // 2 - view.x - CULL_MARGIN,
+                                    self.height // 2 - view.y - CULL_MARGIN)
+        since_hit = sim_clock.now() - self.hit_time[:n][inside]
+        flash = enemy_hit_animation.duration
+        blits = []
+        for (cx, cy), bucket, elapsed in zip(centers.tolist(), buckets.tolist(),
+                                             since_hit.tolist()):
+            if elapsed < flash:
+                frame = enemy_hit_animation.frame(elapsed, bucket)
+            else:
+                frame = enemy_atlas.frame(bucket)
+            blits.append((frame, (cx - frame.get_width() // 2, cy - frame.get_height() // 2)))
+        surface.blits(blits, doreturn=False)
+        return len(blits)
+
+def spawn_enemies(points, speed=80, health=5):
+    """
+    Creates one enemy at each top-left point and adds them to
+    whichever engine is running.
+    """
+    global next_enemy_id
+    uids = range(next_enemy_id, next_enemy_id + len(points))
+    next_enemy_id += len(points)
+    if swarm is not None:
+        if points:
+            swarm.spawn(points, speed, health, uids)
+        return
+    for pos, uid in zip(points, uids):
+        enemies.add(Enemy(pos, speed, health, uid))
+
+def enemy_count():
+    """
+    Number of enemies alive in whichever engine is running.
+    """
+    return len(swarm) if swarm is not None else len(enemies)
+
+def clear_enemies():
+    """
+    Removes every enemy from the groups, grid and swarm.
+    """
+    for e in list(enemies):
+        e.kill()
+    if swarm is not None:
+        swarm.clear()
+
+# --- Sharded Swarm (worker processes) ---
+REBALANCE_EVERY = 25  # Ticks between re-cutting the enemies into bands
+BULLET_SLOTS = 1024   # Bullet boxes handed to the workers at a time
+WORKER_TIMEOUT = 10   # Seconds a worker may take to answer before it's given up on
+
+def swarm_layout(capacity, flow_cells, workers):
+    """
+    Where every array of a ShardedSwarm sits in its shared memory
+    block, as {name: (offset, shape, dtype)}, and the block's size.
+    Besides the SWARM_FIELDS there's a copy of the flow field, the
+    bullet boxes to test and each worker's first-hit rows.
+    """
+    arrays = [(name, (capacity,) + shape, dtype) for name, shape, dtype in SWARM_FIELDS]
+    arrays += [("flow", (flow_cells, 2), "f4"),
+               ("bullets", (BULLET_SLOTS, 4), "i4"),
+               ("first_hit", (workers, BULLET_SLOTS), "i8")]
+    layout, size = {}, 0
+    for name, shape, dtype in arrays:
+        layout[name] = (size, shape, dtype)
+        size += math.prod(shape) * np.dtype(dtype).itemsize
+        size = -(-size // 64) * 64  # Start every array on a cache line
+    return layout, size
+
+def map_block(block, layout):
+    """
+    NumPy views of every array in a shared memory block (no copies).
+    """
+    return {name: np.ndarray(shape, dtype, buffer=block.buf, offset=offset)
+            for name, (offset, shape, dtype) in layout.items()}
+
+def shard_worker(conn, shard, size, map_size):
+    """
+    Body of one ShardedSwarm worker process. Runs each command it
+    is sent on its own band of rows in the shared block and replies
+    when done, until it's told to stop.
+    shard: this worker's row in the first_hit array
+    size: (width, height) of one enemy
+    map_size: the game's (MAP_WIDTH, MAP_HEIGHT)
+    """
+    set_map(*map_size)
+    field = FlowField(MAP_WIDTH, MAP_HEIGHT)
+    block = arrays = band = None
+    while True:
+        command, lo, hi, *args = conn.recv()
+        if command == "attach":
+            # Drop the views of the old block before closing it
+            arrays = band = field.flow = None
+            if block is not None:
+                block.close()
+            name, layout = args
+            block = shared_memory.SharedMemory(name=name)
+            arrays = map_block(block, layout)
+            band = EnemySwarm(size=size, arrays=arrays)
+            field.flow = arrays["flow"]
+        elif command == "move":
+            dt, target = args
+            band.advance(lo, hi, dt, target, field)
+        elif command == "hit":
+            boxes = arrays["bullets"][:args[0]]
+            arrays["first_hit"][shard, :len(boxes)] = band.band_hits(boxes, lo, hi)
+        elif command == "stop":
+            break
+        conn.send(None)
+    arrays = band = field.flow = None
+    if block is not None:
+        block.close()
+
+class ShardedSwarm(EnemySwarm):
+    """
+    EnemySwarm that spreads each tick over worker processes, for
+    waves too big for one core. Every array lives in one block of
+    shared memory. Every REBALANCE_EVERY ticks (and after spawns)
+    the enemies are sorted by y and cut into one band of rows per
+    worker, so each worker owns a horizontal strip of the map with
+    an equal share of the enemies. The workers move their band and
+    test the bullets against it in parallel; spawning, deaths and
+    drawing stay in this process and read the same memory, so
+    nothing is copied back. Separation only pushes apart enemies in
+    the same band, so runs differ a little from plain --swarm.
+    If a worker dies or stops answering, the rest are stopped and
+    the swarm carries on in this process as a plain EnemySwarm.
+    """
+    def __init__(self, workers, capacity=4096):
+        self.workers = workers
+        self.block = None          # SharedMemory holding every array
+        self.conns = []            # Pipe to each worker
+        self.processes = []
+        self.bounds = [0] * (workers + 1)  # Band w is rows bounds[w]..bounds[w + 1]
+        self.sorted = True         # False after spawns until the next rebalance
+        self.flow_version = None   # flow_field.rebuilds last copied into the block
+        self.ticks = 0
+        self.rebalances = 0
+        self.fallback = None       # Why the workers were dropped, once they are
+        super().__init__(capacity)
+        atexit.register(self.close)
+        # Spawned, not forked: this process already runs the IO thread
+        context = multiprocessing.get_context("spawn")
+        os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+        for shard in range(workers):
+            ours, theirs = context.Pipe()
+            process = context.Process(target=shard_worker, daemon=True,
+                                      args=(theirs, shard, (self.width, self.height),
+                                            (MAP_WIDTH, MAP_HEIGHT)))
+            process.start()
+            theirs.close()  # Only the worker holds it now, so its death ends our recv()
+            self.conns.append(ours)
+            self.processes.append(process)
+        try:
+            self._run("attach", self.block.name, self.layout)
+        except RuntimeError as e:
+            self._fall_back(e)
+
+    def _grow(self, capacity):
+        """
+        Moves the arrays into a new, bigger shared block and points
+        the workers at it.
+        """
+        layout, size = swarm_layout(capacity, flow_field.cells, self.workers)
+        block = shared_memory.SharedMemory(create=True, size=size)
+        arrays = map_block(block, layout)
+        for name, _, _ in SWARM_FIELDS:
+            if self.capacity:
+                arrays[name][:self.count] = getattr(self, name)[:self.count]
+        self._use(arrays)
+        self.flow, self.bullets, self.first_hit = (arrays[name] for name in
+                                                   ("flow", "bullets", "first_hit"))
+        self.flow_version = None
+        old, self.block, self.layout = self.block, block, layout
+        if self.conns:
+            try:
+                self._run("attach", block.name, layout)
+            except RuntimeError as e:
+                self._fall_back(e)
+        if old is not None:
+            old.close()
+            old.unlink()
+
+    def _run(self, command, *args):
+        """
+        Sends a command to every worker with its band of rows and
+        waits until they have all finished. Raises RuntimeError if a
+        worker has died or hasn't answered within WORKER_TIMEOUT.
+        """
+        try:
+            for shard, conn in enumerate(self.conns):
+                conn.send((command, self.bounds[shard], self.bounds[shard + 1]) + args)
+            for shard, (conn, process) in enumerate(zip(self.conns, self.processes)):
+                deadline = time.perf_counter() + WORKER_TIMEOUT
+                while not conn.poll(0.1):
+                    if not process.is_alive():
+                        raise RuntimeError(f"swarm worker {shard} exited "
+                                           f"with code {process.exitcode}")
+                    if time.perf_counter() > deadline:
+                        raise RuntimeError(f"swarm worker {shard} didn't finish "
+                                           f"{command!r} within {WORKER_TIMEOUT} s")
+                conn.recv()
+        except (OSError, EOFError) as e:
+            raise RuntimeError(f"lost the pipe to a swarm worker ({e})") from e
+
+    def _fall_back(self, error):
+        """
+        Stops every worker after one has failed. The arrays stay in
+        this process's block, so update() and first_hits() just run
+        EnemySwarm's own versions on them from then on.
+        """
+        print(f"Sharded swarm: {error}; running the swarm in this process instead")
+        self.fallback = str(error)
+        for process in self.processes:
+            process.terminate()
+            process.join(timeout=1)
+            if process.is_alive():  # Hung hard enough to ignore SIGTERM
+                process.kill()
+                process.join(timeout=1)
+        for conn in self.conns:
+            conn.close()
+        self.conns = []
+        self.processes = []
+
+    def spawn(self, points, speed=80, health=5, uids=0):
+        super().spawn(points, speed, health, uids)
+        self.bounds[-1] = self.count  # New rows join the last band until the rebalance
+        self.sorted = False
+
+    def clear(self):
+        super().clear()
+        self.bounds = [0] * (self.workers + 1)
+        self.ticks = 0
+
+    def rebalance(self):
+        """
+        Sorts the enemies by y and cuts them into equal bands.
+        """
+        n = self.count
+        order = np.argsort(self.pos[:n, 1], kind="stable")
+        for name, _, _ in SWARM_FIELDS:
+            array = getattr(self, name)
+            array[:n] = array[:n][order]
+        self.bounds = [n * shard // self.workers for shard in range(self.workers + 1)]
+        self.sorted = True
+        self.rebalances += 1
+
+    def update(self, dt, target):
+        if not self.conns:
+            return super().update(dt, target)
+        if self.count == 0:
+            return
+        self.ticks += 1
+        if not self.sorted or self.ticks % REBALANCE_EVERY == 0:
+            self.rebalance()
+        if self.flow_version != flow_field.rebuilds:
+            self.flow[:] = flow_field.flow
+            self.flow_version = flow_field.rebuilds
+        targets = np.asarray(target, dtype=float).reshape(-1, 2)
+        try:
+            self._run("move", dt, targets.tolist())
+        except RuntimeError as e:
+            self._fall_back(e)
+            super().update(dt, target)  # Bands that already moved move again, once
+
+    def first_hits(self, boxes):
+        """
+        Each worker finds the first hit in its band; the lowest band
+        with a hit has the lowest row, as in EnemySwarm.
+        """
+        if not self.conns:
+            return super().first_hits(boxes)
+        first = np.full(len(boxes), -1)
+        for start in range(0, len(boxes), BULLET_SLOTS):
+            part = boxes[start:start + BULLET_SLOTS]
+            k = len(part)
+            self.bullets[:k] = part
+            try:
+                self._run("hit", k)
+            except RuntimeError as e:
+                self._fall_back(e)
+                return super().first_hits(boxes)
+            rows = self.first_hit[:, :k]
+            found = rows >= 0
+            band = found.argmax(axis=0)
+            first[start:start + k] = np.where(found.any(axis=0), rows[band, np.arange(k)], -1)
+        return first
 
-def spawn_wave(count):
+    def remove_dead(self):
+        n = self.count
+        kept = np.concatenate(([0], np.cumsum(self.health[:n] > 0)))
+        removed = super().remove_dead()
+        if removed:
+            self.bounds = kept[self.bounds].tolist()  # Bands shrink by their dead
+        return removed
+
+    def close(self):
+        """
+        Stops the workers and frees the shared memory. Safe to call
+        more than once.
+        """
+        if self.block is None:
+            return
+        for conn in self.conns:
+            try:
+                conn.send(("stop", 0, 0))
+            except OSError:  # That worker already died
+                pass
+        for process in self.processes:
+            process.join(timeout=1)
+        self.conns = []
+        # Views into the block have to go before it can be closed
+        for name, _, _ in SWARM_FIELDS:
+            setattr(self, name, None)
+        self.flow = self.bullets = self.first_hit = None
+        self.count = self.capacity = 0
+        self.block.close()
+        self.block.unlink()
+        self.block = None
+
+    def report(self):
+        if self.fallback is not None:
+            return f"Sharded swarm: workers dropped ({self.fallback}), ran in this process"
+        sizes = np.diff(self.bounds).tolist()
+        return (f"Sharded swarm: {self.workers} workers, {self.rebalances} rebalances, "
+                f"bands of {sizes} enemies")
+
+# --- Waves ---
+class WaveSpawner:
     """
-    Creates 'count' new enemies and adds them to the game.
+    Runs the waves from WAVE_RULES. A new wave only queues its
+    enemies; update() then lets at most spawn_per_tick of them in
+    each tick, and never more than max_alive at once, so big waves
+    stream in instead of landing in one frame. Enemies appear just
+    outside the player's view (or on the map edge if that is all
+    that's left), never on top of the player.
     """
-    for _ in range(count):
-        e = Enemy()
-        enemies.add(e)
-        game_sprites.add(e)
+    def __init__(self, rules=WAVE_RULES):
+        self.rules = rules
+        self.max_alive = rules["max_alive_swarm"] if swarm is not None else rules["max_alive"]
+        self.wave = 0         # Current wave number (0 before the first)
+        self.queued = 0       # Enemies of this wave still waiting to spawn
+        self.clear_time = None  # When the last wave was cleared
+        self.spawned = 0
+        self.held_back = 0    # Ticks the alive cap stopped spawning
+
+    def wave_size(self, wave):
+        """
+        Number of enemies in a wave: from 'sizes' if listed,
+        otherwise grown from the previous wave.
+        """
+        sizes = self.rules["sizes"]
+        if wave <= len(sizes):
+            return sizes[wave - 1]
+        count = sizes[-1] if sizes else self.rules["first_wave"]
+        for _ in range(max(len(sizes), 1), wave):
+            count = math.ceil(count * self.rules["growth"])
+        return count
+
+    def enemy_stats(self):
+        """
+        (speed, health) for enemies of the current wave.
+        """
+        rules, extra = self.rules, self.wave - 1
+        return (rules["enemy_speed"] + rules["speed_per_wave"] * extra,
+                rules["enemy_health"] + rules["health_per_wave"] * extra)
+
+    def start_wave(self, wave):
+        self.wave = wave
+        self.queued += self.wave_size(wave)
+        self.clear_time = None
+
+    def spawn_points(self, count, center):
+        """
+        Picks 'count' top-left corners on a ring just outside a
+        screen-sized view around center, clamped to the map. Points
+        that clamping pulls back into view are tried again a few
+        times, then moved to the map edge furthest from center.
+        """
+        view = pygame.Rect((0, 0), screen_size)
+        view.center = (int(center[0]), int(center[1]))
+        w, h = enemy_image.get_size()
+        view.inflate_ip(w * 2, h * 2)  # Whole enemy off screen, not just its corner
+        radius = math.hypot(*view.size) / 2 + self.rules["spawn_margin"]
+        max_x, max_y = MAP_WIDTH - w, MAP_HEIGHT - h
+        points = []
+        for _ in range(count):
+            for _ in range(8):
+                angle = random.uniform(0, math.tau)
+                x = min(max(center[0] + math.cos(angle) * radius - w / 2, 0), max_x)
+                y = min(max(center[1] + math.sin(angle) * radius - h / 2, 0), max_y)
+                if not view.collidepoint(x + w / 2, y + h / 2):
+                    break
+            else:
+                # Player is near a corner of a small map: use the far edge
+                if center[0] < MAP_WIDTH / 2:
+                    x, y = max_x, random.uniform(0, max_y)
+                else:
+                    x, y = 0, random.uniform(0, max_y)
+            points.append((x, y))
+        return points
+
+    def spawn(self, count, center):
+        """
+        Spawns 'count' queued enemies right away.
+        """
+        count = min(count, self.queued)
+        if count > 0:
+            spawn_enemies(self.spawn_points(count, center), *self.enemy_stats())
+            self.queued -= count
+            self.spawned += count
+
+    def update(self, now, center):
+        """
+        Called once per sim tick: lets the next queued enemies in
+        and starts the next wave once this one is cleared and the
+        break is over.
+        """
+        alive = enemy_count()
+        if self.queued:
+            room = self.max_alive - alive
+            if room <= 0:
+                self.held_back += 1
+            self.spawn(min(self.rules["spawn_per_tick"], room), center)
+        elif alive == 0:
+            if self.clear_time is None:
+                self.clear_time = now
+            elif now - self.clear_time >= self.rules["break_ms"]:
+                self.start_wave(self.wave + 1)
+
+    def report(self):
+        return (f"Waves: reached {self.wave}, {self.spawned} enemies spawned, "
+                f"{self.queued} still queued, alive cap {self.max_alive} "
+                f"held spawns back for {self.held_back} ticks")
 
 # --- Setup & Start ---
-main_menu()                     # Show main menu first
-camera = Camera()               # Initialize camera
-player = Player()               # Create player instance
-player.gun = AssaultRifle(player)  # Give player a starting weapon
-game_sprites.add(player)        # Add player to sprite group
-spawn_wave(current_wave_count)  # Spawn the first wave
+def init():
+    """
+    Starts pygame, opens the window and loads the assets. Only the
+    first call does anything; new_game() makes it, so importing
+    this module never touches the display or the disk.
+    """
+    global display, clock, wave_font, bullet_pool
+    if display is not None:
+        return
+    if HEADLESS:
+        os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+        os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+    # Starts up pygame
+    pygame.init()
+    warnings.filterwarnings("ignore", category=UserWarning, module="PIL.PngImagePlugin")
+    wave_font = pygame.font.Font(None, 36)
+    # Screen setup and window caption
+    display = pygame.display.set_mode(screen_size)
+    pygame.display.set_caption("2D shooter")
+    clock = pygame.time.Clock()
+    preload_screen("main_menu")  # The .ttf is read on io_worker while the images load
+    load_assets()
+    if isinstance(bullet_group, BulletGroup):
+        bullet_pool = BulletPool()  # ProjectileStore needs no Bullet sprites
 
-# --- Main Game Loop ---
-game_running = True
-while game_running:
-    pygame.mouse.set_visible(False)
-    dt = clock.tick(FPS) / 1000  # Delta time in seconds
-    cursor = pygame.mouse.get_pos()
-
-    handle_player_input(player, bullet_group, camera)
-    player.gun.update()
-    camera.move_bg()
-    game_sprites.update(dt, cursor)
-    bullet_group.update(dt)
+# Menu font sizes each screen uses; preload_screen() reads their .ttf ahead of time
+SCREEN_FONTS = {
+    "main_menu": (100, 60),
+    "game_over": (100, 40),
+}
 
-    # Draw bullets and the crosshair
-    for b in bullet_group:
-        display.blit(b.image, b.rect.topleft - camera.offset)
-    display.blit(
-        crosshair,
-        (cursor[0] - crosshair.get_width() // 2,
-         cursor[1] - crosshair.get_height() // 2)
-    )
+def preload_screen(name):
+    """
+    Reads the .ttf file a screen needs on io_worker, so showing it
+    doesn't wait on the disk. The Fonts themselves are built on
+    the main thread the first time the screen asks for them.
+    """
+    if SCREEN_FONTS[name]:
+        assets.preload_font(MENU_FONT)
+
+startup_ms = None  # Launch to first interactive frame, set by startup_done()
+STARTUP_EXIT = False  # Quit at the first interactive frame (--startup)
+
+def startup_done():
+    """
+    Called when a frame the player can interact with is on screen.
+    Records how long that took after launch the first time, printing
+    it with --startup or --profile (and exiting there with --startup,
+    for bench.py --startup).
+    """
+    global startup_ms
+    if startup_ms is not None:
+        return
+    startup_ms = (time.perf_counter() - LAUNCH_TIME) * 1000
+    if STARTUP_EXIT or profiler.reports:
+        print(f"Startup: {startup_ms:.0f} ms from launch to first interactive frame")
+    if STARTUP_EXIT:
+        pygame.quit()
+        sys.exit()
+
+spawner = None  # Wave state, set up by new_game()
+swarm = None   # NumPy enemy engine when SWARM_MODE is on
+camera = None  # Set up by new_game()
+hud = None     # Set up by new_game()
+player = None  # Set up by new_game()
+players = []   # Everyone in the game; player is players[0]
+next_enemy_id = 1  # Network id of the next enemy spawned
+game_running = False
+
+def new_game(seed=None, rules=None, swarm_mode=None, swarm_workers=None):
+    """
+    Resets every piece of game state for a fresh run: enemies,
+    bullets, grids, clock, score, waves and the player.
+    seed: seeds random so the run can be repeated exactly
+    rules: wave rules to play with instead of WAVE_RULES
+    swarm_mode: run enemies on the NumPy swarm engine
+    swarm_workers: shard the swarm over this many processes (implies
+    swarm_mode). Leave both as None to keep the last game's engine.
+    """
+    global swarm, camera, hud, player, players, game_running, spawner, score, next_enemy_id
+    global SWARM_MODE, SWARM_WORKERS
+    if swarm_mode is not None or swarm_workers is not None:
+        SWARM_WORKERS = swarm_workers or 0
+        SWARM_MODE = bool(swarm_mode) or SWARM_WORKERS > 0
+    if SWARM_MODE and np is None:
+        sys.exit("--swarm needs NumPy (pip install numpy)")
+    init()
+    if seed is None and recorder is not None:
+        seed = random.randrange(2 ** 32)  # Any seed, as long as it's logged
+    if seed is not None:
+        random.seed(seed)
+    clear_enemies()
+    bullet_group.clear()
+    enemy_grid.clear()
+    bullet_grid.clear()
+    sim_clock.reset()
+    effects.clear()
+    sharded = isinstance(swarm, ShardedSwarm) and swarm.workers == SWARM_WORKERS
+    if swarm is not None and not sharded:
+        swarm.close()
+    if SWARM_WORKERS:
+        if not sharded:
+            swarm = ShardedSwarm(SWARM_WORKERS)  # Workers are kept from game to game
+    else:
+        swarm = EnemySwarm() if SWARM_MODE else None
+    score = 0
+    next_enemy_id = 1
+    spawner = WaveSpawner(rules or WAVE_RULES)
+    camera = Camera()               # Initialize camera
+    hud = Hud()                     # Health/wave/ammo overlay
+    player = Player()               # Create player instance
+    players = [player]
+    flow_field.reset(player.pos)    # Paths toward the player
+    spawner.start_wave(1)           # Queue the first wave
+    game_running = True
+    if recorder is not None:
+        recorder.start(seed, spawner.rules)
+
+def add_player():
+    """
+    Adds another player to the running game (co-op), a little to
+    the right of the last one, in the next skin. Returns it.
+    """
+    last = players[-1]
+    new = Player((last.pos.x + 100, last.pos.y), (last.skin + 1) % player_looks.skins)
+    players.append(new)
+    flow_field.reset(*(p.pos for p in living_players()))
+    return new
+
+# --- Profiler ---
+class FrameProfiler:
+    """
+    Times each phase of a frame (input, collision, sprites, bullets,
+    damage, waves, camera, hud, display), counts entities and net allocated memory
+    blocks, and can show a rolling frame-time graph (F3) or write
+    every frame to a CSV/JSON trace. When it's off, every hook is a
+    single attribute check.
+    """
+    def __init__(self, history=240):
+        self.enabled = False     # Collecting timings at all
+        self.overlay = False     # Drawing the on-screen graph
+        self.trace_path = None   # Where to write records at the end
+        self.reports = False     # Print every system's report when a game ends
+        self.history = deque(maxlen=history)  # Recent frame records
+        self.records = []        # Every frame, when tracing
+        self.frame = 0
+        self.font = None
+
+    def toggle_overlay(self):
+        """
+        Shows/hides the overlay, starting from the next frame.
+        """
+        self.overlay = not self.overlay
+
+    def begin_frame(self):
+        self.enabled = self.overlay or self.trace_path is not None
+        if not self.enabled:
+            return
+        self.phases = {}
+        self.start = self.last = time.perf_counter()
+        self.blocks = sys.getallocatedblocks()
+
+    def mark(self, phase):
+        """
+        Charges the time since the previous mark to phase.
+        Marks from several sim ticks in one frame add up.
+        """
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.0) + now - self.last
+        self.last = now
+
+    def end_frame(self, ticks=1):
+        """
+        Closes the frame and records its timings and counts.
+        ticks: sim ticks run during this frame
+        """
+        if not self.enabled:
+            return
+        record = {
+            "frame": self.frame,
+            "ticks": ticks,
+            "total_ms": (time.perf_counter() - self.start) * 1000,
+        }
+        for phase, seconds in self.phases.items():
+            record[phase + "_ms"] = seconds * 1000
+        record["enemies"] = enemy_count()
+        record["bullets"] = len(bullet_group)
+        record["drawn"] = camera.drawn
+        record["culled"] = camera.culled
+        record["effects"] = camera.effects_drawn
+        record["alloc_blocks"] = sys.getallocatedblocks() - self.blocks
+        self.frame += 1
+        self.history.append(record)
+        if self.trace_path is not None:
+            self.records.append(record)
+
+    def draw(self, surface):
+        """
+        Draws the overlay: a bar per recent frame (green under one
+        100 FPS frame, red over) plus the latest phase breakdown.
+        """
+        if not self.overlay or not self.history:
+            return
+        if self.font is None:
+            self.font = pygame.font.Font(None, 20)
+        width, height = 240, 80
+        panel = pygame.Rect(SCREEN_WIDTH - width - 10, 10, width, height + 180)
+        surface.fill((0, 0, 0), panel)
+        budget = 1000 / FPS
+        for i, record in enumerate(self.history):
+            ms = record["total_ms"]
+            bar = min(height, int(ms / (budget * 2) * height))
+            color = (0, 200, 0) if ms <= budget else (220, 0, 0)
+            x = panel.x + i * width // self.history.maxlen
+            pygame.draw.line(surface, color, (x, panel.y + height), (x, panel.y + height - bar))
+        y_budget = panel.y + height // 2
+        pygame.draw.line(surface, (200, 200, 200), (panel.x, y_budget), (panel.right, y_budget))
+        last = self.history[-1]
+        lines = [f"frame {last['total_ms']:.2f} ms  ticks {last['ticks']}"]
+        lines += [f"{k[:-3]}: {v:.2f} ms" for k, v in last.items()
+                  if k.endswith("_ms") and k != "total_ms"]
+        lines.append(f"enemies {last['enemies']}  bullets {last['bullets']}  "
+                     f"effects {last['effects']}")
+        lines.append(f"drawn {last['drawn']}  culled {last['culled']}  blocks {last['alloc_blocks']:+d}")
+        for i, line in enumerate(lines):
+            text = self.font.render(line, True, (255, 255, 255))
+            surface.blit(text, (panel.x + 4, panel.y + height + 4 + i * 14))
+
+    def export(self, path=None):
+        """
+        Writes every recorded frame to path (.json or .csv).
+        """
+        path = path or self.trace_path
+        if path is None or not self.records:
+            return
+        if path.endswith(".json"):
+            with open(path, "w") as f:
+                json.dump(self.records, f)
+            return
+        fields = []
+        for record in self.records:
+            fields += [k for k in record if k not in fields]
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=fields, restval=0)
+            writer.writeheader()
+            writer.writerows(self.records)
+
+profiler = FrameProfiler()
+
+# --- Simulation Step ---
+def simulate_tick(controls):
+    """
+    Advances the game by exactly one fixed SIM_DT step: input,
+    movement, collisions, damage and wave progression. Nothing
+    here draws, and all timing comes from sim_clock.
+    controls: this tick's Controls, or a list with one per player
+    in co-op (players who are down sit still)
+    """
+    global game_running, score
+    inputs = controls if isinstance(controls, list) else [controls]
+    if recorder is not None:
+        recorder.record(inputs[0])
+    alive = [(p, c) for p, c in zip(players, inputs) if p.health > 0]
+    for p, c in alive:
+        handle_player_input(p, bullet_group, c)
+        p.gun.update()
+    profiler.mark("input")
+    # Handle bullet hits on enemies and update score
+    score += bullet_group.hit_enemies()
+    profiler.mark("collision")
+    flow_field.update(*(p.pos for p, _ in alive))
+    for p, c in alive:
+        p.update(SIM_DT, c)
+    enemies.update(SIM_DT, None)
+    if swarm is not None:
+        swarm.update(SIM_DT, [tuple(p.pos) for p, _ in alive])
+    profiler.mark("sprites")
+    bullet_group.update(SIM_DT)
+    profiler.mark("bullets")
 
     # Player damage and invincibility logic
-    hits = pygame.sprite.spritecollide(player, enemies, False)
-    now = pygame.time.get_ticks()
-    if hits and not player.invincible:
-        player.health -= 10
-        player.invincible = True
-        player.last_hit_time = now
-        if player.health <= 0:
-            game_running = False
-    if player.invincible and now - player.last_hit_time >= player.invincibility_duration:
-        player.invincible = False
-
-    # Draw the player's health bar
-    draw_health_bar(display, 20, 20, 200, 20, player.health, player.max_health)
-
-    # Wave progression check
-    if len(enemies) == 0:
-        if wave_clear_time is None:
-            wave_clear_time = pygame.time.get_ticks()
-        elif pygame.time.get_ticks() - wave_clear_time >= 5000:
-            wave_number += 1
-            current_wave_count = math.ceil(current_wave_count * 1.5)
-            spawn_wave(current_wave_count)
-            wave_clear_time = None
-
-    # Draw wave counter on screen
-    wave_text = wave_font.render(f"Wave: {wave_number}", True, (255, 255, 255))
-    display.blit(wave_text, (20, 50))
+    now = sim_clock.now()
+    for p, _ in alive:
+        if swarm is not None:
+            hits = swarm.touching(p.rect)
+        else:
+            hits = enemy_grid.collide(p.rect)
+        if hits and not p.invincible:
+            p.health -= 10
+            p.invincible = True
+            p.last_hit_time = now
+        if p.invincible and now - p.last_hit_time >= p.invincibility_duration:
+            p.invincible = False
+    if not living_players():
+        game_running = False
+    profiler.mark("damage")
 
+    # Stream in enemies, next wave; co-op spawns take turns around each player
+    standing = living_players() or players
+    spawner.update(now, standing[sim_clock.ticks % len(standing)].pos)
+    if recorder is not None:
+        recorder.wave(spawner.wave)
+
+    for c in inputs:
+        c.consume()
+    sim_clock.advance()
+    profiler.mark("waves")
+
+def render_frame(cursor, alpha):
+    """
+    Draws the current game state, blending positions between
+    the last two sim ticks by alpha (0..1).
+    """
+    camera.move_bg(alpha)
+    # Draw bullets and the crosshair
+    camera.draw_overlay(cursor)
+    profiler.mark("camera")
+
+    # Health bar, wave counter and ammo
+    hud.draw(display)
+    profiler.draw(display)
+    profiler.mark("hud")
+
+    # The view scrolls every frame, so the whole screen is dirty
     pygame.display.update()
+    profiler.mark("display")
+
+# --- Main Game Loop ---
+def run_game():
+    """
+    Runs the game in the window: main menu, then one game after
+    another, with the game over screen in between, until the
+    player quits. REPLAY starts the next game in this process.
+    """
+    init()
+    main_menu()                     # Show main menu first
+    while True:
+        play_game()
+        game_over_menu()            # Returns when REPLAY is clicked
+
+def play_game():
+    """
+    Plays one game until the player dies.
+    The sim runs in fixed SIM_DT steps; rendering runs as fast as
+    FPS allows and draws whatever fraction of a tick is left over.
+    """
+    new_game()
+    input_dispatcher.reset()
+    preload_screen("game_over")
+    accumulator = 0.0  # Real seconds not yet simulated
+    while game_running:
+        pygame.mouse.set_visible(False)
+        accumulator += clock.tick(FPS) / 1000 * SIM_SPEED
+        profiler.begin_frame()
+        controls = input_dispatcher.poll()
+        profiler.mark("input")
+
+        steps = 0
+        while accumulator >= SIM_DT and steps < MAX_SIM_STEPS and game_running:
+            simulate_tick(controls)
+            accumulator -= SIM_DT
+            steps += 1
+        if steps == MAX_SIM_STEPS:
+            # Too far behind: drop the backlog instead of spiralling
+            accumulator = min(accumulator, SIM_DT)
+
+        render_frame(controls.cursor, accumulator / SIM_DT)
+        profiler.end_frame(steps)
+
+    # After the game loop ends, save the run and show game over screen
+    if scores is not None:
+        scores.save(run_stats())
+    profiler.export()
+    if recorder is not None:
+        recorder.close()
+    if profiler.reports:
+        print_reports()
+
+def print_reports():
+    """
+    Prints what every cache, pool and system did this game
+    (with --profile).
+    """
+    print(assets.report())
+    print(bullet_group.report())
+    print(player_looks.report())
+    print(enemy_atlas.report())
+    print(effects.report())
+    print(text_cache.report())
+    print(tile_map.report())
+    print(flow_field.report())
+    if SWARM_WORKERS:
+        print(swarm.report())
+    print(spawner.report())
+    print(io_worker.report())
+
+def run_stats():
+    """
+    The row ScoreStore saves for the game that just ended.
+    """
+    return {
+        "ended": time.time(),
+        "score": score,
+        "wave": spawner.wave,
+        "seconds": sim_clock.ticks / SIM_HZ,
+        "engine": "sprites" if swarm is None else "sharded" if SWARM_WORKERS else "swarm",
+        "map": f"{MAP_WIDTH}x{MAP_HEIGHT}",
+    }
+
+# --- Headless Mode ---
+def scripted_controls(tick):
+    """
+    A fixed, state-free input script for headless runs: walks a
+    square, sweeps the aim in a circle, fires every other tick and
+    reloads every 3 seconds. Same tick always gives same Controls.
+    """
+    leg = (tick // 150) % 4  # Which side of the square we're walking
+    angle = math.radians(tick * 3)
+    cursor = (SCREEN_WIDTH / 2 + 200 * math.cos(angle),
+              SCREEN_HEIGHT / 2 + 200 * math.sin(angle))
+    return Controls(
+        up=leg == 0, right=leg == 1, down=leg == 2, left=leg == 3,
+        cursor=cursor,
+        fire=tick % 2 == 0,
+        reload=tick % 300 == 299,
+    )
+
+def run_headless(ticks, seed=0, script=scripted_controls, render=False, on_tick=None):
+    """
+    Runs one game without a human: controls come from script(tick)
+    and random is seeded, so the same arguments replay the same
+    game. Doesn't wait on the clock, so it runs as fast as it can.
+    render: also draw every tick (to the dummy display when headless)
+    on_tick: optional callback(tick) after each tick, for benchmarks
+    Returns the number of ticks actually run (fewer if the player died).
+    """
+    if player is None:
+        new_game(seed)
+    tick = 0
+    while tick < ticks and game_running:
+        profiler.begin_frame()
+        controls = script(tick)
+        simulate_tick(controls)
+        if render:
+            render_frame(controls.cursor, 1.0)
+        profiler.end_frame()
+        tick += 1
+        if on_tick is not None:
+            on_tick(tick)
+    return tick
+
+# --- Recording & Replay ---
+RECORDING_MAGIC = b"PEST"
+RECORDING_VERSION = 2  # 2: weapon records are one-shot switches
+# File header: magic, version, seed, sim Hz, map size, engine (0 sprites,
+# 1 swarm, 1 + N swarm on N workers),
+# then the wave rules as JSON (length first)
+RECORDING_HEADER = struct.Struct("<4sBIHIIBH")
+CURSOR_DELTA = struct.Struct("<hh")
+WAVE_NUMBER = struct.Struct("<H")
+# First byte of each record: the top two bits say what it is
+TICK = 0x00          # One tick: bits 0-3 WASD, bit 4 fire, bit 5 reload
+TICK_CURSOR = 0x40   # Same, followed by the cursor's (dx, dy) since last time
+REPEAT = 0x80        # 1-64 ticks (low 6 bits + 1) of held keys, no clicks
+META = 0xC0          # Not a tick: low bits pick one of the kinds below
+META_WEAPON, META_QUIT, META_WAVE = 0, 1, 2
 
-# After the game loop ends, show game over screen
-game_over_menu()
+class InputRecorder:
+    """
+    Writes every sim tick's Controls to a small binary log, along
+    with the seed and rules the game started with and the tick
+    each wave began on. A tick is one byte, plus a cursor delta
+    when the mouse moved, and runs of idle ticks collapse into a
+    single REPEAT byte, so a long session stays a few hundred KB.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.data = bytearray()
+
+    def start(self, seed, rules):
+        """
+        Starts a fresh log for a new game.
+        """
+        rules_json = json.dumps(rules).encode()
+        self.data = bytearray(RECORDING_HEADER.pack(
+            RECORDING_MAGIC, RECORDING_VERSION, seed, SIM_HZ,
+            MAP_WIDTH, MAP_HEIGHT, SWARM_MODE + SWARM_WORKERS, len(rules_json)))
+        self.data += rules_json
+        self.cursor = SCREEN_CENTER
+        self.keys = 0
+        self.wave_number = spawner.wave
+        self.repeat = 0
+        self.ticks = 0
+
+    def _flush_repeat(self):
+        while self.repeat:
+            run = min(self.repeat, 64)
+            self.data.append(REPEAT | (run - 1))
+            self.repeat -= run
+
+    def _meta(self, kind, payload=b""):
+        self._flush_repeat()
+        self.data.append(META | kind)
+        self.data += payload
+
+    def record(self, controls):
+        """
+        Adds one tick. The cursor is rounded to whole pixels first
+        (in controls too), so the live game and its replay aim
+        exactly the same way.
+        """
+        cursor = (round(controls.cursor[0]), round(controls.cursor[1]))
+        controls.cursor = cursor
+        if controls.weapon is not None:
+            self._meta(META_WEAPON, bytes([controls.weapon]))
+        if controls.quit:
+            self._meta(META_QUIT)
+            self.close()  # The game exits right after this tick
+            return
+        keys = (controls.up | controls.left << 1 | controls.down << 2 |
+                controls.right << 3 | controls.fire << 4 | controls.reload << 5)
+        self.ticks += 1
+        if keys == self.keys and cursor == self.cursor:
+            self.repeat += 1
+            return
+        self._flush_repeat()
+        if cursor == self.cursor:
+            self.data.append(TICK | keys)
+        else:
+            self.data.append(TICK_CURSOR | keys)
+            self.data += CURSOR_DELTA.pack(cursor[0] - self.cursor[0], cursor[1] - self.cursor[1])
+            self.cursor = cursor
+        self.keys = keys & 0x0F  # Clicks never carry over to the next tick
+
+    def wave(self, number):
+        """
+        Notes the wave number after each tick; logs it when it changes.
+        """
+        if number != self.wave_number:
+            self.wave_number = number
+            self._meta(META_WAVE, WAVE_NUMBER.pack(number))
+
+    def close(self):
+        """
+        Hands the log to io_worker to write to disk.
+        """
+        self._flush_repeat()
+        io_worker.submit(write_file, self.path, bytes(self.data))
+        print(f"Recorded {self.ticks} ticks to {self.path} ({len(self.data)} bytes)")
+
+class InputLog:
+    """
+    Reads a log written by InputRecorder. ticks() rebuilds the
+    Controls tick by tick; waves collects (tick, wave number)
+    pairs as they are read, to check a replay against.
+    """
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.data = f.read()
+        (magic, version, self.seed, self.hz, self.map_width, self.map_height,
+         self.swarm, rules_len) = RECORDING_HEADER.unpack_from(self.data)
+        if magic != RECORDING_MAGIC or version != RECORDING_VERSION:
+            raise ValueError(f"{path} is not a version {RECORDING_VERSION} recording")
+        start = RECORDING_HEADER.size
+        self.rules = json.loads(self.data[start:start + rules_len])
+        self.offset = start + rules_len
+        self.waves = []
+
+    def check(self):
+        """
+        Exits with a message if this game is set up differently
+        from the recorded one (the replay would drift otherwise).
+        """
+        if self.hz != SIM_HZ:
+            sys.exit(f"Recorded at {self.hz} Hz, this build runs at {SIM_HZ} Hz")
+        if (self.map_width, self.map_height) != (MAP_WIDTH, MAP_HEIGHT):
+            sys.exit(f"Recorded on a {self.map_width}x{self.map_height} map, "
+                     f"run with --map={self.map_width}x{self.map_height}")
+        if bool(self.swarm) != SWARM_MODE:
+            sys.exit("Recorded " + ("with" if self.swarm else "without") + " --swarm")
+        if max(self.swarm - 1, 0) != SWARM_WORKERS:
+            sys.exit(f"Recorded with --swarm-workers={self.swarm - 1}" if self.swarm > 1
+                     else "Recorded without --swarm-workers")
+
+    def ticks(self):
+        """
+        Yields one Controls per recorded tick. Stops at the end
+        of the log or where the player closed the window.
+        """
+        data, i = self.data, self.offset
+        cursor, keys, weapon = SCREEN_CENTER, 0, None
+        tick = 0
+        while i < len(data):
+            byte = data[i]
+            i += 1
+            kind = byte & 0xC0
+            if kind == META:
+                meta = byte & 0x3F
+                if meta == META_WEAPON:
+                    weapon = data[i]  # Applies to the next tick only
+                    i += 1
+                elif meta == META_QUIT:
+                    return
+                elif meta == META_WAVE:
+                    self.waves.append((tick, WAVE_NUMBER.unpack_from(data, i)[0]))
+                    i += WAVE_NUMBER.size
+                continue
+            if kind == REPEAT:
+                count = (byte & 0x3F) + 1
+                keys &= 0x0F
+            else:
+                count = 1
+                keys = byte & 0x3F
+                if kind == TICK_CURSOR:
+                    dx, dy = CURSOR_DELTA.unpack_from(data, i)
+                    i += CURSOR_DELTA.size
+                    cursor = (cursor[0] + dx, cursor[1] + dy)
+            for _ in range(count):
+                tick += 1
+                yield Controls(up=bool(keys & 1), left=bool(keys & 2),
+                               down=bool(keys & 4), right=bool(keys & 8),
+                               cursor=cursor, fire=bool(keys & 16),
+                               reload=bool(keys & 32), weapon=weapon)
+                weapon = None
+
+recorder = None  # InputRecorder when started with --record=path
+
+def run_replay(path, realtime=False, render=False):
+    """
+    Plays a recorded game back from its log. By default it runs
+    as fast as the CPU allows (add render=True to draw too);
+    realtime=True shows it in the window at normal speed instead.
+    Prints whether every wave started on the same tick as in
+    the recording.
+    """
+    log = InputLog(path)
+    log.check()
+    new_game(log.seed, log.rules)
+    ticks = log.ticks()
+    waves = []  # (tick, wave) seen in this replay
+    tick = 0
+    accumulator = 0.0
+    start = time.perf_counter()
+    controls = Controls()
+    while game_running:
+        if realtime:
+            accumulator += clock.tick(FPS) / 1000 * SIM_SPEED
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    return
+                if event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                    profiler.toggle_overlay()
+            steps = min(int(accumulator / SIM_DT), MAX_SIM_STEPS)
+            accumulator = min(accumulator - steps * SIM_DT, SIM_DT)
+        else:
+            steps = 1
+        profiler.begin_frame()
+        for _ in range(steps):
+            controls = next(ticks, None)
+            if controls is None or not game_running:
+                break
+            wave = spawner.wave
+            simulate_tick(controls)
+            tick += 1
+            if spawner.wave != wave:
+                waves.append((tick, spawner.wave))
+        if controls is None:
+            break
+        if realtime or render:
+            render_frame(controls.cursor, accumulator / SIM_DT if realtime else 1.0)
+        profiler.end_frame(steps)
+    elapsed = time.perf_counter() - start
+    profiler.export()
+    print(f"Replayed {tick} ticks in {elapsed:.2f} s ({tick / elapsed:.0f} ticks/s): "
+          f"wave {spawner.wave}, score {score}")
+    if waves == log.waves:
+        print(f"Matches the recording ({len(waves)} wave starts)")
+    else:
+        for mine, theirs in zip(waves + [None] * len(log.waves), log.waves + [None] * len(waves)):
+            if mine != theirs:
+                print(f"Replay drifted: recording has wave start {theirs}, replay has {mine}")
+                break
+
+def main():
+    """
+    Reads every command line flag and runs the game, a headless run
+    or a replay. Flags are only read here, so bench.py, batch.py and
+    coop.py can import this module without it picking up theirs.
+    """
+    global recorder, SWARM_MODE, SWARM_WORKERS, HEADLESS, SIM_SPEED, PLAYER_SKIN
+    global STARTUP_EXIT, scores
+    replay_path = None
+    for arg in sys.argv:
+        value = arg.split("=", 1)[-1]
+        if arg.startswith("--wave-rules="):
+            with open(value) as f:
+                WAVE_RULES.update(json.load(f))
+        elif arg.startswith("--swarm-workers="):
+            SWARM_WORKERS = int(value)
+        elif arg.startswith("--replay="):
+            replay_path = value
+        elif arg.startswith("--map="):
+            set_map(*(int(v) for v in value.split("x")))
+        elif arg.startswith("--speed="):
+            SIM_SPEED = float(value)
+        elif arg.startswith("--stats="):
+            scores = ScoreStore(value)
+        elif arg == "--no-stats":
+            scores = None
+        elif arg.startswith("--asset-cache="):
+            assets.cache_dir = value
+        elif arg == "--no-asset-cache":
+            assets.cache_dir = None
+        elif arg.startswith("--skin="):
+            PLAYER_SKIN = int(value)
+        elif arg == "--profile":
+            # Overlay from the start, and every system's report after each game
+            profiler.toggle_overlay()
+            profiler.reports = True
+        elif arg.startswith("--trace="):
+            profiler.trace_path = value
+        elif arg == "--startup":
+            STARTUP_EXIT = True
+    SWARM_MODE = "--swarm" in sys.argv or SWARM_WORKERS > 0
+    HEADLESS = "--headless" in sys.argv or bool(replay_path and "--realtime" not in sys.argv)
+    if replay_path:
+        run_replay(replay_path, realtime="--realtime" in sys.argv,
+                   render="--render" in sys.argv)
+        return
+    for arg in sys.argv:
+        if arg.startswith("--record="):
+            recorder = InputRecorder(arg.split("=", 1)[1])
+    if "--headless" in sys.argv:
+        new_game(seed=0)
+        ticks = run_headless(SIM_HZ * 60)
+        profiler.export()
+        if recorder is not None:
+            recorder.close()
+        print(f"Headless run: {ticks} ticks, wave {spawner.wave}, score {score}")
+        return
+    run_game()
 
+if __name__ == "__main__":
+    main()